@@ -1,3 +1,19 @@
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
+from .authentication import deactivate_users
 
-# Register your models here.
+
+@admin.action(description="Deactivate selected users", permissions=["change"])
+def deactivate_selected(modeladmin, request, queryset):
+    deactivated = deactivate_users(queryset)
+    modeladmin.message_user(request, f"Deactivated {deactivated} users.")
+
+
+# Bulk deactivation goes through deactivate_users, which also drops the users from the auth cache
+class CachedUserAdmin(UserAdmin):
+    actions = [deactivate_selected]
+
+
+admin.site.unregister(User)
+admin.site.register(User, CachedUserAdmin)
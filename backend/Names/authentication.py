@@ -1,9 +1,74 @@
+import copy
+import time
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from core.caching import TTLCache
 
-class CookieJWTAuthentication(JWTAuthentication):
+# (user id, token jti) -> User, so constantly polled endpoints skip the user query.
+# Saving or deleting a user drops its entries in this process. Anything else (other
+# processes, queryset.update()) shows up within AUTH_USER_CACHE_TTL seconds; to
+# deactivate many users at once without waiting, use deactivate_users().
+user_cache = TTLCache(settings.AUTH_USER_CACHE_SIZE)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    Bearer-token authentication that remembers which user each token resolved to.
+    """
+
+    def get_user(self, validated_token):
+        key = (str(validated_token.get(api_settings.USER_ID_CLAIM)), validated_token.get(api_settings.JTI_CLAIM))
+        user = user_cache.get(key)
+        if user is None:
+            user = super().get_user(validated_token)
+            # Never keep a user around for longer than the token is valid
+            ttl = min(settings.AUTH_USER_CACHE_TTL, validated_token["exp"] - time.time())
+            if ttl > 0:
+                user_cache.set(key, user, ttl)
+        # Each request gets its own copy, so changes a view makes to request.user stay out of the cache
+        return copy.copy(user)
+
+
+class CookieJWTAuthentication(CachedJWTAuthentication):
     def authenticate(self, request):
         access_token = request.COOKIES.get("access_token")
         if not access_token:
             return None
         validated_token = self.get_validated_token(access_token)
         return self.get_user(validated_token), validated_token
+
+
+def forget_user(user_id) -> None:
+    forget_users([user_id])
+
+
+def forget_users(user_ids) -> None:
+    user_ids = {str(user_id) for user_id in user_ids}
+    user_cache.pop_where(lambda key: key[0] in user_ids)
+
+
+def deactivate_users(queryset) -> int:
+    """
+    Deactivates the users in `queryset` with one UPDATE, which sends no
+    post_save, and drops them from this process's cache. Returns the number deactivated.
+    """
+    user_ids = list(queryset.values_list("pk", flat=True))
+    deactivated = queryset.model.objects.filter(pk__in=user_ids).update(is_active=False)
+    forget_users(user_ids)
+    return deactivated
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login; any other save may change the password or is_active
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    forget_user(instance.pk)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleted(sender, instance, **kwargs):
+    forget_user(instance.pk)
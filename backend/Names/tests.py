@@ -1,3 +1,78 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from .authentication import deactivate_users, user_cache
+
+
+class CachedUserAuthenticationTests(TestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(username="alice", email="alice@example.com", password="pw")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def test_repeat_requests_skip_the_user_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get("/api/profile/").data["username"], "alice")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/api/profile/").data["username"], "alice")
+        self.assertEqual(user_cache.stats()["hit_rate"], 0.5)
+
+    def test_cookie_and_header_tokens_share_the_cache(self):
+        token = str(AccessToken.for_user(self.user))
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.client.get("/api/profile/")
+        self.client.credentials()
+        self.client.cookies["access_token"] = token
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/api/profile/").status_code, 200)
+
+    def test_deactivation_revokes_cached_user(self):
+        self.client.get("/api/profile/")
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/profile/").status_code, 401)
+
+    def test_bulk_deactivation_revokes_cached_users(self):
+        self.client.get("/api/profile/")
+        self.assertEqual(deactivate_users(User.objects.filter(username="alice")), 1)
+        self.assertEqual(self.client.get("/api/profile/").status_code, 401)
+
+    def test_admin_bulk_deactivation_revokes_cached_users(self):
+        self.client.get("/api/profile/")
+        admin = APIClient()
+        admin.force_login(User.objects.create_superuser(username="root", password="pw"))
+        admin.post("/admin/auth/user/", {"action": "deactivate_selected", "_selected_action": [self.user.id]})
+        self.assertFalse(User.objects.get(id=self.user.id).is_active)
+        self.assertEqual(self.client.get("/api/profile/").status_code, 401)
+
+    def test_password_change_drops_cached_user(self):
+        self.client.get("/api/profile/")
+        self.user.set_password("new")
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.client.get("/api/profile/")
+
+    def test_login_timestamp_keeps_cached_user(self):
+        self.client.get("/api/profile/")
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=["last_login"])
+        with self.assertNumQueries(0):
+            self.client.get("/api/profile/")
+
+    def test_views_cannot_change_the_cached_user(self):
+        first = self.client.get("/api/profile/").wsgi_request.user
+        first.username = "mallory"
+        self.assertEqual(self.client.get("/api/profile/").data["username"], "alice")
+
+    def test_stats_are_for_admins_only(self):
+        self.assertEqual(self.client.get("/api/auth-cache/").status_code, 403)
+        User.objects.filter(id=self.user.id).update(is_staff=True)
+        user_cache.clear()
+        response = self.client.get("/api/auth-cache/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {"size", "max_entries", "hits", "misses", "evictions", "hit_rate"})
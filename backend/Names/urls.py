@@ -1,6 +1,7 @@
 from django.urls import path
-from .views import register_view,profile
+from .views import register_view,profile,auth_cache_stats
 
 urlpatterns = [
     path('profile/',profile,name='profile'),
+    path('auth-cache/',auth_cache_stats,name='auth_cache_stats'),
 ]
\ No newline at end of file
@@ -1,7 +1,7 @@
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken, TokenError
 from django.core.mail import send_mail
@@ -13,6 +13,7 @@ from django.contrib.auth import get_user_model
 from django.conf import settings
 from rest_framework_simplejwt.views import TokenRefreshView
 from django.contrib.auth import authenticate, login, logout
+from .authentication import user_cache
 
 
 
@@ -86,6 +87,13 @@ def profile(request):
     })
 
 
+# Hit rate of the authenticated-user cache
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def auth_cache_stats(request):
+    return Response(user_cache.stats())
+
+
 
 class TokenBlacklistView(APIView):
     permission_classes = [IsAuthenticated]
@@ -11,6 +11,9 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+import supabase_client
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cloudstorage.settings')
 
-application = get_asgi_application()
+# Lifespan events give the serving loop its Supabase connection pool (see supabase_client)
+application = supabase_client.lifespan(get_asgi_application())
@@ -15,7 +15,6 @@ from datetime import timedelta
 import os
 from dotenv import load_dotenv
 # from dotenv import dotenv_values
-from supabase import create_client, Client
 
 
 load_dotenv()
@@ -64,6 +63,7 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'core.metrics.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -106,9 +106,29 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD", "mypassword"),
         "HOST": "db",   # must be the service name, not localhost
         "PORT": 5432,
+        # Keep each thread's connection open between requests, checking it
+        # before reuse instead of failing the first request after an outage.
+        # Not under ASGI, where requests hop between threads and a kept
+        # connection is never closed: there it is 0 (serve --asgi enforces it)
+        "CONN_MAX_AGE": int(os.getenv("CONN_MAX_AGE", 0 if os.getenv("SERVE_ASGI") == "True" else 60)),
+        "CONN_HEALTH_CHECKS": os.getenv("CONN_HEALTH_CHECKS", "True") == "True",
     }
 }
 
+# Application server (manage.py serve): workers default to 2 per CPU plus one
+# (one per CPU under ASGI), kept to at most SERVE_DB_CONNECTIONS workers x
+# threads; each worker is replaced after about SERVE_MAX_REQUESTS requests
+SERVE_BIND = os.getenv("SERVE_BIND", "0.0.0.0:8000")
+SERVE_ASGI = os.getenv("SERVE_ASGI", "False") == "True"
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", 0))
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", 4))
+SERVE_DB_CONNECTIONS = int(os.getenv("SERVE_DB_CONNECTIONS", 80))
+SERVE_MAX_REQUESTS = int(os.getenv("SERVE_MAX_REQUESTS", 1000))
+SERVE_TIMEOUT = int(os.getenv("SERVE_TIMEOUT", 60))
+SERVE_GRACEFUL_TIMEOUT = int(os.getenv("SERVE_GRACEFUL_TIMEOUT", 30))
+SERVE_KEEPALIVE = int(os.getenv("SERVE_KEEPALIVE", 5))
+SERVE_ACCESS_LOG = os.getenv("SERVE_ACCESS_LOG", "True") == "True"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -155,15 +175,118 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL='/media/'
 MEDIA_ROOT=os.path.join(BASE_DIR,'media')
 
+# Where file contents are stored: "core.storage.SupabaseStorage" or "core.storage.LocalStorage"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "core.storage.SupabaseStorage")
+LOCAL_STORAGE_ROOT = os.getenv("LOCAL_STORAGE_ROOT", os.path.join(MEDIA_ROOT, "uploads"))
+LOCAL_STORAGE_URL = os.getenv("LOCAL_STORAGE_URL", MEDIA_URL + "uploads/")
+
+# Hash uploads while they are received so duplicates can share one stored object
+FILE_UPLOAD_HANDLERS = [
+    "core.uploadhandlers.HashingMemoryFileUploadHandler",
+    "core.uploadhandlers.HashingTemporaryFileUploadHandler",
+]
+
+# Uploads are streamed to storage in chunks of this many bytes
+STORAGE_UPLOAD_CHUNK_SIZE = int(os.getenv("STORAGE_UPLOAD_CHUNK_SIZE", 1024 * 1024))
+
+# Bytes each new user may store; 0 means no limit. Per-user overrides live on StorageUsage.quota
+STORAGE_DEFAULT_QUOTA = int(os.getenv("STORAGE_DEFAULT_QUOTA", 10 * 1024 ** 3))
+
+# Deleted files stay visible to the changes feed for this long; sync cursors
+# older than the pruned tombstones must resync from scratch
+FILE_TOMBSTONE_RETENTION_DAYS = int(os.getenv("FILE_TOMBSTONE_RETENTION_DAYS", 30))
+
+# Batch uploads: files per request, and how many are sent to storage at once
+UPLOAD_BATCH_MAX_FILES = int(os.getenv("UPLOAD_BATCH_MAX_FILES", 500))
+UPLOAD_BATCH_WORKERS = int(os.getenv("UPLOAD_BATCH_WORKERS", 8))
+DATA_UPLOAD_MAX_NUMBER_FILES = UPLOAD_BATCH_MAX_FILES
+
+# Signed download URLs: lifetime, and an in-process LRU cache that reuses a URL
+# only while it has at least SIGNED_URL_CACHE_MIN_TTL seconds left
+SIGNED_URL_EXPIRY = int(os.getenv("SIGNED_URL_EXPIRY", 3600))
+SIGNED_URL_CACHE_SIZE = int(os.getenv("SIGNED_URL_CACHE_SIZE", 10000))
+SIGNED_URL_CACHE_MIN_TTL = int(os.getenv("SIGNED_URL_CACHE_MIN_TTL", 300))
+SIGNED_URL_BATCH_MAX = int(os.getenv("SIGNED_URL_BATCH_MAX", 500))
+
+# Storage objects removed per call when deleting many files, and the most
+# ids a single bulk delete request may name
+STORAGE_DELETE_BATCH_SIZE = int(os.getenv("STORAGE_DELETE_BATCH_SIZE", 500))
+BULK_DELETE_MAX_IDS = int(os.getenv("BULK_DELETE_MAX_IDS", 10000))
+
+# Backoff (seconds) between retries of a failed outbox storage deletion
+STORAGE_DELETION_RETRY_BASE = int(os.getenv("STORAGE_DELETION_RETRY_BASE", 30))
+STORAGE_DELETION_RETRY_MAX = int(os.getenv("STORAGE_DELETION_RETRY_MAX", 60 * 60))
+
+# Streaming downloads through Django (download/<id>/content/), for clients that
+# cannot reach the storage host; off unless enabled
+DOWNLOAD_PROXY_ENABLED = os.getenv("DOWNLOAD_PROXY_ENABLED", "False") == "True"
+DOWNLOAD_PROXY_CHUNK_SIZE = int(os.getenv("DOWNLOAD_PROXY_CHUNK_SIZE", 256 * 1024))
+
+# ZIP downloads (download/zip/): most ids one request may name, and how many
+# chunks of the next files are read ahead while the current one is sent
+ZIP_DOWNLOAD_MAX_IDS = int(os.getenv("ZIP_DOWNLOAD_MAX_IDS", 10000))
+ZIP_PREFETCH_CHUNKS = int(os.getenv("ZIP_PREFETCH_CHUNKS", 16))
+
+# Compression of new objects (see core.compression): "gzip", "zstd" (needs the
+# zstandard package) or empty for none; files below the minimum size, or that
+# shrink by less than the minimum fraction, are stored as they are. Only local
+# storage serves Content-Encoding: on Supabase, the default backend, files are
+# always stored as they are and this setting does nothing
+UPLOAD_COMPRESSION = os.getenv("UPLOAD_COMPRESSION", "")
+UPLOAD_COMPRESSION_MIN_SIZE = int(os.getenv("UPLOAD_COMPRESSION_MIN_SIZE", 1024))
+UPLOAD_COMPRESSION_MIN_SAVING = float(os.getenv("UPLOAD_COMPRESSION_MIN_SAVING", 0.1))
+
+# Previews of images and PDFs (see core.previews): bounding box sizes in pixels,
+# render processes, the largest original worth rendering, and how long a job
+# claimed by the worker stays hidden before it is retried
+PREVIEW_SIZES = [int(size) for size in os.getenv("PREVIEW_SIZES", "256,1024").split(",")]
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", os.cpu_count() or 1))
+PREVIEW_MAX_SOURCE_BYTES = int(os.getenv("PREVIEW_MAX_SOURCE_BYTES", 50 * 1024 * 1024))
+PREVIEW_MAX_ATTEMPTS = int(os.getenv("PREVIEW_MAX_ATTEMPTS", 5))
+PREVIEW_LEASE = int(os.getenv("PREVIEW_LEASE", 10 * 60))
+
+# Request metrics (see core.metrics): per-view latency histograms at metrics/,
+# readable by staff or with METRICS_TOKEN as the bearer token; requests slower
+# than SLOW_REQUEST_MS are logged with their breakdown at the given sample rate
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True") == "True"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", 1000))
+SLOW_REQUEST_LOG_RATE = float(os.getenv("SLOW_REQUEST_LOG_RATE", 0.1))
+
+# File listing page size (?limit=) and its upper bound
+FILE_LIST_PAGE_SIZE = int(os.getenv("FILE_LIST_PAGE_SIZE", 100))
+FILE_LIST_MAX_PAGE_SIZE = int(os.getenv("FILE_LIST_MAX_PAGE_SIZE", 1000))
+# Rows fetched and encoded per step of the streamed listing (files/stream/)
+FILE_STREAM_BATCH_SIZE = int(os.getenv("FILE_STREAM_BATCH_SIZE", 2000))
+
+# Resumable uploads: chunks are staged here until the session is committed.
+# Kept out of MEDIA_ROOT, which DEBUG serves publicly. Every chunk PUT and the
+# commit must see the same directory, so run a single web node or put it on a
+# volume shared by all of them; purge_upload_sessions clears what is abandoned
+UPLOAD_SESSION_ROOT = os.getenv("UPLOAD_SESSION_ROOT", os.path.join(BASE_DIR, "upload_sessions"))
+UPLOAD_SESSION_CHUNK_SIZE = int(os.getenv("UPLOAD_SESSION_CHUNK_SIZE", 8 * 1024 * 1024))
+UPLOAD_SESSION_MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_SESSION_MAX_CHUNK_SIZE", 64 * 1024 * 1024))
+UPLOAD_SESSION_MAX_CHUNKS = int(os.getenv("UPLOAD_SESSION_MAX_CHUNKS", 10000))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 24 * 60 * 60))   # seconds since the last chunk
+
+# Direct uploads (see core.direct_upload): seconds a slot and its pre-signed
+# upload URL stay valid; Supabase caps its upload URLs at two hours
+DIRECT_UPLOAD_EXPIRY = int(os.getenv("DIRECT_UPLOAD_EXPIRY", 60 * 60))
+
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         "Names.authentication.CookieJWTAuthentication",
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        "Names.authentication.CachedJWTAuthentication",
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    # orjson instead of the standard library encoder (see core.renderers)
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 SIMPLE_JWT = {
@@ -174,6 +297,13 @@ SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
 }
 
+# Users resolved from access tokens are cached per process for this many
+# seconds, so authenticated requests skip the user query. Saves and deletes
+# take effect at once; other changes (queryset.update(), another process)
+# within the TTL, which is why it is kept short (see Names.authentication)
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", 10000))
+AUTH_USER_CACHE_TTL = int(os.getenv("AUTH_USER_CACHE_TTL", 60))
+
 # Google OAuth Settings
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
 
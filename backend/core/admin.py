@@ -1,5 +1,12 @@
 from django.contrib import admin
-from .models import File
+from .models import Blob, DirectUpload, File, FileTombstone, PreviewJob, StorageDeletion, StorageUsage, UploadSession
 
 # Register your models here.
-admin.site.register(File)
\ No newline at end of file
+admin.site.register(File)
+admin.site.register(Blob)
+admin.site.register(StorageDeletion)
+admin.site.register(StorageUsage)
+admin.site.register(FileTombstone)
+admin.site.register(PreviewJob)
+admin.site.register(UploadSession)
+admin.site.register(DirectUpload)
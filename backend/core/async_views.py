@@ -0,0 +1,120 @@
+"""
+Native async versions of the upload, list, download-URL and delete endpoints.
+
+Served under ``api/async/``. Under ASGI the request body is received on the
+event loop, and storage calls go through the backend's async client, so a
+slow client or a slow bucket holds a coroutine instead of a worker thread.
+They work under WSGI too, one event loop per request.
+"""
+import functools
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+from .models import File
+from .pagination import InvalidCursor, keyset_queryset, page_size, split_page
+from .renderers import dumps
+from .services import FILE_PAYLOAD_FIELDS, astore_file, adelete_file, file_payload, row_payload
+from .signed_urls import asigned_url
+from .usage import QuotaExceeded, usage_for
+from .views import MAX_NAME_LENGTH, NAME_TOO_LONG, not_modified, set_listing_validators
+
+
+def json_response(data, status: int = 200) -> HttpResponse:
+    # The sync views' renderer, so payloads match them byte for byte
+    return HttpResponse(dumps(data), status=status, content_type="application/json")
+
+
+def _authenticate(request):
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = authentication_class().authenticate(request)
+        if result is not None:
+            return result[0]
+    return None
+
+
+def async_api_view(methods):
+    """
+    Restricts an async view to `methods` and to users authenticated by the
+    ``DEFAULT_AUTHENTICATION_CLASSES`` (JWT cookie or bearer token).
+    """
+    def decorator(view):
+        @csrf_exempt
+        @require_http_methods(methods)
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                user = await sync_to_async(_authenticate)(request)
+            except AuthenticationFailed as e:
+                # Same body DRF's exception handler would send
+                return json_response(e.detail if isinstance(e.detail, (list, dict)) else {"detail": e.detail}, status=401)
+            if user is None:
+                return json_response({"detail": "Authentication credentials were not provided."}, status=401)
+            request.user = user
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Upload a file
+@async_api_view(["POST"])
+async def upload_file(request):
+    # Parsing spools the upload to disk and hashes it: blocking work for a thread
+    files = await sync_to_async(lambda: request.FILES, thread_sensitive=False)()
+    uploaded_file = files.get("file")
+
+    if not uploaded_file:
+        return json_response({"error": "No file provided."}, status=400)
+    if len(uploaded_file.name) > MAX_NAME_LENGTH:
+        return json_response({"error": NAME_TOO_LONG}, status=400)
+
+    try:
+        file_instance = await astore_file(request.user, uploaded_file, uploaded_file.name, uploaded_file.size)
+    except QuotaExceeded as e:
+        return json_response({"error": str(e)}, status=413)
+
+    return json_response(file_payload(file_instance), status=201)
+
+
+# List files, newest first, one page at a time (?limit=&cursor=)
+@async_api_view(["GET"])
+async def list_files(request):
+    usage = await sync_to_async(usage_for)(request.user)
+    cached = not_modified(request, usage)
+    if cached:
+        return cached
+
+    try:
+        files = keyset_queryset(File.objects.filter(user=request.user), request.GET.get("cursor")).values(*FILE_PAYLOAD_FIELDS)
+    except InvalidCursor as e:
+        return json_response({"error": str(e)}, status=400)
+    limit = page_size(request)
+    page, next_cursor = split_page([row async for row in files[:limit + 1]], limit)
+    return set_listing_validators(json_response({
+        "results": [row_payload(row) for row in page],
+        "next_cursor": next_cursor,
+    }), usage)
+
+
+# Download via signed URL
+@async_api_view(["GET"])
+async def download_file(request, file_id):
+    file_obj = await File.objects.filter(id=file_id, user=request.user).afirst()
+    if file_obj is None:
+        return json_response({"detail": "File not found or unauthorized."}, status=404)
+
+    return json_response({"download_url": await asigned_url(file_obj.supabase_path)})
+
+
+# Delete file
+@async_api_view(["DELETE"])
+async def delete_file(request, file_id):
+    file_obj = await File.objects.filter(id=file_id, user=request.user).afirst()
+    if file_obj is None:
+        return json_response({"error": "File not found"}, status=404)
+
+    await adelete_file(file_obj)
+
+    return json_response({"message": "File deleted successfully"}, status=204)
@@ -0,0 +1,75 @@
+"""
+The changes feed a sync client polls instead of diffing full listings.
+
+Every file created or deleted takes the next number of its owner's change
+sequence (``StorageUsage.version``): live files carry it in ``File.seq`` and
+deletions leave a ``FileTombstone`` with it. A client keeps the cursor of the
+last page it applied and asks for everything after it. A file whose previews
+arrive later takes a new number and is sent again, so clients apply "created"
+entries as upserts.
+"""
+from django.db import transaction
+from .models import File, FileTombstone, StorageUsage
+from .services import file_payload
+from .usage import usage_for
+
+
+class CursorExpired(Exception):
+    def __init__(self, message="Cursor is older than the retained changes; resync from cursor 0."):
+        super().__init__(message)
+
+
+def changes_since(user, cursor: int, limit: int) -> dict:
+    """
+    Up to `limit` changes to `user`'s files after `cursor`, oldest first.
+
+    Cursor 0 is a full resync: every live file and no tombstones. Raises
+    CursorExpired if tombstones after `cursor` have already been pruned.
+    """
+    # Read first: every change up to this version has committed, so it is a safe cursor
+    usage = usage_for(user)
+    if 0 < cursor < usage.pruned_seq:
+        raise CursorExpired()
+
+    changes = [
+        {"seq": f.seq, "type": "created", "file": file_payload(f)}
+        for f in File.objects.filter(user=user, seq__gt=cursor).order_by("seq")[:limit + 1]
+    ]
+    if cursor:
+        changes += [
+            {"seq": t.seq, "type": "deleted", "id": t.file_id}
+            for t in FileTombstone.objects.filter(user=user, seq__gt=cursor).order_by("seq")[:limit + 1]
+        ]
+    changes.sort(key=lambda change: change["seq"])
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    last = changes[-1]["seq"] if changes else cursor
+    return {
+        "changes": changes,
+        "cursor": last if has_more else max(last, usage.version),
+        "has_more": has_more,
+    }
+
+
+def prune_tombstones(before, batch_size: int) -> int:
+    """
+    Deletes one batch of tombstones older than `before`. Each owner's
+    ``pruned_seq`` is raised first, so cursors that would miss them expire.
+    Returns how many were deleted.
+    """
+    with transaction.atomic():
+        batch = list(
+            FileTombstone.objects.filter(deleted_at__lt=before)
+            .order_by("id").values_list("id", "user_id", "seq")[:batch_size]
+        )
+        if not batch:
+            return 0
+
+        pruned = {}
+        for _, user_id, seq in batch:
+            pruned[user_id] = max(seq, pruned.get(user_id, 0))
+        for user_id, seq in sorted(pruned.items()):
+            StorageUsage.objects.filter(user_id=user_id, pruned_seq__lt=seq).update(pruned_seq=seq)
+        FileTombstone.objects.filter(id__in=[tombstone_id for tombstone_id, _, _ in batch]).delete()
+    return len(batch)
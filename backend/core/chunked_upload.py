@@ -0,0 +1,162 @@
+import bisect
+import io
+import itertools
+import os
+import shutil
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.utils import timezone
+
+# Bytes copied from the request body to the staging file per read.
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+class ChunkSizeMismatch(Exception):
+    """The body of a chunk PUT was not the size the session expects."""
+
+
+def staging_root() -> Path:
+    return Path(settings.UPLOAD_SESSION_ROOT)
+
+
+def session_dir(session) -> Path:
+    return staging_root() / str(session.id)
+
+
+def chunk_path(session, index: int) -> Path:
+    return session_dir(session) / f"{index:06d}.part"
+
+
+def session_expiry():
+    return timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+
+
+def write_chunk(session, index: int, stream) -> int:
+    """
+    Copies one chunk from `stream` into the session's staging directory.
+
+    The chunk is written to a temporary name and renamed into place, so
+    concurrent or retried PUTs of the same index never leave a torn chunk.
+    """
+    expected = session.expected_chunk_size(index)
+    directory = session_dir(session)
+    directory.mkdir(parents=True, exist_ok=True)
+    tmp_path = directory / f".{index:06d}.{uuid.uuid4().hex}.tmp"
+
+    written = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            while stream is not None and written <= expected:
+                data = stream.read(min(COPY_BUFFER_SIZE, expected + 1 - written))
+                if not data:
+                    break
+                out.write(data)
+                written += len(data)
+        if written != expected:
+            raise ChunkSizeMismatch(f"Chunk {index} must be exactly {expected} bytes.")
+        os.replace(tmp_path, chunk_path(session, index))
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return written
+
+
+def received_chunks(session) -> list:
+    """
+    Indexes of the chunks already staged for `session`, in ascending order.
+    """
+    directory = session_dir(session)
+    if not directory.is_dir():
+        return []
+    return sorted(int(entry.name[:-5]) for entry in os.scandir(directory) if entry.name.endswith(".part"))
+
+
+def missing_chunks(session, received=None) -> list:
+    received = set(received_chunks(session) if received is None else received)
+    return [index for index in range(session.total_chunks) if index not in received]
+
+
+def discard_session_files(session_id) -> None:
+    shutil.rmtree(staging_root() / str(session_id), ignore_errors=True)
+
+
+class ChunkSequence(io.RawIOBase):
+    """
+    Seekable read-only view over the staged chunk files, in index order.
+
+    Lets a committed session be streamed to storage without first
+    concatenating the chunks into another file.
+    """
+
+    def __init__(self, paths):
+        self._paths = list(paths)
+        self._sizes = [os.path.getsize(path) for path in self._paths]
+        self._starts = [0, *itertools.accumulate(self._sizes)][:-1]
+        self._length = sum(self._sizes)
+        self._position = 0
+        self._current = None
+        self._current_index = -1
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._position = max(0, offset)
+        return self._position
+
+    def _locate(self):
+        # Which chunk holds the current position, and where inside it
+        if self._position >= self._length:
+            return None, 0
+        index = bisect.bisect_right(self._starts, self._position) - 1
+        return index, self._position - self._starts[index]
+
+    def readinto(self, buffer):
+        index, offset = self._locate()
+        if index is None:
+            return 0
+        if index != self._current_index:
+            self._close_current()
+            self._current = open(self._paths[index], "rb")
+            self._current_index = index
+        self._current.seek(offset)
+        data = self._current.read(min(len(buffer), self._sizes[index] - offset))
+        size = len(data)
+        buffer[:size] = data
+        self._position += size
+        return size
+
+    def _close_current(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+            self._current_index = -1
+
+    def close(self):
+        self._close_current()
+        super().close()
+
+
+def open_assembled(session) -> DjangoFile:
+    """
+    Returns the staged chunks of `session` as a single Django ``File``.
+    """
+    paths = [chunk_path(session, index) for index in range(session.total_chunks)]
+    stream = io.BufferedReader(ChunkSequence(paths), buffer_size=COPY_BUFFER_SIZE)
+    django_file = DjangoFile(stream, name=session.name)
+    django_file.content_type = session.content_type or "application/octet-stream"
+    django_file.size = session.size
+    return django_file
@@ -0,0 +1,196 @@
+"""
+Transparent compression of uploads that compress well.
+
+With ``UPLOAD_COMPRESSION`` set to "gzip" (or "zstd", which needs the
+zstandard package), each new object is screened before it is sent: files
+that start with the signature of an already compressed format, or whose
+content type is media or an archive, are stored as they are. Others are
+compressed chunk by chunk into a spooled temporary file, and kept compressed
+only if that saves at least ``UPLOAD_COMPRESSION_MIN_SAVING`` of the size.
+
+Compressed objects get the codec's suffix on their storage path, and the
+codec is recorded on the Blob and its Files as `encoding`. Only backends that
+send stored objects with a Content-Encoding header (see
+``StorageBackend.serves_content_encoding``) get compressed objects: the URLs
+of the others would hand clients the compressed bytes, so on Supabase, the
+default backend, the setting does nothing. Downloads carry no encoding field:
+signed URLs and the download proxy send the header (or decode), and clients
+always receive the original bytes.
+"""
+import mimetypes
+import re
+import tempfile
+import zlib
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File as DjangoFile
+from .storage import upload_chunk_size
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+# The last segment of a compressed blob path (see services.blob_path)
+ENCODED_NAME = re.compile(r"[0-9a-f]{32}(\.gz|\.zst)")
+
+# Leading bytes of formats that are compressed already
+COMPRESSED_SIGNATURES = (
+    b"\x1f\x8b",                 # gzip
+    b"\x28\xb5\x2f\xfd",         # zstd
+    b"BZh",                      # bzip2
+    b"\xfd7zXZ\x00",             # xz
+    b"PK\x03\x04",               # zip, docx, xlsx, jar, apk
+    b"7z\xbc\xaf\x27\x1c",       # 7z
+    b"Rar!",                     # rar
+    b"\xff\xd8\xff",             # jpeg
+    b"\x89PNG",                  # png
+    b"GIF8",                     # gif
+    b"RIFF",                     # webp, avi, wav
+    b"OggS",                     # ogg
+    b"fLaC",                     # flac
+    b"ID3",                      # mp3
+    b"%PDF",                     # pdf (streams are deflated inside)
+    b"wOF2",                     # woff2
+)
+COMPRESSED_TYPE_PREFIXES = ("image/", "video/", "audio/", "font/woff")
+COMPRESSED_TYPES = {
+    "application/zip", "application/gzip", "application/x-gzip", "application/x-bzip2",
+    "application/x-xz", "application/x-7z-compressed", "application/vnd.rar",
+    "application/zstd", "application/pdf",
+}
+# These compress well despite their type prefix
+COMPRESSIBLE_TYPES = {"image/svg+xml", "image/bmp", "image/x-ms-bmp", "image/tiff"}
+
+# Bytes compressed up front to judge files whose type says nothing
+SAMPLE_SIZE = 64 * 1024
+
+
+def _compressor(encoding: str):
+    if encoding == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return zstandard.ZstdCompressor(level=3).compressobj()
+
+
+def _decompressor(encoding: str):
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "zstd":
+        if zstandard is None:
+            raise ImproperlyConfigured("Reading zstd objects requires the zstandard package.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def upload_encoding() -> str:
+    """
+    The codec new uploads are compressed with, or "" if compression is off.
+    """
+    encoding = settings.UPLOAD_COMPRESSION
+    if encoding not in ("", *SUFFIXES):
+        raise ImproperlyConfigured(f"UPLOAD_COMPRESSION must be one of: {', '.join(SUFFIXES)}, or empty.")
+    if encoding == "zstd" and zstandard is None:
+        raise ImproperlyConfigured("UPLOAD_COMPRESSION=zstd requires the zstandard package.")
+    return encoding
+
+
+def is_compressible(django_file) -> bool:
+    """
+    Cheap screening by size, content type and signature, then a trial run on
+    the first ``SAMPLE_SIZE`` bytes for files of unknown type.
+    """
+    if django_file.size < settings.UPLOAD_COMPRESSION_MIN_SIZE:
+        return False
+    content_type = getattr(django_file, "content_type", None)
+    if not content_type or content_type == "application/octet-stream":
+        content_type = mimetypes.guess_type(django_file.name or "")[0] or ""
+    if content_type not in COMPRESSIBLE_TYPES and (
+        content_type in COMPRESSED_TYPES or content_type.startswith(COMPRESSED_TYPE_PREFIXES)
+    ):
+        return False
+
+    django_file.seek(0)
+    sample = django_file.read(SAMPLE_SIZE)
+    django_file.seek(0)
+    if sample.startswith(COMPRESSED_SIGNATURES):
+        return False
+    if content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES:
+        return True
+    return len(zlib.compress(sample, 1)) <= len(sample) * (1 - settings.UPLOAD_COMPRESSION_MIN_SAVING)
+
+
+def compress_upload(django_file, storage) -> tuple:
+    """
+    (file to store, encoding): `django_file` itself and "" when it is not worth
+    compressing or `storage` cannot serve it compressed, else a temporary
+    compressed copy, which the caller closes, and its codec.
+    """
+    encoding = upload_encoding()
+    if not encoding or not storage.serves_content_encoding or not is_compressible(django_file):
+        return django_file, ""
+
+    # Only the first chunk's worth of compressed output is held in memory
+    spool = tempfile.SpooledTemporaryFile(max_size=upload_chunk_size())
+    compressor = _compressor(encoding)
+    for chunk in django_file.chunks(upload_chunk_size()):
+        spool.write(compressor.compress(chunk))
+    spool.write(compressor.flush())
+    size = spool.tell()
+    django_file.seek(0)
+    if size > django_file.size * (1 - settings.UPLOAD_COMPRESSION_MIN_SAVING):
+        spool.close()
+        return django_file, ""
+
+    spool.seek(0)
+    payload = DjangoFile(spool, name=django_file.name)
+    payload.size = size
+    payload.content_type = getattr(django_file, "content_type", None)
+    return payload, encoding
+
+
+@contextmanager
+def compressed_upload(django_file, storage):
+    """
+    `compress_upload` as a context manager that cleans up the compressed copy.
+    """
+    payload, encoding = compress_upload(django_file, storage)
+    try:
+        yield payload, encoding
+    finally:
+        if encoding:
+            payload.close()
+
+
+def encoded_path(path: str, encoding: str) -> str:
+    return path + SUFFIXES.get(encoding, "")
+
+
+def path_encoding(path: str) -> str:
+    """
+    The codec a blob object was stored with, from its path suffix; "" if none.
+    Objects stored before deduplication keep their raw bytes whatever they are called.
+    """
+    match = ENCODED_NAME.fullmatch(path.rsplit("/", 1)[-1])
+    if not match:
+        return ""
+    return next(encoding for encoding, suffix in SUFFIXES.items() if suffix == match.group(1))
+
+
+def decompress_chunks(chunks, encoding: Optional[str]) -> Iterator[bytes]:
+    """
+    The original bytes of an object stored with `encoding`, from its stored `chunks`.
+    """
+    if not encoding:
+        yield from chunks
+        return
+    decompressor = _decompressor(encoding)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    tail = decompressor.flush()
+    if tail:
+        yield tail
@@ -0,0 +1,120 @@
+"""
+Uploads that go straight from the client to storage.
+
+The client asks for a slot and gets a pre-signed upload URL for a path of its
+own, ``{user_id}/{uuid}_{name}``. It sends the bytes there, then finalizes the
+slot; only then is the object checked and the File created. The bytes never
+pass through a web worker, so they are not deduplicated, compressed or
+previewed: the File owns its object, like files stored before deduplication.
+"""
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import DirectUpload, File
+from .services import enqueue_storage_deletions
+from .storage import get_storage
+from .usage import QuotaExceeded, claim_seqs, release_usage, reserve_usage
+
+
+class UploadMissing(Exception):
+    def __init__(self, message="Nothing has been uploaded to this slot yet."):
+        super().__init__(message)
+
+
+class UploadSizeMismatch(Exception):
+    """The stored object is not the size the slot was opened for; the slot is discarded."""
+
+
+class UploadGone(Exception):
+    def __init__(self, message="Upload slot expired or was already finalized."):
+        super().__init__(message)
+
+
+def upload_path(user, name: str) -> str:
+    safe_name = name.replace("/", "_").replace("\\", "_")
+    return f"{user.id}/{uuid.uuid4().hex}_{safe_name}"
+
+
+def open_slot(user, name: str, size: int, content_type: str = "") -> tuple:
+    """
+    (DirectUpload, {"url", "method", "headers"}) for an upload of `size` bytes
+    called `name`. The URL expires with the slot, after ``DIRECT_UPLOAD_EXPIRY`` seconds.
+    """
+    expiry = settings.DIRECT_UPLOAD_EXPIRY
+    upload = DirectUpload(
+        user=user,
+        name=name,
+        size=size,
+        content_type=content_type,
+        path=upload_path(user, name),
+        expires_at=timezone.now() + timedelta(seconds=expiry),
+    )
+    target = get_storage().signed_upload_url(upload.path, size, content_type, expiry)
+    upload.save()
+    return upload, target
+
+
+def _discard(upload: DirectUpload) -> None:
+    with transaction.atomic():
+        if DirectUpload.objects.filter(id=upload.id).delete()[0]:
+            enqueue_storage_deletions([upload.path])
+
+
+def finalize(upload: DirectUpload) -> File:
+    """
+    Creates the File for a slot whose object is in storage, and closes the slot.
+
+    Raises UploadMissing if nothing is stored yet, QuotaExceeded if the file
+    no longer fits (both leave the slot open), UploadSizeMismatch if the
+    object is the wrong size, and UploadGone if the slot expired or another
+    request finalized it first.
+    """
+    if upload.expires_at <= timezone.now():
+        _discard(upload)
+        raise UploadGone()
+
+    storage = get_storage()
+    info = storage.stat(upload.path)
+    if info is None:
+        raise UploadMissing()
+    if info["size"] != upload.size:
+        _discard(upload)
+        raise UploadSizeMismatch(f"Uploaded {info['size']} bytes, expected {upload.size}.")
+
+    if not reserve_usage(upload.user, [upload.size])[0]:
+        raise QuotaExceeded()
+    try:
+        with transaction.atomic():
+            # Whoever deletes the slot row owns the object
+            if not DirectUpload.objects.filter(id=upload.id).delete()[0]:
+                raise UploadGone()
+            return File.objects.create(
+                user=upload.user,
+                name=upload.name,
+                size=upload.size,
+                supabase_path=upload.path,
+                url=storage.public_url(upload.path),
+                seq=claim_seqs(upload.user_id)[0],
+            )
+    except Exception:
+        release_usage(upload.user_id, upload.size)
+        raise
+
+
+def purge_expired(batch_size: int) -> int:
+    """
+    Deletes one batch of expired slots, queueing whatever was uploaded to
+    them for deletion. Returns how many were deleted.
+    """
+    with transaction.atomic():
+        expired = list(
+            DirectUpload.objects.select_for_update(skip_locked=True)
+            .filter(expires_at__lt=timezone.now())
+            .values_list("id", "path")[:batch_size]
+        )
+        if expired:
+            DirectUpload.objects.filter(id__in=[upload_id for upload_id, _ in expired]).delete()
+            enqueue_storage_deletions([path for _, path in expired])
+    return len(expired)
@@ -0,0 +1,277 @@
+"""
+Serving stored files through Django, for deployments where clients cannot
+reach the storage host.
+
+Bodies stream in ``DOWNLOAD_PROXY_CHUNK_SIZE`` pieces, so memory stays flat
+whatever the file size. On local disk, whole files and open-ended ranges go
+out as a ``FileResponse``, which WSGI servers hand to sendfile. Many files go
+out as one ZIP archive written while it is sent.
+"""
+import itertools
+import mimetypes
+import os
+import queue
+import re
+import threading
+import zipfile
+from typing import Iterator, Optional
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+from .compression import decompress_chunks
+from .storage import LocalStorage, get_storage
+
+SINGLE_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """
+    (start, end), inclusive, of the single byte range in a Range `header` for
+    a `size`-byte file. None means send the whole file: no header, or one this
+    server ignores (malformed, or several ranges). Raises RangeNotSatisfiable.
+    """
+    match = SINGLE_RANGE.fullmatch(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def file_etag(file_obj, encoding: str = "") -> str:
+    """
+    Strong ETag of a file's bytes, as sent with `encoding`. Stored files never
+    change, so the content digest (or, before deduplication, the id) identifies them.
+    """
+    tag = file_obj.blob.digest if file_obj.blob_id else f"file-{file_obj.id}"
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+
+def if_range_matches(request, etag: str, last_modified: int) -> bool:
+    """
+    Whether a Range request may be honoured: no If-Range, or one naming the current version.
+    """
+    value = request.META.get("HTTP_IF_RANGE")
+    if not value:
+        return True
+    if value.startswith('"'):
+        return value == etag
+    return parse_http_date_safe(value) == last_modified
+
+
+def accepts_encoding(request, encoding: str) -> bool:
+    accepted = {
+        part.split(";")[0].strip().lower(): part
+        for part in request.META.get("HTTP_ACCEPT_ENCODING", "").split(",")
+    }
+    return encoding in accepted and "q=0" not in accepted[encoding].replace(" ", "").split(";")[1:]
+
+
+def byte_slice(chunks, start: int, end: int) -> Iterator[bytes]:
+    """
+    Bytes `start`..`end` (inclusive) of the stream of `chunks`.
+    """
+    position = 0
+    for chunk in chunks:
+        chunk_end = position + len(chunk)
+        if chunk_end > start:
+            yield chunk[max(0, start - position):end + 1 - position]
+        position = chunk_end
+        if position > end:
+            break
+
+
+def opened(chunks) -> Iterator[bytes]:
+    """
+    `chunks` with the first one already read, so that a missing object is a
+    404 here rather than a broken stream after the headers have gone out.
+    """
+    chunks = iter(chunks)
+    try:
+        first = next(chunks, b"")
+    except FileNotFoundError:
+        raise Http404("File not found.")
+    return itertools.chain([first], chunks)
+
+
+def serve_file(request, file_obj, inline: bool = False):
+    """
+    The bytes of `file_obj`, honouring conditional and Range requests.
+
+    Compressed objects are decoded on the way out, unless the client takes the
+    whole file in the stored encoding.
+    """
+    storage = get_storage()
+    path, size, encoding = file_obj.supabase_path, file_obj.size, file_obj.encoding
+    chunk_size = settings.DOWNLOAD_PROXY_CHUNK_SIZE
+    passthrough = bool(encoding) and not request.META.get("HTTP_RANGE") and accepts_encoding(request, encoding)
+    etag = file_etag(file_obj, encoding if passthrough else "")
+    last_modified = int(file_obj.uploaded_at.timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        try:
+            byte_range = None
+            if not passthrough and if_range_matches(request, etag, last_modified):
+                byte_range = parse_range(request.META.get("HTTP_RANGE"), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+        content_type = mimetypes.guess_type(file_obj.name)[0] or "application/octet-stream"
+        start, end = byte_range or (0, size - 1)
+        if size == 0:
+            response = HttpResponse(b"", content_type=content_type)
+        elif passthrough:
+            response = StreamingHttpResponse(opened(storage.stream(path, chunk_size)), content_type=content_type)
+            response["Content-Encoding"] = encoding
+        elif not encoding and isinstance(storage, LocalStorage) and end == size - 1:
+            try:
+                f = open(storage.path(path), "rb")
+            except FileNotFoundError:
+                raise Http404("File not found.")
+            f.seek(start)
+            # Content-Length comes from the file position
+            response = FileResponse(f, content_type=content_type)
+        else:
+            if encoding:
+                body = byte_slice(decompress_chunks(storage.stream(path, chunk_size), encoding), start, end)
+            else:
+                body = storage.stream(path, chunk_size, start, end)
+            response = StreamingHttpResponse(opened(body), content_type=content_type)
+            response["Content-Length"] = end - start + 1
+        if byte_range:
+            response.status_code = 206
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Disposition"] = content_disposition_header(not inline, file_obj.name)
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = "private, no-cache"
+    if encoding:
+        patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+class _ZipSink:
+    """
+    Where ``zipfile`` writes the archive. Not seekable, so entries get data
+    descriptors; the stream takes what was written after each piece.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def archive_names(names) -> list:
+    """
+    `names` made safe and unique as ZIP entries: "a.txt", "a (1).txt", ...
+    """
+    seen, unique = set(), []
+    for name in names:
+        name = name.replace("/", "_").replace("\\", "_")
+        if name in ("", ".", ".."):
+            name = "file"
+        candidate, n = name, 0
+        while candidate.lower() in seen:
+            n += 1
+            stem, ext = os.path.splitext(name)
+            candidate = f"{stem} ({n}){ext}"
+        seen.add(candidate.lower())
+        unique.append(candidate)
+    return unique
+
+
+def _prefetch(files, chunk_size: int, depth: int, stop: threading.Event) -> queue.Queue:
+    """
+    Reads the objects of `files` in order on a background thread into a queue
+    of at most `depth` chunks, so the next object is already arriving while
+    the current one is written. None ends each file; an exception ends the stream.
+    """
+    chunks = queue.Queue(maxsize=depth)
+    storage = get_storage()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for file_obj in files:
+                for chunk in decompress_chunks(storage.stream(file_obj.supabase_path, chunk_size), file_obj.encoding):
+                    if not put(chunk):
+                        return
+                if not put(None):
+                    return
+        except Exception as e:
+            put(e)
+
+    threading.Thread(target=read, daemon=True).start()
+    return chunks
+
+
+def zip_stream(files) -> Iterator[bytes]:
+    """
+    A ZIP archive of `files` (File rows), generated as it is sent. Entries are
+    stored uncompressed and switch to ZIP64 when large, as does the archive
+    once it passes 4 GiB or 65,535 entries. Holds at most
+    ``ZIP_PREFETCH_CHUNKS`` chunks of read-ahead in memory.
+    """
+    stop = threading.Event()
+    chunks = _prefetch(files, settings.DOWNLOAD_PROXY_CHUNK_SIZE, settings.ZIP_PREFETCH_CHUNKS, stop)
+    sink = _ZipSink()
+    try:
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+            for file_obj, name in zip(files, archive_names(f.name for f in files)):
+                info = zipfile.ZipInfo(name, date_time=timezone.localtime(file_obj.uploaded_at).timetuple()[:6])
+                # Read by zipfile to decide on ZIP64 before the entry is written
+                info.file_size = file_obj.size
+                with archive.open(info, "w") as entry:
+                    while True:
+                        chunk = chunks.get()
+                        if chunk is None:
+                            break
+                        if isinstance(chunk, Exception):
+                            raise chunk
+                        entry.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+        # The central directory
+        yield sink.drain()
+    finally:
+        # Also runs when the client goes away: the reader thread gives up
+        stop.set()
@@ -0,0 +1,100 @@
+"""
+Shared scaffolding of the bench_* commands, which write throwaway users and
+files to the database they run against.
+
+``BenchCommand`` refuses to run unless ``DEBUG`` is on or ``--database``
+names another alias from ``DATABASES`` (a test or scratch database), which
+then stands in for the default one, in every thread, for the whole run.
+``bench_users`` creates the users and removes them, their files and stored
+objects afterwards; ``seed_files`` fills their accounts.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from core.models import File
+from core.services import delete_files
+
+
+class BenchCommand(BaseCommand):
+    # Servers started in other processes read the settings themselves and cannot follow --database
+    database_option = True
+
+    def add_arguments(self, parser):
+        if self.database_option:
+            parser.add_argument("--database", help="Run on this alias from DATABASES (a test or scratch database) instead of the default one.")
+
+    def execute(self, *args, **options):
+        alias = options.get("database") or DEFAULT_DB_ALIAS
+        if alias == DEFAULT_DB_ALIAS:
+            if not settings.DEBUG:
+                hint = " or point --database at a test database" if self.database_option else ""
+                raise CommandError(f"Benchmarks write users and files to the database: run them with DEBUG on{hint}.")
+            return super().execute(*args, **options)
+        if alias not in connections.settings:
+            raise CommandError(f"Unknown database alias: {alias}")
+        with default_database(alias):
+            return super().execute(*args, **options)
+
+
+@contextmanager
+def default_database(alias: str):
+    """
+    Makes `alias` the default database for the duration, for this thread and any it starts.
+    """
+    original = connections.settings[DEFAULT_DB_ALIAS]
+
+    def switch(settings_dict):
+        connections[DEFAULT_DB_ALIAS].close()
+        del connections[DEFAULT_DB_ALIAS]
+        connections.settings[DEFAULT_DB_ALIAS] = settings_dict
+
+    switch(connections.settings[alias])
+    try:
+        yield
+    finally:
+        switch(original)
+
+
+@contextmanager
+def bench_users(count: int = 1, keep: bool = False):
+    """
+    `count` new users, deleted afterwards unless `keep` is set. Files the run
+    stored are deleted the normal way, so their objects are queued for
+    removal; seeded rows, which have no objects, are simply dropped.
+    """
+    users = [User.objects.create_user(username=f"bench-{uuid.uuid4().hex[:8]}") for _ in range(count)]
+    try:
+        yield users
+    finally:
+        if not keep:
+            files = File.objects.filter(user__in=users)
+            delete_files(files.filter(blob__isnull=False))
+            files.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+
+def seed_files(user, count: int, batch_size: int = 10_000, **fields) -> float:
+    """
+    Inserts `count` files owned by `user` in batches and returns the seconds
+    it took. Each field is a value or a function of the file's number n; by
+    default files are named "file-{n}.bin", are n bytes long and live at
+    "bench/{user id}/{n}" with no object behind them.
+    """
+    fields = {
+        "name": lambda n: f"file-{n}.bin",
+        "size": lambda n: n,
+        "supabase_path": lambda n: f"bench/{user.id}/{n}",
+        "url": "",
+        **fields,
+    }
+    start = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        File.objects.bulk_create([
+            File(user=user, **{key: value(n) if callable(value) else value for key, value in fields.items()})
+            for n in range(offset, min(offset + batch_size, count))
+        ])
+    return time.perf_counter() - start
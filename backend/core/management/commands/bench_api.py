@@ -0,0 +1,225 @@
+import json
+import os
+import platform
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from core.management.bench import BenchCommand, bench_users, seed_files
+from core.models import File, StorageDeletion
+from core.signed_urls import signed_url_cache
+from core.storage import StorageBackend
+
+SCENARIOS = ["upload", "list", "download", "delete"]
+# Lower is better for all of these; a run is a regression if one grows past the tolerance
+COMPARED = ["p50_ms", "p95_ms", "p99_ms", "queries_per_request"]
+
+
+class MemoryStorage(StorageBackend):
+    """
+    Objects in a dict shared by the process: the API's own cost, with storage taken out.
+    """
+
+    objects = {}
+    lock = threading.Lock()
+
+    def upload(self, path, django_file, content_type=None, overwrite=False):
+        data = b"".join(django_file.chunks())
+        with self.lock:
+            if path in self.objects and not overwrite:
+                raise FileExistsError(path)
+            self.objects[path] = data
+
+    def public_url(self, path):
+        return f"memory://{path}"
+
+    def signed_url(self, path, expiry=3600):
+        return f"memory://{path}?expires={int(time.time()) + expiry}"
+
+    def delete(self, paths):
+        with self.lock:
+            for path in paths:
+                self.objects.pop(path, None)
+        return True
+
+    def stat(self, path):
+        data = self.objects.get(path)
+        return None if data is None else {"size": len(data)}
+
+    def stream(self, path, chunk_size=64 * 1024, start=0, end=None):
+        data = self.objects[path][start:None if end is None else end + 1]
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+
+class Command(BenchCommand):
+    help = (
+        "Seeds users and files, drives the upload, list, download-URL and delete "
+        "endpoints against in-memory storage, and reports latency percentiles, "
+        "throughput and queries per request. Results can be saved as JSON and "
+        "compared with an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--files", type=int, default=1000, help="Files seeded per user.")
+        parser.add_argument("--requests", type=int, default=500, help="Requests per scenario.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once (1 runs them inline; SQLite only copes with 1).")
+        parser.add_argument("--size", type=int, default=16 * 1024, help="Upload size in bytes.")
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of: " + ", ".join(SCENARIOS))
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for picking users and files.")
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+        parser.add_argument("--baseline", help="Compare with the results in this JSON file.")
+        parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed growth over the baseline (0.2 = 20%%).")
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options["scenarios"].split(",") if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        self.rng = random.Random(options["seed"])
+
+        try:
+            with bench_users(options["users"]) as users, override_settings(STORAGE_BACKEND=f"{__name__}.MemoryStorage"):
+                self.tokens = {user.id: f"Bearer {AccessToken.for_user(user)}" for user in users}
+                seeded = self.seed(users, options["files"])
+                signed_url_cache.clear()
+                results = {
+                    name: self.run(self.requests(name, users, seeded, options), options["concurrency"])
+                    for name in scenarios
+                }
+        finally:
+            # The deletions queued for objects that only ever lived in memory
+            StorageDeletion.objects.filter(path__in=list(MemoryStorage.objects)).delete()
+            MemoryStorage.objects.clear()
+
+        report = {
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "options": {key: options[key] for key in ("users", "files", "requests", "concurrency", "size", "seed")},
+            },
+            "scenarios": results,
+        }
+        self.print_report(results)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Saved results to {options['output']}")
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["tolerance"])
+
+    def seed(self, users, per_user) -> dict:
+        """
+        {user id: [file ids]}; each file has a stored object so deletes do real work.
+        """
+        start = time.perf_counter()
+        seeded = {}
+        for user in users:
+            seed_files(user, per_user, size=1)
+            files = list(File.objects.filter(user=user).values_list("id", "supabase_path"))
+            MemoryStorage.objects.update({path: b"x" for _, path in files})
+            seeded[user.id] = [file_id for file_id, _ in files]
+        self.stdout.write(f"Seeded {len(users)} users x {per_user} files in {time.perf_counter() - start:.1f}s")
+        return seeded
+
+    def requests(self, scenario, users, seeded, options) -> list:
+        """
+        (user id, method, url, data) per request. Deletes use each seeded file once.
+        """
+        count = options["requests"]
+        user_ids = [user.id for user in users]
+        if scenario == "upload":
+            return [
+                (self.rng.choice(user_ids), "post", "/api/upload/",
+                 {"file": SimpleUploadedFile(f"upload-{n}.bin", os.urandom(options["size"]))})
+                for n in range(count)
+            ]
+        if scenario == "list":
+            return [(self.rng.choice(user_ids), "get", "/api/files/", {}) for _ in range(count)]
+        if scenario == "download":
+            picks = [self.rng.choice(user_ids) for _ in range(count)]
+            return [(user_id, "get", f"/api/download/{self.rng.choice(seeded[user_id])}/", {}) for user_id in picks]
+
+        pool = [(user_id, file_id) for user_id, ids in seeded.items() for file_id in ids]
+        self.rng.shuffle(pool)
+        return [(user_id, "delete", f"/api/delete/{file_id}/", {}) for user_id, file_id in pool[:count]]
+
+    def send(self, request) -> tuple:
+        user_id, method, url, data = request
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        # Server errors count against the run instead of aborting it
+        client = Client(raise_request_exception=False, HTTP_AUTHORIZATION=self.tokens[user_id])
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = getattr(client, method)(url, data) if data else getattr(client, method)(url)
+        return time.perf_counter() - start, queries, response.status_code < 400
+
+    def run(self, requests, concurrency) -> dict:
+        start = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                samples = list(pool.map(self.send, requests))
+        else:
+            samples = [self.send(request) for request in requests]
+        elapsed = time.perf_counter() - start
+
+        if not samples:
+            return {"requests": 0}
+        latencies = [latency * 1000 for latency, _, _ in samples]
+        # 99 cut points: index k-1 is the k-th percentile
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+        return {
+            "requests": len(samples),
+            "errors": sum(1 for _, _, ok in samples if not ok),
+            "throughput_rps": round(len(samples) / elapsed, 1),
+            "p50_ms": round(cuts[49], 2),
+            "p95_ms": round(cuts[94], 2),
+            "p99_ms": round(cuts[98], 2),
+            "queries_per_request": round(sum(queries for _, queries, _ in samples) / len(samples), 2),
+        }
+
+    def print_report(self, results):
+        self.stdout.write(f"{'scenario':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>7}")
+        for name, r in results.items():
+            if not r["requests"]:
+                continue
+            self.stdout.write(
+                f"{name:<10} {r['throughput_rps']:>8.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+                f"{r['p99_ms']:>8.2f} {r['queries_per_request']:>8.2f} {r['errors']:>7}"
+            )
+
+    def compare(self, results, path, tolerance):
+        try:
+            with open(path) as f:
+                baseline = json.load(f)["scenarios"]
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Cannot read the baseline {path}: {e}")
+        regressions = []
+        for name, r in results.items():
+            before = baseline.get(name)
+            if not before or not r["requests"]:
+                continue
+            for metric in COMPARED:
+                if before[metric] and r[metric] > before[metric] * (1 + tolerance):
+                    regressions.append(f"{name} {metric}: {before[metric]} -> {r[metric]}")
+            if r["errors"] > before["errors"]:
+                regressions.append(f"{name} errors: {before['errors']} -> {r['errors']}")
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {path} (tolerance {tolerance:.0%})."))
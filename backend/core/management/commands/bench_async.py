@@ -0,0 +1,126 @@
+import asyncio
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from core.management.bench import BenchCommand, bench_users, seed_files
+from core.models import File
+from core.signed_urls import signed_url_cache
+from core.storage import LocalStorage
+
+
+class SlowStorage(LocalStorage):
+    """
+    Local disk with a fixed delay per call, standing in for a remote bucket.
+    Blocking methods sleep the thread; async ones sleep the coroutine.
+    """
+
+    latency = 0.05
+
+    def upload(self, path, django_file, content_type=None, overwrite=False):
+        time.sleep(self.latency)
+        super().upload(path, django_file, content_type, overwrite)
+
+    def signed_url(self, path, expiry=3600):
+        time.sleep(self.latency)
+        return super().signed_url(path, expiry)
+
+    async def aupload(self, path, django_file, content_type=None, overwrite=False):
+        await asyncio.sleep(self.latency)
+        super().upload(path, django_file, content_type, overwrite)
+
+    async def asigned_url(self, path, expiry=3600):
+        await asyncio.sleep(self.latency)
+        return LocalStorage.signed_url(self, path, expiry)
+
+
+class Command(BenchCommand):
+    help = (
+        "Compares throughput of the sync endpoints served by a pool of WSGI threads "
+        "with the async endpoints served by one ASGI event loop, against a storage "
+        "backend with simulated network latency."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--endpoint", choices=["download", "upload"], default="download")
+        parser.add_argument("--requests", type=int, default=400)
+        parser.add_argument("--concurrency", type=int, default=100, help="Requests in flight at once.")
+        parser.add_argument("--threads", type=int, default=8, help="WSGI worker threads (like gunicorn --threads).")
+        parser.add_argument("--latency", type=float, default=0.05, help="Seconds each storage call takes.")
+        parser.add_argument("--size", type=int, default=16 * 1024, help="Upload size in bytes.")
+
+    def handle(self, *args, **options):
+        SlowStorage.latency = options["latency"]
+        root = tempfile.mkdtemp()
+        try:
+            with bench_users() as (user,), override_settings(STORAGE_BACKEND=f"{__name__}.SlowStorage", LOCAL_STORAGE_ROOT=root):
+                token = f"Bearer {AccessToken.for_user(user)}"
+                self.stdout.write(f"{'server':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+                self.report("wsgi", self.run_wsgi(self.requests(user, options, "/api"), token, options))
+                self.report("asgi", asyncio.run(self.run_asgi(self.requests(user, options, "/api/async"), token, options)))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    def requests(self, user, options, prefix):
+        """
+        (method, url, kwargs) per request. Every request hits a different file
+        or different bytes, so neither the URL cache nor deduplication skips storage.
+        """
+        count = options["requests"]
+        signed_url_cache.clear()
+        if options["endpoint"] == "download":
+            seed_files(user, count, size=0, supabase_path=lambda n: f"{user.id}/{uuid.uuid4().hex}")
+            ids = File.objects.filter(user=user).order_by("-id").values_list("id", flat=True)[:count]
+            return [("GET", f"{prefix}/download/{file_id}/", {}) for file_id in ids]
+        return [
+            ("POST", f"{prefix}/upload/", {"files": {"file": (f"file-{n}.bin", os.urandom(options["size"]))}})
+            for n in range(count)
+        ]
+
+    def run_wsgi(self, requests, token, options):
+        transport = httpx.WSGITransport(app=get_wsgi_application())
+        with httpx.Client(transport=transport, base_url="http://localhost", headers={"Authorization": token}) as client:
+            def send(request):
+                method, url, kwargs = request
+                start = time.perf_counter()
+                client.request(method, url, **kwargs).raise_for_status()
+                return time.perf_counter() - start
+
+            # Requests beyond the thread count queue up, as they would behind a WSGI server
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+                latencies = list(pool.map(send, requests))
+            return latencies, time.perf_counter() - start
+
+    async def run_asgi(self, requests, token, options):
+        transport = httpx.ASGITransport(app=get_asgi_application())
+        limit = asyncio.Semaphore(options["concurrency"])
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost", headers={"Authorization": token}) as client:
+            async def send(request):
+                method, url, kwargs = request
+                async with limit:
+                    start = time.perf_counter()
+                    (await client.request(method, url, **kwargs)).raise_for_status()
+                    return time.perf_counter() - start
+
+            start = time.perf_counter()
+            latencies = await asyncio.gather(*(send(request) for request in requests))
+            return latencies, time.perf_counter() - start
+
+    def report(self, server, result):
+        latencies, elapsed = result
+        latencies = sorted(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(
+            f"{server:>6} {len(latencies) / elapsed:>8.1f} "
+            f"{statistics.median(latencies) * 1000:>8.1f} {p95 * 1000:>8.1f}"
+        )
@@ -0,0 +1,58 @@
+import statistics
+import time
+from rest_framework.test import APIRequestFactory, force_authenticate
+from core.management.bench import BenchCommand, bench_users, seed_files
+from core.models import File
+from core.pagination import encode_cursor
+from core.views import FileListView
+
+
+class Command(BenchCommand):
+    help = (
+        "Seeds a throwaway user with many files and compares the cost of fetching "
+        "file-list pages at increasing depth with cursor vs OFFSET pagination."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--rows", type=int, default=200_000)
+        parser.add_argument("--limit", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--keep", action="store_true", help="Keep the seeded user and files afterwards.")
+
+    def handle(self, *args, **options):
+        rows, limit, repeat = options["rows"], options["limit"], options["repeat"]
+        with bench_users(keep=options["keep"]) as (user,):
+            self.stdout.write(f"Seeded {rows} files in {seed_files(user, rows):.1f}s")
+            self.report(user, rows, limit, repeat)
+
+    def report(self, user, rows, limit, repeat):
+        view = FileListView.as_view()
+        factory = APIRequestFactory()
+        ordered = File.objects.filter(user=user).order_by("-uploaded_at", "-id")
+
+        def timed(fn):
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn()
+                samples.append((time.perf_counter() - start) * 1000)
+            return statistics.median(samples)
+
+        def cursor_page(cursor):
+            request = factory.get("/api/files/", {"limit": limit, **({"cursor": cursor} if cursor else {})})
+            force_authenticate(request, user=user)
+            response = view(request)
+            assert len(response.data["results"]) == min(limit, rows)
+
+        def offset_page(offset):
+            list(ordered[offset:offset + limit])
+
+        self.stdout.write(f"{'depth':>8} {'cursor ms':>10} {'offset ms':>10}")
+        for fraction in (0, 0.25, 0.5, 0.75, 0.99):
+            depth = int((rows - limit) * fraction)
+            cursor = None
+            if depth:
+                anchor = ordered.values("uploaded_at", "id")[depth - 1]
+                cursor = encode_cursor(anchor["uploaded_at"], anchor["id"])
+            self.stdout.write(f"{depth:>8} {timed(lambda: cursor_page(cursor)):>10.2f} {timed(lambda: offset_page(depth)):>10.2f}")
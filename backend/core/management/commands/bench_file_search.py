@@ -0,0 +1,65 @@
+import random
+import statistics
+import time
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+from core.management.bench import BenchCommand, bench_users, seed_files
+from core.models import File
+from core.views import FileSearchView
+
+WORDS = [
+    "holiday", "invoice", "report", "budget", "photo", "scan", "draft", "final", "notes", "backup",
+    "contract", "slides", "resume", "receipt", "summary", "export", "video", "design", "archive", "meeting",
+]
+EXTENSIONS = ["jpg", "png", "pdf", "docx", "xlsx", "txt", "mp4", "zip"]
+
+
+class Command(BenchCommand):
+    help = (
+        "Seeds a throwaway user with many files and measures name search latency "
+        "for prefix, substring and no-match queries."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--limit", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--keep", action="store_true", help="Keep the seeded user and files afterwards.")
+
+    def handle(self, *args, **options):
+        with bench_users(keep=options["keep"]) as (user,):
+            self.seed(user, options["rows"])
+            self.report(user, options["limit"], options["repeat"])
+
+    def seed(self, user, rows):
+        start = time.perf_counter()
+        rng = random.Random(0)
+        seed_files(user, rows, name=lambda n: f"{rng.choice(WORDS)}-{rng.choice(WORDS)}-{n}.{rng.choice(EXTENSIONS)}")
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {File._meta.db_table}")
+        self.stdout.write(f"Seeded {rows} files in {time.perf_counter() - start:.1f}s ({connection.vendor})")
+
+    def report(self, user, limit, repeat):
+        view = FileSearchView.as_view()
+        factory = APIRequestFactory()
+        queries = [
+            ("prefix, common", {"q": "holiday", "match": "prefix"}),
+            ("substring, common", {"q": "voice-sum"}),
+            ("substring, rare", {"q": "-123456."}),
+            ("substring, no match", {"q": "zzzz"}),
+        ]
+
+        self.stdout.write(f"{'query':<22} {'hits':>6} {'p50 ms':>8} {'p95 ms':>8}")
+        for label, params in queries:
+            samples = []
+            for _ in range(repeat):
+                request = factory.get("/api/files/search/", {"limit": limit, **params})
+                force_authenticate(request, user=user)
+                start = time.perf_counter()
+                response = view(request)
+                samples.append((time.perf_counter() - start) * 1000)
+            samples.sort()
+            p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+            self.stdout.write(f"{label:<22} {len(response.data['results']):>6} {statistics.median(samples):>8.2f} {p95:>8.2f}")
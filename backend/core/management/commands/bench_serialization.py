@@ -0,0 +1,56 @@
+import time
+from rest_framework.renderers import JSONRenderer
+from core.management.bench import BenchCommand, bench_users, seed_files
+from core.models import File
+from core.renderers import ORJSONRenderer, stream_array
+from core.services import FILE_PAYLOAD_FIELDS, file_payload, row_payload
+
+
+class Command(BenchCommand):
+    help = (
+        "Seeds one account with many files and times listing all of them three "
+        "ways: File instances rendered by DRF's JSONRenderer, values() rows "
+        "rendered by orjson, and the streamed array of files/stream/."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--rows", type=int, default=50_000)
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per path; the best is reported.")
+
+    def handle(self, *args, **options):
+        with bench_users() as (user,):
+            seed_files(user, options["rows"], url=lambda n: f"https://storage.test/bench/{user.id}/{n}", previews={}, seq=lambda n: n + 1)
+            files = File.objects.filter(user=user).order_by("-uploaded_at", "-id")
+
+            def instances():
+                start = time.perf_counter()
+                rows = list(files.all())
+                fetched = time.perf_counter()
+                body = JSONRenderer().render({"results": [file_payload(f) for f in rows]})
+                return fetched - start, time.perf_counter() - fetched, len(body)
+
+            def values():
+                start = time.perf_counter()
+                rows = list(files.values(*FILE_PAYLOAD_FIELDS))
+                fetched = time.perf_counter()
+                body = ORJSONRenderer().render({"results": [row_payload(row) for row in rows]})
+                return fetched - start, time.perf_counter() - fetched, len(body)
+
+            def streamed():
+                # Fetching and encoding interleave, so it is all one number
+                start = time.perf_counter()
+                size = sum(len(chunk) for chunk in stream_array(map(row_payload, files.values(*FILE_PAYLOAD_FIELDS).iterator(2000)), 2000))
+                return None, time.perf_counter() - start, size
+
+            self.stdout.write(f"{options['rows']} rows")
+            self.stdout.write(f"{'path':<22} {'fetch ms':>9} {'encode ms':>10} {'total ms':>9} {'bytes':>10} {'speedup':>8}")
+            baseline = None
+            for name, run in (("instances + DRF JSON", instances), ("values() + orjson", values), ("streamed array", streamed)):
+                fetch, encode, size = min((run() for _ in range(options["repeat"])), key=lambda r: (r[0] or 0) + r[1])
+                total = (fetch or 0) + encode
+                baseline = baseline or total
+                self.stdout.write(
+                    f"{name:<22} {'-' if fetch is None else f'{fetch * 1000:.0f}':>9} {encode * 1000:>10.0f} "
+                    f"{total * 1000:>9.0f} {size:>10} {baseline / total:>7.1f}x"
+                )
@@ -0,0 +1,116 @@
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from django.conf import settings
+from django.core.management.base import CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+from core.management.bench import BenchCommand, bench_users, seed_files
+
+SERVERS = {
+    "runserver": ["runserver", "--noreload"],
+    "serve": ["serve"],
+    "serve-asgi": ["serve", "--asgi"],
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Command(BenchCommand):
+    # The servers run on the default database
+    database_option = False
+    help = (
+        "Starts runserver and manage.py serve in turn on local ports and drives the "
+        "same authenticated file listing against each over real HTTP, reporting "
+        "throughput and latency percentiles."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--servers", default="runserver,serve", help="Comma-separated subset of: " + ", ".join(SERVERS))
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=16, help="Clients sending at once, each on a kept-alive connection.")
+        parser.add_argument("--files", type=int, default=200, help="Files in the listed account.")
+        parser.add_argument("--limit", type=int, default=50, help="Files per listing page.")
+
+    def handle(self, *args, **options):
+        servers = [name.strip() for name in options["servers"].split(",") if name.strip()]
+        unknown = set(servers) - set(SERVERS)
+        if unknown:
+            raise CommandError(f"Unknown servers: {', '.join(sorted(unknown))}")
+        if settings.DATABASES["default"]["NAME"] == ":memory:":
+            raise CommandError("The servers need a database they can share with this process.")
+
+        with bench_users() as (user,):
+            seed_files(user, options["files"], size=1, seq=lambda n: n + 1)
+            token = f"Bearer {AccessToken.for_user(user)}"
+            self.stdout.write(f"{'server':<11} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+            for name in servers:
+                self.report(name, self.run(name, token, options))
+
+    def run(self, name, token, options) -> tuple:
+        port = free_port()
+        command = [sys.executable, "manage.py", *SERVERS[name]]
+        command += ["--bind", f"127.0.0.1:{port}"] if name.startswith("serve") else [f"127.0.0.1:{port}"]
+        process = subprocess.Popen(
+            command, cwd=settings.BASE_DIR, env={**os.environ, "SERVE_ACCESS_LOG": "False"},
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        url = f"http://127.0.0.1:{port}/api/files/?limit={options['limit']}"
+        try:
+            self.wait_until_up(url, token, process)
+            local, clients = threading.local(), []
+
+            def send(_):
+                if not hasattr(local, "client"):
+                    local.client = httpx.Client(headers={"Authorization": token}, timeout=30)
+                    clients.append(local.client)
+                start = time.perf_counter()
+                try:
+                    ok = local.client.get(url).status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                return time.perf_counter() - start, ok
+
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+                # Warm-up: connections, workers and caches
+                list(pool.map(send, range(options["concurrency"] * 4)))
+                start = time.perf_counter()
+                samples = list(pool.map(send, range(options["requests"])))
+                elapsed = time.perf_counter() - start
+            for client in clients:
+                client.close()
+            return samples, elapsed
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    def wait_until_up(self, url, token, process, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f"The server exited with status {process.returncode}.")
+            try:
+                httpx.get(url, headers={"Authorization": token}, timeout=5)
+                return
+            except httpx.TransportError:
+                time.sleep(0.2)
+        raise CommandError("The server did not start in time.")
+
+    def report(self, name, result):
+        samples, elapsed = result
+        latencies = [latency * 1000 for latency, _ in samples]
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        errors = sum(1 for _, ok in samples if not ok)
+        self.stdout.write(
+            f"{name:<11} {len(samples) / elapsed:>8.1f} {cuts[49]:>8.2f} {cuts[94]:>8.2f} {cuts[98]:>8.2f} {errors:>7}"
+        )
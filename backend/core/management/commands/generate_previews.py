@@ -0,0 +1,35 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.services import process_preview_jobs
+
+
+class Command(BaseCommand):
+    help = "Renders queued thumbnails and PDF previews on a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.PREVIEW_WORKERS, help="Render processes.")
+        parser.add_argument("--batch-size", type=int, help="Jobs claimed at once (default: twice --workers).")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep when no job is due.")
+        parser.add_argument("--once", action="store_true", help="Exit once nothing is due instead of polling.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"] or 2 * options["workers"]
+        total_done = total_failed = 0
+        # Spawned, not forked: the children never share this process's database connection
+        with ProcessPoolExecutor(options["workers"], mp_context=multiprocessing.get_context("spawn")) as pool:
+            while True:
+                done, failed = process_preview_jobs(batch_size, pool)
+                total_done += done
+                total_failed += failed
+                if failed:
+                    self.stderr.write(f"{failed} previews could not be stored; retrying later.")
+                if done or failed:
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS(f"Finished {total_done} preview jobs; {total_failed} deferred."))
@@ -0,0 +1,29 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.services import process_storage_deletions
+
+
+class Command(BaseCommand):
+    help = "Drains the storage deletion outbox, retrying failed deletes with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.STORAGE_DELETE_BATCH_SIZE)
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument("--once", action="store_true", help="Exit once nothing is due instead of polling.")
+
+    def handle(self, *args, **options):
+        total_deleted = total_failed = 0
+        while True:
+            deleted, failed = process_storage_deletions(options["batch_size"])
+            total_deleted += deleted
+            total_failed += failed
+            if failed:
+                self.stderr.write(f"{failed} storage deletions failed; retrying later.")
+            if deleted or failed:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {total_deleted} objects; {total_failed} deletions deferred."))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.changes import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = "Deletes file tombstones older than FILE_TOMBSTONE_RETENTION_DAYS from the changes feed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=settings.FILE_TOMBSTONE_RETENTION_DAYS)
+        purged = 0
+
+        while True:
+            deleted = prune_tombstones(before, options["batch_size"])
+            if not deleted:
+                break
+            purged += deleted
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} file tombstones."))
@@ -0,0 +1,65 @@
+import os
+import uuid
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.models import UploadSession
+from core import chunked_upload, direct_upload
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes expired resumable upload sessions and their staged chunks, and "
+        "expired direct upload slots, queueing anything uploaded to them for deletion."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        purged = 0
+
+        while True:
+            expired = list(
+                UploadSession.objects.filter(expires_at__lt=timezone.now())
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not expired:
+                break
+            UploadSession.objects.filter(id__in=expired).delete()
+            for upload_id in expired:
+                chunked_upload.discard_session_files(upload_id)
+            purged += len(expired)
+
+        # Staging directories whose session row is already gone
+        orphans = 0
+        root = chunked_upload.staging_root()
+        if root.is_dir():
+            names = [entry.name for entry in os.scandir(root) if entry.is_dir()]
+            live = {str(upload_id) for upload_id in UploadSession.objects.filter(id__in=self._uuids(names)).values_list("id", flat=True)}
+            for name in names:
+                if name not in live:
+                    chunked_upload.discard_session_files(name)
+                    orphans += 1
+
+        slots = 0
+        while True:
+            deleted = direct_upload.purge_expired(batch_size)
+            if not deleted:
+                break
+            slots += deleted
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {purged} expired upload sessions, {orphans} orphaned staging directories "
+            f"and {slots} expired direct upload slots."
+        ))
+
+    @staticmethod
+    def _uuids(names):
+        valid = []
+        for name in names:
+            try:
+                valid.append(uuid.UUID(name))
+            except ValueError:
+                continue
+        return valid
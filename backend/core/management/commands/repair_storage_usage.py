@@ -0,0 +1,26 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from core.usage import repair_usage
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes every user's storage usage counters from their files, a batch "
+        "of users at a time. An upload in flight while its owner is recomputed is missed "
+        "until the next run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Users recomputed per transaction.")
+
+    def handle(self, *args, **options):
+        last_id = users = corrected = 0
+        while True:
+            user_ids = list(User.objects.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:options["batch_size"]])
+            if not user_ids:
+                break
+            corrected += repair_usage(user_ids)
+            users += len(user_ids)
+            last_id = user_ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Checked {users} users; corrected {corrected} usage counters."))
@@ -0,0 +1,121 @@
+import math
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+def available_cpus() -> int:
+    """
+    CPUs this process may run on, honouring affinity and a cgroup v2 CPU quota (Docker --cpus).
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def tune(cpus: int, asgi: bool, workers: int = 0, threads: int = 0) -> tuple:
+    """
+    (workers, threads) for `cpus`. Explicit counts win. Blocking workers
+    default to 2 per CPU plus one; an event loop needs no more than one per CPU.
+    The total is kept within ``SERVE_DB_CONNECTIONS``, as every thread can
+    hold a persistent database connection.
+    """
+    threads = 1 if asgi else threads or settings.SERVE_THREADS
+    workers = workers or (cpus if asgi else 2 * cpus + 1)
+    budget = settings.SERVE_DB_CONNECTIONS
+    if budget and workers * threads > budget:
+        workers = max(1, budget // threads)
+    return workers, threads
+
+
+def close_connections_after_each_request() -> None:
+    """
+    Sets CONN_MAX_AGE to 0 on every database, here and in workers that load the settings afresh.
+    """
+    os.environ["CONN_MAX_AGE"] = "0"
+    for database in connections.settings.values():
+        database["CONN_MAX_AGE"] = 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the project under gunicorn: pre-forked WSGI workers with threads, or "
+        "uvicorn workers for ASGI, sized from the available CPUs. The app is loaded "
+        "once before forking, workers are recycled after a number of requests, and "
+        "SIGHUP replaces them gracefully."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bind", default=settings.SERVE_BIND, help="host:port or unix:/path.")
+        parser.add_argument("--asgi", action="store_true", default=settings.SERVE_ASGI, help="Serve cloudstorage.asgi with uvicorn workers.")
+        parser.add_argument("--workers", type=int, default=settings.SERVE_WORKERS, help="Worker processes (0 = from the CPU count).")
+        parser.add_argument("--threads", type=int, default=settings.SERVE_THREADS, help="Threads per WSGI worker.")
+        parser.add_argument("--max-requests", type=int, default=settings.SERVE_MAX_REQUESTS, help="Requests before a worker is replaced (0 = never).")
+        parser.add_argument("--timeout", type=int, default=settings.SERVE_TIMEOUT, help="Seconds a silent worker may take before it is killed.")
+        parser.add_argument("--no-preload", action="store_true", help="Load the app in each worker instead of once in the master.")
+        parser.add_argument("--pid", help="Write the master's PID here, for sending it signals.")
+        parser.add_argument("--dry-run", action="store_true", help="Print the configuration and exit.")
+
+    def handle(self, *args, **options):
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            raise CommandError("serve needs gunicorn (and uvicorn for --asgi): pip install gunicorn uvicorn")
+
+        asgi = options["asgi"]
+        cpus = available_cpus()
+        workers, threads = tune(cpus, asgi, options["workers"], options["threads"])
+        config = {
+            "bind": options["bind"],
+            "workers": workers,
+            "threads": threads,
+            "worker_class": "uvicorn.workers.UvicornWorker" if asgi else ("gthread" if threads > 1 else "sync"),
+            "preload_app": not options["no_preload"],
+            "max_requests": options["max_requests"],
+            # Spread out the recycling so workers do not all restart at once
+            "max_requests_jitter": options["max_requests"] // 10,
+            "timeout": options["timeout"],
+            "graceful_timeout": settings.SERVE_GRACEFUL_TIMEOUT,
+            "keepalive": settings.SERVE_KEEPALIVE,
+            "pidfile": options["pid"],
+            "accesslog": "-" if settings.SERVE_ACCESS_LOG else None,
+            "errorlog": "-",
+        }
+        self.stdout.write(
+            f"{'ASGI' if asgi else 'WSGI'} on {config['bind']}: {workers} workers x {threads} threads "
+            f"({config['worker_class']}, {cpus} CPUs), recycled every ~{config['max_requests']} requests"
+        )
+        persistent = asgi and any(database.get("CONN_MAX_AGE") for database in connections.settings.values())
+        if persistent:
+            self.stderr.write("Note: CONN_MAX_AGE is set to 0 under ASGI, where persistent connections are never closed.")
+        if options["dry_run"]:
+            return
+        if persistent:
+            close_connections_after_each_request()
+
+        self.check()
+        # Nothing opened here may be shared with the forked workers
+        connections.close_all()
+        app_path = "cloudstorage.asgi:application" if asgi else "cloudstorage.wsgi:application"
+
+        class Server(BaseApplication):
+            def load_config(self):
+                for key, value in config.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                from gunicorn.util import import_app
+                return import_app(app_path)
+
+        Server().run()
@@ -0,0 +1,325 @@
+"""
+Per-request timing, split into database queries, storage calls and response
+rendering, aggregated per view into latency histograms.
+
+``RequestTimingMiddleware`` opens a ``RequestTimings`` for each request in a
+context variable. Every database connection runs its queries through
+``time_query`` and every storage backend method is wrapped by
+``timed_storage``; both add to the open request's timings and cost one
+context variable lookup when there is none. ``render_metrics`` writes the
+histograms in the Prometheus text format for ``/api/metrics/``.
+
+Histograms live in the process: each worker reports its own, and the
+scraper sums them. The body of a streamed response is sent after its
+request is recorded, so it is not part of these timings.
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; +Inf is implied
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMPONENTS = ("db", "storage", "render")
+
+_current = contextvars.ContextVar("request_timings", default=None)
+# Storage methods call each other (signed_urls -> signed_url, a subclass's
+# upload -> super().upload); only the outermost call is timed. Per context,
+# so concurrent uploads from one request are each timed.
+_storage_depth = contextvars.ContextVar("storage_depth", default=0)
+
+
+class RequestTimings:
+    """
+    Seconds spent on each component of one request, and how many calls it made.
+    """
+
+    __slots__ = ("db", "db_queries", "storage", "storage_calls", "render", "_lock")
+
+    def __init__(self):
+        self.db = self.storage = self.render = 0.0
+        self.db_queries = self.storage_calls = 0
+        # Uploads in a batch go to storage from several threads at once
+        self._lock = threading.Lock()
+
+    def add_storage(self, seconds: float):
+        with self._lock:
+            self.storage += seconds
+            self.storage_calls += 1
+
+
+def current_timings():
+    return _current.get()
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper (see ``connection.execute_wrapper``).
+    """
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - start
+        timings.db_queries += 1
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_query)
+
+
+def _timed_iterator(iterator, timings):
+    """
+    Counts the time spent producing each item of a storage stream as one call.
+    """
+    elapsed = 0.0
+    try:
+        while True:
+            token = _storage_depth.set(_storage_depth.get() + 1)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+                _storage_depth.reset(token)
+            yield item
+    finally:
+        timings.add_storage(elapsed)
+
+
+def timed_storage(method):
+    """
+    Wraps a storage backend method so that calls made while a request is
+    open add to its storage time. Handles coroutines and returned iterators.
+    """
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(*args, **kwargs):
+            timings = _current.get()
+            if timings is None or _storage_depth.get():
+                return await method(*args, **kwargs)
+            token = _storage_depth.set(1)
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                timings.add_storage(time.perf_counter() - start)
+                _storage_depth.reset(token)
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        timings = _current.get()
+        if timings is None or _storage_depth.get():
+            return method(*args, **kwargs)
+        token = _storage_depth.set(1)
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            _storage_depth.reset(token)
+        if inspect.isgenerator(result):
+            # Generators do their work when iterated, not when called
+            return _timed_iterator(result, timings)
+        timings.add_storage(time.perf_counter() - start)
+        return result
+    return wrapper
+
+
+class Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """
+    Request metrics of this process, keyed by view.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.durations = defaultdict(Histogram)
+        self.components = {name: defaultdict(Histogram) for name in COMPONENTS}
+        self.requests = defaultdict(int)
+        self.db_queries = defaultdict(int)
+        self.storage_calls = defaultdict(int)
+
+    def observe(self, view: str, status: int, seconds: float, timings: RequestTimings):
+        with self._lock:
+            self.durations[view].observe(seconds)
+            for name in COMPONENTS:
+                self.components[name][view].observe(getattr(timings, name))
+            self.requests[(view, str(status))] += 1
+            self.db_queries[view] += timings.db_queries
+            self.storage_calls[view] += timings.storage_calls
+
+
+registry = Registry()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+def _histogram_lines(name: str, help_text: str, histograms: dict) -> list:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for view, histogram in sorted(histograms.items()):
+        labels = _labels(view=view)
+        total = 0
+        for bound, count in zip((*BUCKETS, "+Inf"), histogram.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {total}")
+    return lines
+
+
+def _counter_lines(name: str, help_text: str, values: dict, label_names: tuple) -> list:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    for key, value in sorted(values.items()):
+        key = key if isinstance(key, tuple) else (key,)
+        lines.append(f"{name}{{{_labels(**dict(zip(label_names, key)))}}} {value}")
+    return lines
+
+
+def _gauge_lines(name: str, help_text: str, value) -> list:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+
+def render_metrics(caches: dict = None) -> str:
+    """
+    The registry in the Prometheus text exposition format (version 0.0.4),
+    followed by the counters of each of `caches` ({name: TTLCache}).
+    """
+    with registry._lock:
+        lines = _histogram_lines(
+            "http_request_duration_seconds", "Time to produce a response, by view.", registry.durations
+        )
+        for name in COMPONENTS:
+            lines += _histogram_lines(
+                f"http_request_{name}_seconds", f"Time a request spent on {name}, by view.",
+                registry.components[name],
+            )
+        lines += _counter_lines("http_requests_total", "Responses, by view and status.", registry.requests, ("view", "status"))
+        lines += _counter_lines("http_request_db_queries_total", "Database queries, by view.", registry.db_queries, ("view",))
+        lines += _counter_lines("http_request_storage_calls_total", "Storage calls, by view.", registry.storage_calls, ("view",))
+    for cache_name, cache in (caches or {}).items():
+        stats = cache.stats()
+        for stat in ("hits", "misses", "evictions"):
+            lines += _counter_lines(f"{cache_name}_{stat}_total", f"{cache_name} {stat}.", {(): stats[stat]}, ())
+        lines += _gauge_lines(f"{cache_name}_size", f"Entries in {cache_name}.", stats["size"])
+        lines += _gauge_lines(f"{cache_name}_hit_rate", f"Share of {cache_name} lookups that hit.", stats["hit_rate"])
+    return "\n".join(lines) + "\n"
+
+
+def view_name(request) -> str:
+    """
+    The class name of the view that served `request` (e.g. "FileListView"),
+    the URL name of a function view, or "unmatched".
+    """
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    view_class = getattr(match.func, "view_class", None)
+    if view_class is not None:
+        return view_class.__name__
+    return match.url_name or match.func.__name__
+
+
+class RequestTimingMiddleware:
+    """
+    Times each request and its components, records them per view, and logs
+    a sample of requests slower than ``SLOW_REQUEST_MS`` with the breakdown.
+    Goes first in ``MIDDLEWARE`` so the timings cover the other middleware.
+    """
+
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        # Under ASGI the chain stays async, so async views do not hold a thread each
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, time.perf_counter() - start, timings)
+        return response
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, time.perf_counter() - start, timings)
+        return response
+
+    def record(self, request, response, elapsed, timings):
+        view = view_name(request)
+        registry.observe(view, response.status_code, elapsed, timings)
+        if elapsed * 1000 >= settings.SLOW_REQUEST_MS and random.random() < settings.SLOW_REQUEST_LOG_RATE:
+            logger.warning(
+                "Slow request: %s %s -> %s (%s) in %.1f ms: db %.1f ms over %d queries, "
+                "storage %.1f ms over %d calls, render %.1f ms, other %.1f ms",
+                request.method, request.path, response.status_code, view, elapsed * 1000,
+                timings.db * 1000, timings.db_queries, timings.storage * 1000, timings.storage_calls,
+                timings.render * 1000, (elapsed - timings.db - timings.storage - timings.render) * 1000,
+            )
+
+    def process_template_response(self, request, response):
+        # Called just before a DRF Response renders its content
+        timings = _current.get()
+        if timings is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                timings.render += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+INDEX = "file_name_trgm_idx"
+
+
+def create_trigram_index(apps, schema_editor):
+    # Postgres only; elsewhere name searches scan the user's rows via file_user_uploaded_idx
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name(apps.get_model("core", "File")._meta.db_table)
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    # UPPER(name) is what icontains / istartswith compare, so the planner can use the index for both.
+    # CONCURRENTLY keeps uploads flowing while a large table is indexed.
+    schema_editor.execute(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX} ON {table} USING gin (user_id, UPPER(name) gin_trgm_ops)"
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX}")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('core', '0009_storageusage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_file_name_trgm_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storageusage',
+            name='changed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storageusage',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
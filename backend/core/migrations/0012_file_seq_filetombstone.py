@@ -0,0 +1,60 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+
+def backfill_seqs(apps, schema_editor):
+    # Existing files take their id: increasing per user, and every change sequence continues past it
+    File = apps.get_model("core", "File")
+    StorageUsage = apps.get_model("core", "StorageUsage")
+    File.objects.filter(seq__isnull=True).update(seq=F("id"))
+    latest = File.objects.filter(user_id=OuterRef("user_id")).order_by().values("user_id").annotate(seq=Max("seq")).values("seq")
+    StorageUsage.objects.update(version=Greatest("version", Coalesce(Subquery(latest), 0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_storageusage_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_id', models.BigIntegerField()),
+                ('seq', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='seq',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storageusage',
+            name='pruned_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['user', 'seq'], name='file_user_seq_idx'),
+        ),
+        migrations.AddField(
+            model_name='filetombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='filetombstone',
+            index=models.Index(fields=['user', 'seq'], name='tombstone_user_seq_idx'),
+        ),
+        migrations.RunPython(backfill_seqs, migrations.RunPython.noop),
+    ]
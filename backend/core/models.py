@@ -1,13 +1,165 @@
+import uuid
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+class Blob(models.Model):
+    """
+    A stored object addressed by the SHA-256 of its contents, shared by every
+    File with the same bytes. The object is removed when `ref_count` drops to zero.
+    """
+    digest = models.CharField(max_length=64, unique=True)   # hex SHA-256
+    size = models.BigIntegerField()
+    path = models.TextField()                                # storage path
+    url = models.TextField(null=True, blank=True)            # public URL
+    encoding = models.CharField(max_length=16, blank=True, default="")   # codec the object is compressed with, if any
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    previews = models.JSONField(null=True, blank=True)      # {size: public URL}; null until generated
+
+    def __str__(self):
+        return self.digest
+
 
 class File(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     size = models.BigIntegerField()
+    blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.PROTECT, related_name="files")   # null for files stored before deduplication
     supabase_path = models.TextField(null=True, blank=True)   # path used for download/delete
     url = models.TextField(null=True, blank=True)             # public URL
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    seq = models.BigIntegerField(null=True, blank=True)        # the owner's change sequence at the last change
+    previews = models.JSONField(default=dict, blank=True)      # copied from the Blob, like url
+    encoding = models.CharField(max_length=16, blank=True, default="")   # copied from the Blob
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's files, newest first
+            models.Index(fields=["user", "uploaded_at", "id"], name="file_user_uploaded_idx"),
+            # The changes feed
+            models.Index(fields=["user", "seq"], name="file_user_seq_idx"),
+        ]
 
     def __str__(self):
         return self.name
+
+
+class StorageUsage(models.Model):
+    """
+    Running totals of a user's files, kept in step with every upload and delete
+    so usage and quota checks never have to sum the File table.
+
+    `version` is the user's change sequence: it goes up by one for every file
+    created or deleted, and listings derive their ETag from it. `pruned_seq` is
+    the newest tombstone removed by retention; older sync cursors are expired.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="storage_usage")
+    bytes_used = models.BigIntegerField(default=0)
+    file_count = models.BigIntegerField(default=0)
+    quota = models.BigIntegerField(null=True, blank=True)   # bytes; null means unlimited
+    version = models.BigIntegerField(default=0)
+    changed_at = models.DateTimeField(null=True, blank=True)
+    pruned_seq = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user}: {self.bytes_used} bytes"
+
+
+class FileTombstone(models.Model):
+    """
+    A deleted file, kept for the changes feed until ``FILE_TOMBSTONE_RETENTION_DAYS`` pass.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    file_id = models.BigIntegerField()
+    seq = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "seq"], name="tombstone_user_seq_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.file_id} @ {self.seq}"
+
+
+class PreviewJob(models.Model):
+    """
+    A Blob waiting for previews. Written with the upload's File row and
+    drained by ``manage.py generate_previews``.
+    """
+    blob = models.OneToOneField(Blob, on_delete=models.CASCADE, related_name="preview_job")
+    kind = models.CharField(max_length=16)                   # "image" or "pdf"
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.blob_id}"
+
+
+class StorageDeletion(models.Model):
+    """
+    Outbox of stored objects to remove. Rows are written in the same transaction
+    that deletes the files, and drained by ``manage.py process_storage_deletions``.
+    """
+    path = models.TextField()
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.path
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload: chunks are staged on local disk until the client commits.
+    """
+    OPEN = "open"
+    COMMITTING = "committing"
+    STATUS_CHOICES = [(OPEN, "Open"), (COMMITTING, "Committing")]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    content_type = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=OPEN)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)   # pushed forward on every chunk
+
+    @property
+    def total_chunks(self) -> int:
+        # An empty file is still uploaded as a single (empty) chunk
+        return max(1, -(-self.size // self.chunk_size))
+
+    def expected_chunk_size(self, index: int) -> int:
+        if index < self.total_chunks - 1:
+            return self.chunk_size
+        return self.size - self.chunk_size * (self.total_chunks - 1)
+
+    def __str__(self):
+        return f"{self.name} ({self.id})"
+
+
+class DirectUpload(models.Model):
+    """
+    A slot for an upload that goes straight to storage through a pre-signed
+    URL. The File is created when the client finalizes it.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()                      # declared by the client, checked on finalize
+    content_type = models.CharField(max_length=255, blank=True)
+    path = models.TextField()                            # "user_id/uuid_name"
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.id})"
@@ -0,0 +1,71 @@
+import base64
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(uploaded_at: datetime, pk: int) -> str:
+    raw = f"{uploaded_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        uploaded_at, pk = raw.split("|")
+        return datetime.fromisoformat(uploaded_at), int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor("Invalid cursor.") from e
+
+
+def page_size(request) -> int:
+    """
+    The `limit` query parameter, clamped to ``FILE_LIST_MAX_PAGE_SIZE``.
+    """
+    try:
+        limit = int(request.GET.get("limit", settings.FILE_LIST_PAGE_SIZE))
+    except ValueError:
+        limit = settings.FILE_LIST_PAGE_SIZE
+    return max(1, min(limit, settings.FILE_LIST_MAX_PAGE_SIZE))
+
+
+def keyset_queryset(queryset, cursor):
+    """
+    `queryset` in newest-first (uploaded_at, id) order, starting after `cursor`.
+
+    Seeks straight to the cursor position through the (user, uploaded_at, id)
+    index, so a deep page costs the same as the first one.
+    """
+    queryset = queryset.order_by("-uploaded_at", "-id")
+    if cursor:
+        uploaded_at, pk = decode_cursor(cursor)
+        # The redundant `lte` bounds the index range scan
+        queryset = queryset.filter(uploaded_at__lte=uploaded_at).filter(
+            Q(uploaded_at__lt=uploaded_at) | Q(id__lt=pk)
+        )
+    return queryset
+
+
+def split_page(rows: list, limit: int):
+    """
+    (page, next_cursor) from the first `limit` + 1 rows of a `keyset_queryset`,
+    as model instances or as ``values()`` dicts.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    if isinstance(last, dict):
+        return rows, encode_cursor(last["uploaded_at"], last["id"])
+    return rows, encode_cursor(last.uploaded_at, last.id)
+
+
+def keyset_page(queryset, cursor, limit: int):
+    """
+    One page of `queryset` after `cursor`. Returns (rows, next_cursor).
+    """
+    return split_page(list(keyset_queryset(queryset, cursor)[:limit + 1]), limit)
@@ -0,0 +1,72 @@
+"""
+Thumbnails of uploaded images and first-page previews of PDFs.
+
+Uploads only queue a ``PreviewJob``; ``manage.py generate_previews`` renders
+them in a process pool and stores each size next to the original, at
+``preview_path(blob.path, size)``. Nothing here touches Django, so pool
+workers import it without setting Django up.
+
+Rendering needs Pillow, and pypdfium2 for PDFs. Without them the matching
+uploads are not queued.
+"""
+import io
+import mimetypes
+from typing import Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/tiff"}
+PREVIEW_FORMAT = "WEBP"
+PREVIEW_CONTENT_TYPE = "image/webp"
+
+
+def preview_kind(name: str) -> Optional[str]:
+    """
+    "image" or "pdf" if previews can be rendered for a file called `name`, else None.
+    """
+    if Image is None:
+        return None
+    content_type = mimetypes.guess_type(name)[0]
+    if content_type in IMAGE_TYPES:
+        return "image"
+    if content_type == "application/pdf" and pypdfium2 is not None:
+        return "pdf"
+    return None
+
+
+def preview_path(path: str, size: int) -> str:
+    return f"{path}.{size}.webp"
+
+
+def render_previews(data: bytes, kind: str, sizes) -> dict:
+    """
+    {size: WEBP bytes} of `data` scaled to fit a `size` square, for each of `sizes`.
+    Raises whatever the decoder raises for data it cannot read.
+    """
+    largest = max(sizes)
+    if kind == "pdf":
+        page = pypdfium2.PdfDocument(data)[0]
+        source = page.render(scale=largest / max(page.get_size())).to_pil()
+    else:
+        source = Image.open(io.BytesIO(data))
+        # JPEGs decode straight at a reduced scale, far cheaper than full size
+        source.draft("RGB", (largest, largest))
+        source = ImageOps.exif_transpose(source)
+    source = source.convert("RGBA" if source.mode in ("RGBA", "LA", "P") else "RGB")
+
+    previews = {}
+    # Each size scales down the one before it instead of the full image
+    for size in sorted(sizes, reverse=True):
+        source.thumbnail((size, size))
+        out = io.BytesIO()
+        source.save(out, PREVIEW_FORMAT, quality=80)
+        previews[size] = out.getvalue()
+    return previews
@@ -0,0 +1,539 @@
+import contextvars
+import hashlib
+import random
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .compression import compress_upload, compressed_upload, decompress_chunks, encoded_path, path_encoding
+from .models import Blob, File, FileTombstone, PreviewJob, StorageDeletion
+from .previews import PREVIEW_CONTENT_TYPE, preview_kind, preview_path, render_previews
+from .signed_urls import forget_signed_urls
+from .storage import get_storage, upload_chunk_size
+from .usage import QuotaExceeded, claim_seqs, release_files, release_usage, reserve_usage
+
+
+def file_digest(django_file) -> str:
+    """
+    Hex SHA-256 of `django_file`. Uses the digest computed while the upload
+    was received when there is one, otherwise reads the file in chunks.
+    """
+    digest = getattr(django_file, "sha256", None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in django_file.chunks(upload_chunk_size()):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def blob_path(digest: str) -> str:
+    # A fresh suffix per upload: an object queued for deletion is never the
+    # one a later upload of the same bytes writes
+    return f"blobs/{digest[:2]}/{digest}/{uuid.uuid4().hex}"
+
+
+def enqueue_storage_deletions(paths) -> None:
+    """
+    Queues objects for removal by the ``process_storage_deletions`` worker.
+    Written in the caller's transaction, so they are deleted only if it commits.
+    """
+    StorageDeletion.objects.bulk_create([StorageDeletion(path=path) for path in paths])
+    for path in paths:
+        forget_signed_urls(path)
+
+
+def queue_previews(blobs_and_names) -> None:
+    """
+    Queues preview generation for each (Blob, file name) that can have previews
+    and has none yet; run in the transaction that creates the files.
+    """
+    jobs = {}
+    for blob, name in blobs_and_names:
+        kind = preview_kind(name)
+        if kind and blob.previews is None:
+            jobs.setdefault(blob.id, PreviewJob(blob=blob, kind=kind))
+    PreviewJob.objects.bulk_create(jobs.values(), ignore_conflicts=True)
+
+
+def _upload_blob(storage, digest: str, django_file) -> str:
+    """
+    Sends `django_file` to a new blob path, compressed if that pays off. Returns the path.
+    """
+    with compressed_upload(django_file, storage) as (payload, encoding):
+        path = encoded_path(blob_path(digest), encoding)
+        storage.upload(path, payload, content_type=getattr(django_file, "content_type", None))
+    return path
+
+
+async def _aupload_blob(storage, digest: str, django_file) -> str:
+    # Compressing is blocking work for a thread; the transfer stays on the event loop
+    payload, encoding = await sync_to_async(compress_upload, thread_sensitive=False)(django_file, storage)
+    try:
+        path = encoded_path(blob_path(digest), encoding)
+        await storage.aupload(path, payload, content_type=getattr(django_file, "content_type", None))
+    finally:
+        if encoding:
+            payload.close()
+    return path
+
+
+def _register_blob(digest: str, size: int, path: str, url: str) -> Blob:
+    """
+    The Blob for `digest` after uploading it to `path`. If a concurrent upload
+    of the same bytes registered first, that Blob wins and ours is queued for deletion.
+    """
+    blob, created = Blob.objects.get_or_create(
+        digest=digest,
+        defaults={"size": size, "path": path, "url": url, "encoding": path_encoding(path)},
+    )
+    if not created:
+        enqueue_storage_deletions([path])
+    return blob
+
+
+def acquire_blob(django_file, digest: str, size: int) -> Blob:
+    """
+    Returns the Blob holding these bytes with one more reference counted,
+    uploading them only if no Blob with `digest` exists yet.
+    """
+    blob = Blob.objects.filter(digest=digest).first()
+    if blob is None:
+        storage = get_storage()
+        path = _upload_blob(storage, digest, django_file)
+        blob = _register_blob(digest, size, path, storage.public_url(path))
+
+    # The last reference may have been released since the lookup, taking the row with it
+    if not Blob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") + 1):
+        return acquire_blob(django_file, digest, size)
+    return blob
+
+
+async def aacquire_blob(django_file, digest: str, size: int) -> Blob:
+    """
+    `acquire_blob` for async views: the transfer goes through the backend's async client.
+    """
+    blob = await Blob.objects.filter(digest=digest).afirst()
+    if blob is None:
+        storage = get_storage()
+        path = await _aupload_blob(storage, digest, django_file)
+        blob = await sync_to_async(_register_blob)(digest, size, path, storage.public_url(path))
+
+    if not await Blob.objects.filter(pk=blob.pk).aupdate(ref_count=F("ref_count") + 1):
+        return await aacquire_blob(django_file, digest, size)
+    return blob
+
+
+def _delete_batch(files) -> None:
+    """
+    Deletes `files`, releasing their Blob references and their owners' usage, in one transaction.
+    Objects that end up unreferenced are queued for the storage deletion worker, and
+    each file leaves a tombstone for the changes feed.
+    """
+    with transaction.atomic():
+        # The locked rows are what gets deleted: a file removed concurrently is not released twice
+        files = list(
+            File.objects.select_for_update().filter(id__in=[f.id for f in files])
+            .only("id", "user_id", "size", "blob_id", "supabase_path")
+        )
+        released = Counter(f.blob_id for f in files if f.blob_id)
+        blobs = list(Blob.objects.select_for_update().filter(id__in=released).order_by("id"))
+        orphaned = [blob for blob in blobs if blob.ref_count <= released[blob.id]]
+        paths = [blob.path for blob in orphaned]
+        paths += [preview_path(blob.path, int(size)) for blob in orphaned for size in blob.previews or {}]
+        # Stored before deduplication: the object belongs to that file alone
+        paths += [f.supabase_path for f in files if not f.blob_id and f.supabase_path]
+
+        by_user = defaultdict(list)
+        for f in sorted(files, key=lambda f: f.id):
+            by_user[f.user_id].append(f.id)
+        FileTombstone.objects.bulk_create([
+            FileTombstone(user_id=user_id, file_id=file_id, seq=seq)
+            for user_id in sorted(by_user)
+            for file_id, seq in zip(by_user[user_id], claim_seqs(user_id, len(by_user[user_id])))
+        ])
+        File.objects.filter(id__in=[f.id for f in files]).delete()
+
+        decrements = defaultdict(list)
+        for blob in blobs:
+            if blob.ref_count > released[blob.id]:
+                decrements[released[blob.id]].append(blob.id)
+        for count, blob_ids in decrements.items():
+            Blob.objects.filter(id__in=blob_ids).update(ref_count=F("ref_count") - count)
+
+        Blob.objects.filter(id__in=[blob.id for blob in orphaned]).delete()
+        enqueue_storage_deletions(paths)
+        release_files(files)
+
+
+def delete_files(files) -> None:
+    """
+    Deletes `files` in batches of ``STORAGE_DELETE_BATCH_SIZE``. Stored objects
+    nothing references any more are removed later by the outbox worker.
+    """
+    files = list(files)
+    batch_size = settings.STORAGE_DELETE_BATCH_SIZE
+    for start in range(0, len(files), batch_size):
+        _delete_batch(files[start:start + batch_size])
+
+
+def process_storage_deletions(batch_size: int) -> tuple:
+    """
+    Removes one batch of due outbox objects from storage. Failed batches are
+    retried with exponential backoff. Returns (deleted, failed) counts.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # skip_locked lets several workers drain the outbox side by side
+        batch = list(
+            StorageDeletion.objects.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        if not batch:
+            return 0, 0
+
+        try:
+            ok, error = get_storage().delete([item.path for item in batch]), "Storage refused the delete."
+        except Exception as e:
+            ok, error = False, str(e) or e.__class__.__name__
+
+        if ok:
+            StorageDeletion.objects.filter(id__in=[item.id for item in batch]).delete()
+            return len(batch), 0
+
+        for item in batch:
+            item.attempts += 1
+            delay = min(settings.STORAGE_DELETION_RETRY_MAX, settings.STORAGE_DELETION_RETRY_BASE * 2 ** (item.attempts - 1))
+            item.next_attempt_at = now + timedelta(seconds=delay * random.uniform(0.5, 1.0))
+            item.last_error = error
+        StorageDeletion.objects.bulk_update(batch, ["attempts", "next_attempt_at", "last_error"])
+        return 0, len(batch)
+
+
+def process_preview_jobs(batch_size: int, pool) -> tuple:
+    """
+    Renders the previews of one batch of due jobs on `pool` (a process pool)
+    and stores them next to their originals. A job that fails to reach storage
+    is retried once its lease runs out; a file that cannot be decoded gets no
+    previews. Returns (done, failed) counts.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # skip_locked lets several workers run side by side; the lease hides claimed jobs from them
+        jobs = list(
+            PreviewJob.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("blob")
+            .filter(next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        for job in jobs:
+            job.attempts += 1
+            job.next_attempt_at = now + timedelta(seconds=settings.PREVIEW_LEASE)
+        PreviewJob.objects.bulk_update(jobs, ["attempts", "next_attempt_at"])
+
+    storage = get_storage()
+    sizes = settings.PREVIEW_SIZES
+    rendering = {}
+    done = failed = 0
+    for job in jobs:
+        if job.blob.size > settings.PREVIEW_MAX_SOURCE_BYTES:
+            _finish_preview_job(job, {})
+            done += 1
+            continue
+        try:
+            data = b"".join(decompress_chunks(storage.stream(job.blob.path), job.blob.encoding))
+        except Exception as e:
+            _retry_preview_job(job, e)
+            failed += 1
+            continue
+        rendering[job] = pool.submit(render_previews, data, job.kind, sizes)
+
+    for job, future in rendering.items():
+        try:
+            previews = future.result()
+        except Exception:
+            # Not a file the decoder can read: settle for no previews
+            _finish_preview_job(job, {})
+            done += 1
+            continue
+        try:
+            paths = {}
+            for size, data in previews.items():
+                paths[size] = preview_path(job.blob.path, size)
+                storage.upload(paths[size], ContentFile(data), content_type=PREVIEW_CONTENT_TYPE, overwrite=True)
+        except Exception as e:
+            _retry_preview_job(job, e)
+            failed += 1
+            continue
+        _finish_preview_job(job, paths)
+        done += 1
+    return done, failed
+
+
+def _retry_preview_job(job: PreviewJob, error: Exception) -> None:
+    if job.attempts >= settings.PREVIEW_MAX_ATTEMPTS:
+        _finish_preview_job(job, {})
+        return
+    # Due again when the lease taken by process_preview_jobs runs out
+    PreviewJob.objects.filter(id=job.id).update(last_error=str(error) or error.__class__.__name__)
+
+
+def _finish_preview_job(job: PreviewJob, paths: dict) -> None:
+    """
+    Records the stored previews {size: path} of the job's Blob on it and on its
+    files, which reappear in their owners' changes feeds, and drops the job.
+    """
+    storage = get_storage()
+    previews = {str(size): storage.public_url(path) for size, path in paths.items()}
+    with transaction.atomic():
+        if not Blob.objects.select_for_update().filter(id=job.blob_id).exists():
+            # Every file was deleted while the previews rendered
+            enqueue_storage_deletions(paths.values())
+            return
+        Blob.objects.filter(id=job.blob_id).update(previews=previews)
+        files = list(File.objects.filter(blob_id=job.blob_id).only("id", "user_id").order_by("user_id", "id"))
+        by_user = defaultdict(list)
+        for f in files:
+            by_user[f.user_id].append(f)
+        for user_id, user_files in by_user.items():
+            for f, seq in zip(user_files, claim_seqs(user_id, len(user_files))):
+                f.previews, f.seq = previews, seq
+        File.objects.bulk_update(files, ["previews", "seq"])
+        PreviewJob.objects.filter(id=job.id).delete()
+
+
+def _release_blob(blob: Blob) -> None:
+    """
+    Gives back a reference taken by `acquire_blob` that no File ended up
+    holding. A Blob left unreferenced is dropped and its objects queued for deletion.
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob.pk).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            Blob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") - 1)
+            return
+        paths = [blob.path] + [preview_path(blob.path, int(size)) for size in blob.previews or {}]
+        blob.delete()
+        enqueue_storage_deletions(paths)
+
+
+def _create_file(user, blob: Blob, name: str, size: int) -> File:
+    """
+    The File holding a reference to `blob` taken by `acquire_blob`. If it
+    cannot be created, the reference is released.
+    """
+    try:
+        with transaction.atomic():
+            file_obj = File.objects.create(
+                user=user,
+                name=name,
+                size=size,
+                blob=blob,
+                supabase_path=blob.path,
+                url=blob.url,
+                previews=blob.previews or {},
+                encoding=blob.encoding,
+                seq=claim_seqs(user.id)[0],
+            )
+            queue_previews([(blob, name)])
+    except Exception:
+        _release_blob(blob)
+        raise
+    return file_obj
+
+
+def store_file(user, django_file, name: str, size: int) -> File:
+    """
+    Records `django_file` as a `File` owned by `user`. Contents already in
+    storage are shared instead of being uploaded again.
+
+    Raises QuotaExceeded, before anything is transferred, if the file does not fit.
+    """
+    if not reserve_usage(user, [size])[0]:
+        raise QuotaExceeded()
+    try:
+        blob = acquire_blob(django_file, file_digest(django_file), size)
+        return _create_file(user, blob, name, size)
+    except Exception:
+        release_usage(user.id, size)
+        raise
+
+
+async def astore_file(user, django_file, name: str, size: int) -> File:
+    """
+    Async `store_file`.
+    """
+    if not (await sync_to_async(reserve_usage)(user, [size]))[0]:
+        raise QuotaExceeded()
+    try:
+        # Uploads received by the hashing handlers already carry their digest
+        digest = getattr(django_file, "sha256", None) or await sync_to_async(file_digest, thread_sensitive=False)(django_file)
+        blob = await aacquire_blob(django_file, digest, size)
+        return await sync_to_async(_create_file)(user, blob, name, size)
+    except Exception:
+        await sync_to_async(release_usage)(user.id, size)
+        raise
+
+
+def _upload_blobs(uploads: dict) -> tuple:
+    """
+    Sends {digest: django_file} to storage on up to ``UPLOAD_BATCH_WORKERS``
+    threads at once. Returns ({digest: path}, {digest: error message}).
+    """
+    storage = get_storage()
+    paths, errors = {}, {}
+    if not uploads:
+        return paths, errors
+
+    with ThreadPoolExecutor(max_workers=min(settings.UPLOAD_BATCH_WORKERS, len(uploads))) as pool:
+        # Each upload runs in a copy of this context, so it counts towards the request's metrics
+        futures = {
+            digest: pool.submit(contextvars.copy_context().run, _upload_blob, storage, digest, django_file)
+            for digest, django_file in uploads.items()
+        }
+        for digest, future in futures.items():
+            try:
+                paths[digest] = future.result()
+            except Exception as e:
+                errors[digest] = str(e) or e.__class__.__name__
+    return paths, errors
+
+
+def store_files(user, uploaded_files) -> list:
+    """
+    Records many uploads as `File`s owned by `user`. Contents not in storage yet
+    are uploaded concurrently; Blob references and File rows are written in one
+    transaction. Returns, in order, each file's `File` or its error message.
+
+    Files that do not fit in the user's quota are rejected before any transfer.
+    """
+    fits = reserve_usage(user, [f.size for f in uploaded_files])
+    accepted = [f for f, ok in zip(uploaded_files, fits) if ok]
+    try:
+        stored = iter(_store_batch(user, accepted))
+    except Exception:
+        if accepted:
+            release_usage(user.id, sum(f.size for f in accepted), len(accepted))
+        raise
+    results = [next(stored) if ok else str(QuotaExceeded()) for ok in fits]
+
+    failed = [f.size for f, ok, result in zip(uploaded_files, fits, results) if ok and isinstance(result, str)]
+    if failed:
+        release_usage(user.id, sum(failed), len(failed))
+    return results
+
+
+def _store_batch(user, uploaded_files) -> list:
+    storage = get_storage()
+    digests = [file_digest(f) for f in uploaded_files]
+    existing = set(Blob.objects.filter(digest__in=digests).values_list("digest", flat=True))
+    # Identical files in the batch are uploaded once
+    uploaded, errors = _upload_blobs({d: f for d, f in zip(digests, uploaded_files) if d not in existing})
+    sizes = dict(zip(digests, (f.size for f in uploaded_files)))
+
+    try:
+        with transaction.atomic():
+            Blob.objects.bulk_create(
+                [
+                    Blob(digest=d, size=sizes[d], path=path, url=storage.public_url(path), encoding=path_encoding(path))
+                    for d, path in uploaded.items()
+                ],
+                ignore_conflicts=True,
+            )
+            # Locked so a concurrent delete cannot release a Blob before it is referenced
+            blobs = {
+                blob.digest: blob
+                for blob in Blob.objects.select_for_update().filter(digest__in=set(digests) - set(errors)).order_by("id")
+            }
+            # A concurrent upload of the same bytes registered first; ours are surplus
+            enqueue_storage_deletions([path for d, path in uploaded.items() if d in blobs and blobs[d].path != path])
+
+            stored = [i for i, d in enumerate(digests) if d in blobs]
+            increments = defaultdict(list)
+            for d, count in Counter(digests[i] for i in stored).items():
+                increments[count].append(blobs[d].id)
+            for count, blob_ids in increments.items():
+                Blob.objects.filter(id__in=blob_ids).update(ref_count=F("ref_count") + count)
+
+            seqs = claim_seqs(user.id, len(stored)) if stored else []
+            files = File.objects.bulk_create([
+                File(
+                    user=user,
+                    name=uploaded_files[i].name,
+                    size=uploaded_files[i].size,
+                    blob=blobs[digests[i]],
+                    supabase_path=blobs[digests[i]].path,
+                    url=blobs[digests[i]].url,
+                    previews=blobs[digests[i]].previews or {},
+                    encoding=blobs[digests[i]].encoding,
+                    seq=seq,
+                )
+                for i, seq in zip(stored, seqs)
+            ])
+            queue_previews((blobs[digests[i]], uploaded_files[i].name) for i in stored)
+    except Exception:
+        # Rolled back: nothing references the objects just uploaded
+        enqueue_storage_deletions(list(uploaded.values()))
+        raise
+
+    results = [errors.get(d) for d in digests]
+    for i, file_obj in zip(stored, files):
+        results[i] = file_obj
+    for i, result in enumerate(results):
+        if result is None:
+            # Its Blob was released between the lookup and the lock: store it the one-at-a-time way
+            try:
+                blob = acquire_blob(uploaded_files[i], digests[i], uploaded_files[i].size)
+                results[i] = _create_file(user, blob, uploaded_files[i].name, uploaded_files[i].size)
+            except Exception as e:
+                results[i] = str(e) or e.__class__.__name__
+    return results
+
+
+def delete_file(file_obj: File) -> None:
+    """
+    Deletes `file_obj`; its stored object is queued for removal once nothing else references it.
+    """
+    delete_files([file_obj])
+
+
+async def adelete_file(file_obj: File) -> None:
+    # The deletion runs in one transaction, which needs a single thread
+    await sync_to_async(delete_file)(file_obj)
+
+
+# The columns file_payload reads, in its key order
+FILE_PAYLOAD_FIELDS = ("id", "name", "size", "uploaded_at", "url", "previews", "encoding")
+
+
+def row_payload(row: dict) -> dict:
+    """
+    `file_payload` of a ``values(*FILE_PAYLOAD_FIELDS)`` row, reusing the row
+    itself, for listings that skip building File instances.
+    """
+    row["encoding"] = row["encoding"] or None
+    return row
+
+
+def file_payload(file_obj: File) -> dict:
+    """
+    The JSON shape returned for a single file by the API.
+    """
+    return {
+        "id": file_obj.id,
+        "name": file_obj.name,
+        "size": file_obj.size,
+        "uploaded_at": file_obj.uploaded_at,
+        "url": file_obj.url,     # public URL
+        "previews": file_obj.previews,   # {size: public URL} of images and PDFs, once generated
+        "encoding": file_obj.encoding or None,   # codec the stored bytes behind url are compressed with
+    }
@@ -0,0 +1,74 @@
+from typing import Optional
+from django.conf import settings
+from .caching import TTLCache
+from .storage import get_storage
+
+# (path, expiry) -> signed URL. Shared paths (deduplicated blobs) share the URL.
+signed_url_cache = TTLCache(settings.SIGNED_URL_CACHE_SIZE)
+
+# Expiries handed out so far, so invalidation can find every key of a path
+_expiries = set()
+
+
+def _min_ttl(expiry: int) -> float:
+    # Never hand out a URL that might expire before the client gets to use it
+    return min(settings.SIGNED_URL_CACHE_MIN_TTL, expiry / 2)
+
+
+def signed_url(path: str, expiry: Optional[int] = None) -> Optional[str]:
+    """
+    A signed URL for `path`, reusing a cached one while it has enough lifetime left.
+    """
+    expiry = expiry or settings.SIGNED_URL_EXPIRY
+    url = signed_url_cache.get((path, expiry), min_ttl=_min_ttl(expiry))
+    if url is None:
+        url = get_storage().signed_url(path, expiry)
+        if url:
+            _expiries.add(expiry)
+            signed_url_cache.set((path, expiry), url, expiry)
+    return url
+
+
+async def asigned_url(path: str, expiry: Optional[int] = None) -> Optional[str]:
+    """
+    Async `signed_url`: same cache, signed through the backend's async client on a miss.
+    """
+    expiry = expiry or settings.SIGNED_URL_EXPIRY
+    url = signed_url_cache.get((path, expiry), min_ttl=_min_ttl(expiry))
+    if url is None:
+        url = await get_storage().asigned_url(path, expiry)
+        if url:
+            _expiries.add(expiry)
+            signed_url_cache.set((path, expiry), url, expiry)
+    return url
+
+
+def signed_urls(paths, expiry: Optional[int] = None) -> dict:
+    """
+    {path: signed URL} for many paths, signing only the cache misses, in one storage call.
+    """
+    expiry = expiry or settings.SIGNED_URL_EXPIRY
+    min_ttl = _min_ttl(expiry)
+    urls, misses = {}, []
+    for path in dict.fromkeys(paths):
+        url = signed_url_cache.get((path, expiry), min_ttl=min_ttl)
+        if url is None:
+            misses.append(path)
+        else:
+            urls[path] = url
+
+    if misses:
+        fresh = get_storage().signed_urls(misses, expiry)
+        _expiries.add(expiry)
+        for path, url in fresh.items():
+            signed_url_cache.set((path, expiry), url, expiry)
+        urls.update(fresh)
+    return urls
+
+
+def forget_signed_urls(path: str) -> None:
+    """
+    Drops every cached URL for `path`; called when the object is deleted.
+    """
+    for expiry in list(_expiries):
+        signed_url_cache.pop((path, expiry))
@@ -0,0 +1,351 @@
+import functools
+import io
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Iterator, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from .metrics import timed_storage
+
+# Bytes pulled from the uploaded file per read while streaming to storage.
+DEFAULT_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+LOCAL_SIGNING_SALT = "core.storage.LocalStorage"
+LOCAL_UPLOAD_SIGNING_SALT = "core.storage.LocalStorage.upload"
+
+
+class ChunkedFileStream(io.RawIOBase):
+    """
+    Read-only raw stream over a Django ``File``.
+
+    Wrapped in an ``io.BufferedReader`` it lets the storage client pull the
+    payload chunk by chunk instead of receiving one big bytes object, so the
+    worker only ever holds one chunk of the upload in memory.
+    """
+
+    def __init__(self, django_file):
+        self._file = django_file
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._file.seek(offset, whence)
+        return self._file.tell()
+
+    def tell(self):
+        return self._file.tell()
+
+    def readinto(self, buffer):
+        data = self._file.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        return size
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class CappedStream(io.RawIOBase):
+    """
+    Read-only raw stream over a request body that raises ``UploadTooLarge``
+    as soon as more than `limit` bytes come through, whatever the client
+    declared as its Content-Length.
+    """
+
+    def __init__(self, stream, limit: int):
+        self._stream = stream
+        self._limit = limit
+        self._received = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # One byte past the limit is enough to tell that the body is too large
+        wanted = min(len(buffer), self._limit + 1 - self._received)
+        data = self._stream.read(wanted) if wanted > 0 else b""
+        self._received += len(data)
+        if self._received > self._limit:
+            raise UploadTooLarge(f"Upload is larger than the {self._limit} bytes allowed.")
+        size = len(data)
+        buffer[:size] = data
+        return size
+
+
+def upload_chunk_size(chunk_size: Optional[int] = None) -> int:
+    return chunk_size or getattr(settings, "STORAGE_UPLOAD_CHUNK_SIZE", DEFAULT_UPLOAD_CHUNK_SIZE)
+
+
+def open_upload_stream(django_file, chunk_size: Optional[int] = None) -> io.BufferedReader:
+    """
+    Returns a buffered reader that pulls `django_file` in `chunk_size` pieces.
+    """
+    django_file.seek(0)
+    return io.BufferedReader(ChunkedFileStream(django_file), buffer_size=upload_chunk_size(chunk_size))
+
+
+async def aupload_chunks(django_file, chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """
+    Yields `django_file` in `chunk_size` pieces, each read in a worker thread
+    so that the event loop never waits on the disk.
+    """
+    read = sync_to_async(django_file.read, thread_sensitive=False)
+    size = upload_chunk_size(chunk_size)
+    django_file.seek(0)
+    while chunk := await read(size):
+        yield chunk
+
+
+class StorageBackend:
+    """
+    Where file contents live. Paths are bucket-relative, e.g. "user_id/uuid_filename.ext".
+
+    The ``a``-prefixed methods serve the async views. By default they run the
+    blocking method in a worker thread; backends with an async client override them.
+
+    Subclasses' own implementations of the methods in ``TIMED_METHODS`` are
+    wrapped so that their time counts towards the current request's metrics.
+    """
+
+    # Whether URLs to a compressed object deliver it with Content-Encoding, so
+    # clients get the original bytes; new objects are only compressed if so
+    serves_content_encoding = False
+
+    TIMED_METHODS = ("upload", "signed_url", "signed_urls", "signed_upload_url", "delete", "stat", "stream", "aupload", "asigned_url", "asigned_urls")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in cls.TIMED_METHODS:
+            if name in cls.__dict__:
+                setattr(cls, name, timed_storage(cls.__dict__[name]))
+
+    def upload(self, path: str, django_file, content_type: Optional[str] = None, overwrite: bool = False) -> None:
+        """Streams `django_file` to `path`."""
+        raise NotImplementedError
+
+    def public_url(self, path: str) -> str:
+        """URL anyone can use to fetch `path` (public buckets)."""
+        raise NotImplementedError
+
+    def signed_url(self, path: str, expiry: int = 3600) -> Optional[str]:
+        """URL valid for `expiry` seconds that fetches `path`."""
+        raise NotImplementedError
+
+    def signed_urls(self, paths: list, expiry: int = 3600) -> dict:
+        """{path: signed URL} for many paths; backends with a batch API override this."""
+        urls = {}
+        for path in paths:
+            url = self.signed_url(path, expiry)
+            if url:
+                urls[path] = url
+        return urls
+
+    def signed_upload_url(self, path: str, size: int, content_type: str = "", expiry: int = 3600) -> dict:
+        """
+        {"url", "method", "headers"} of a request that stores `size` bytes at
+        `path` without going through this server. Fails if `path` exists.
+        """
+        raise NotImplementedError
+
+    def delete(self, paths: list) -> bool:
+        """Removes every object in `paths`. Returns True on success."""
+        raise NotImplementedError
+
+    def stat(self, path: str) -> Optional[dict]:
+        """{"size": bytes} for `path`, or None if there is no such object."""
+        raise NotImplementedError
+
+    def stream(self, path: str, chunk_size: int = 64 * 1024, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Yields the bytes of `path` from `start` to `end` (inclusive) in `chunk_size` pieces."""
+        raise NotImplementedError
+
+    async def aupload(self, path: str, django_file, content_type: Optional[str] = None, overwrite: bool = False) -> None:
+        await sync_to_async(self.upload, thread_sensitive=False)(path, django_file, content_type, overwrite)
+
+    async def asigned_url(self, path: str, expiry: int = 3600) -> Optional[str]:
+        return await sync_to_async(self.signed_url, thread_sensitive=False)(path, expiry)
+
+    async def asigned_urls(self, paths: list, expiry: int = 3600) -> dict:
+        return await sync_to_async(self.signed_urls, thread_sensitive=False)(paths, expiry)
+
+
+class SupabaseStorage(StorageBackend):
+    """
+    Supabase Storage bucket (``SUPABASE_BUCKET``), via ``core.supabase_upload``.
+    The bucket serves objects without a Content-Encoding, so uploads are stored uncompressed.
+    """
+
+    def __init__(self):
+        # Imported here so other backends work without Supabase credentials
+        from . import supabase_upload
+        self._api = supabase_upload
+
+    def upload(self, path, django_file, content_type=None, overwrite=False):
+        self._api.upload_file_to_supabase(django_file, path, content_type=content_type, upsert=overwrite)
+
+    def public_url(self, path):
+        return self._api.get_public_url(path)
+
+    def signed_url(self, path, expiry=3600):
+        return self._api.get_signed_url(path, expiry)
+
+    def signed_urls(self, paths, expiry=3600):
+        return self._api.get_signed_urls(paths, expiry)
+
+    def signed_upload_url(self, path, size, content_type="", expiry=3600):
+        # Supabase fixes the lifetime of upload URLs at two hours
+        return {
+            "url": self._api.get_signed_upload_url(path),
+            "method": "PUT",
+            "headers": {"Content-Type": content_type or "application/octet-stream"},
+        }
+
+    def delete(self, paths):
+        return self._api.delete_files_supabase(paths)
+
+    def stat(self, path):
+        return self._api.stat_file_supabase(path)
+
+    def stream(self, path, chunk_size=64 * 1024, start=0, end=None):
+        return self._api.stream_file_supabase(path, chunk_size, start, end)
+
+    async def aupload(self, path, django_file, content_type=None, overwrite=False):
+        await self._api.aupload_file_to_supabase(django_file, path, content_type=content_type, upsert=overwrite)
+
+    async def asigned_url(self, path, expiry=3600):
+        return await self._api.aget_signed_url(path, expiry)
+
+    async def asigned_urls(self, paths, expiry=3600):
+        return await self._api.aget_signed_urls(paths, expiry)
+
+
+class LocalStorage(StorageBackend):
+    """
+    Files on local disk under ``LOCAL_STORAGE_ROOT`` (``MEDIA_ROOT/uploads`` by default).
+
+    Public URLs point at ``LOCAL_STORAGE_URL``; signed URLs are served by
+    ``LocalStorageDownloadView`` and carry their own expiry. Signed upload URLs
+    are accepted by ``LocalStorageUploadView``, standing in for the bucket.
+    """
+
+    # LocalStorageDownloadView sends compressed objects with their Content-Encoding
+    serves_content_encoding = True
+
+    def __init__(self, root: Optional[str] = None, base_url: Optional[str] = None):
+        self.root = Path(root or settings.LOCAL_STORAGE_ROOT).resolve()
+        self.base_url = base_url or settings.LOCAL_STORAGE_URL
+
+    def path(self, path: str) -> Path:
+        """Absolute location of `path`, refusing anything that escapes the root."""
+        full = (self.root / path).resolve()
+        if full != self.root and self.root not in full.parents:
+            raise ValueError(f"Path escapes storage root: {path}")
+        return full
+
+    def upload(self, path, django_file, content_type=None, overwrite=False):
+        target = self.path(path)
+        if target.exists() and not overwrite:
+            raise FileExistsError(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as out:
+                for chunk in django_file.chunks(upload_chunk_size()):
+                    out.write(chunk)
+            os.replace(tmp_path, target)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def public_url(self, path):
+        return f"{self.base_url}{path}"
+
+    def signed_url(self, path, expiry=3600):
+        token = signing.dumps({"path": path, "exp": int(time.time()) + expiry}, salt=LOCAL_SIGNING_SALT)
+        return reverse("local_storage_download", args=[token])
+
+    async def asigned_url(self, path, expiry=3600):
+        # Signing is local and cheap: no need for a thread
+        return self.signed_url(path, expiry)
+
+    def signed_upload_url(self, path, size, content_type="", expiry=3600):
+        token = signing.dumps({"path": path, "size": size, "exp": int(time.time()) + expiry}, salt=LOCAL_UPLOAD_SIGNING_SALT)
+        return {
+            "url": reverse("local_storage_upload", args=[token]),
+            "method": "PUT",
+            "headers": {"Content-Type": content_type or "application/octet-stream"},
+        }
+
+    @staticmethod
+    def _load_token(token: str, salt: str) -> Optional[dict]:
+        try:
+            payload = signing.loads(token, salt=salt)
+        except signing.BadSignature:
+            return None
+        if payload.get("exp", 0) < time.time():
+            return None
+        return payload
+
+    def unsign(self, token: str) -> Optional[str]:
+        """The path a signed URL token grants access to, or None if it is invalid or expired."""
+        payload = self._load_token(token, LOCAL_SIGNING_SALT)
+        return None if payload is None else payload.get("path")
+
+    def unsign_upload(self, token: str) -> Optional[tuple]:
+        """(path, most bytes) a signed upload URL token allows, or None if it is invalid or expired."""
+        payload = self._load_token(token, LOCAL_UPLOAD_SIGNING_SALT)
+        return None if payload is None else (payload["path"], payload["size"])
+
+    def delete(self, paths):
+        for path in paths:
+            try:
+                self.path(path).unlink()
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError):
+                return False
+        return True
+
+    def stat(self, path):
+        try:
+            return {"size": self.path(path).stat().st_size}
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def stream(self, path, chunk_size=64 * 1024, start=0, end=None):
+        with open(self.path(path), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+
+@functools.lru_cache(maxsize=None)
+def get_storage() -> StorageBackend:
+    """
+    The storage backend selected by ``STORAGE_BACKEND``, shared by the process.
+    """
+    return import_string(settings.STORAGE_BACKEND)()
+
+
+@receiver(setting_changed)
+def reset_storage(*, setting, **kwargs):
+    if setting in ("STORAGE_BACKEND", "LOCAL_STORAGE_ROOT", "LOCAL_STORAGE_URL"):
+        get_storage.cache_clear()
@@ -1,32 +1,76 @@
 import os
-from typing import Optional
-from supabase_client import supabase
+from typing import Iterator, Optional
+from urllib.parse import quote
+from asgiref.sync import sync_to_async
+from storage3 import AsyncStorageClient
+from storage3.exceptions import StorageApiError
+from supabase_client import async_http_client, auth_headers, http_client, storage_client, storage_url
+from .storage import aupload_chunks, open_upload_stream
 
 BUCKET = os.getenv("SUPABASE_BUCKET", "cloud-storage")
 
-def upload_file_to_supabase(django_file, path: str):
+def bucket():
+    """
+    The bucket through the process's shared storage client.
+    """
+    return storage_client().from_(BUCKET)
+
+def async_bucket(http):
+    """
+    The bucket through storage3's async client, on `http`, the serving loop's
+    async httpx client (see `supabase_client.async_http_client`).
+    """
+    return AsyncStorageClient(storage_url(), auth_headers(), http_client=http).from_(BUCKET)
+
+def _file_options(django_file, content_type: Optional[str], upsert: bool) -> dict:
+    file_options = {
+        "content-type": content_type or getattr(django_file, "content_type", None) or "application/octet-stream"
+    }
+    if upsert:
+        file_options["upsert"] = "true"
+    return file_options
+
+def _signed_url(res) -> Optional[str]:
+    # typical dict shape: {"signedURL": "https://..."} or {"signed_url": "..."}
+    if isinstance(res, dict):
+        return res.get("signedURL") or res.get("signed_url") or res.get("signedUrl") or ""
+    if isinstance(res, str):
+        return res
+    return None
+
+def _signed_urls(res) -> dict:
+    urls = {}
+    for item in res or []:
+        url = item.get("signedURL") or item.get("signed_url") or item.get("signedUrl")
+        if url and not item.get("error"):
+            urls[item.get("path")] = url
+    return urls
+
+def upload_file_to_supabase(django_file, path: str, chunk_size: Optional[int] = None, content_type: Optional[str] = None, upsert: bool = False):
     """
     Upload file bytes to supabase at given path.
     `path` example: "user_id/uuid_filename.ext"
+
+    The file is streamed in `chunk_size` pieces (``STORAGE_UPLOAD_CHUNK_SIZE``
+    by default) rather than read into memory in one go.
     """
-    # Read bytes
-    data = django_file.read()
+    stream = open_upload_stream(django_file, chunk_size)
+    file_options = _file_options(django_file, content_type, upsert)
     # Some client versions expect (path, file) positional args, others keyword.
     # Try typical signature first.
     try:
-        res = supabase.storage.from_(BUCKET).upload(path=path, file=data, file_options={
-            "content-type": getattr(django_file, "content_type", "application/octet-stream")
-        })
+        res = bucket().upload(path=path, file=stream, file_options=file_options)
     except TypeError:
         # Fallback: positional args
-        res = supabase.storage.from_(BUCKET).upload(path, data)
+        stream = open_upload_stream(django_file, chunk_size)
+        res = bucket().upload(path, stream)
     return res
 
 def get_public_url(path: str) -> str:
     """
     Returns the public URL for a file in the bucket (works for public buckets).
     """
-    res = supabase.storage.from_(BUCKET).get_public_url(path)
+    res = bucket().get_public_url(path)
     # get_public_url commonly returns a dict like {"publicUrl": "..."} or a string depending on client version.
     if isinstance(res, dict):
         # common shape: {"publicUrl": "https://..."}
@@ -40,34 +84,96 @@ def get_signed_url(path: str, expiry: int = 3600) -> Optional[str]:
     Returns a signed URL valid for `expiry` seconds (useful for private buckets).
     """
     try:
-        res = supabase.storage.from_(BUCKET).create_signed_url(path, expiry)
+        res = bucket().create_signed_url(path, expiry)
     except TypeError:
         # some clients might return different shapes
-        res = supabase.storage.from_(BUCKET).create_signed_url(path, expiry)
-    # typical dict shape: {"signedURL": "https://..."} or {"signed_url": "..."}
-    if isinstance(res, dict):
-        return res.get("signedURL") or res.get("signed_url") or res.get("signedUrl") or ""
-    if isinstance(res, str):
-        return res
-    return None
+        res = bucket().create_signed_url(path, expiry)
+    return _signed_url(res)
+
+def get_signed_urls(paths: list, expiry: int = 3600) -> dict:
+    """
+    Signs every path in `paths` with a single request.
+    Returns {path: signed URL}; paths the bucket could not sign are left out.
+    """
+    res = bucket().create_signed_urls(list(paths), expiry)
+    return _signed_urls(res)
+
+def get_signed_upload_url(path: str) -> str:
+    """
+    Returns a URL that accepts one PUT of the object at `path`, valid for two hours.
+    """
+    res = bucket().create_signed_upload_url(path)
+    return res.get("signed_url") or res.get("signedUrl") or ""
+
+async def aupload_file_to_supabase(django_file, path: str, chunk_size: Optional[int] = None, content_type: Optional[str] = None, upsert: bool = False):
+    """
+    Async counterpart of `upload_file_to_supabase`: under ASGI the body is
+    sent from the event loop as it is read, a chunk at a time in a worker
+    thread, so a slow bucket holds a coroutine rather than a thread. Elsewhere
+    the sync upload runs in a thread, on the shared pool.
+    """
+    http = async_http_client()
+    if http is None:
+        return await sync_to_async(upload_file_to_supabase, thread_sensitive=False)(django_file, path, chunk_size, content_type, upsert)
+    # storage3 only sends multipart bodies, which httpx reads synchronously, so the object goes as a raw body
+    options = _file_options(django_file, content_type, upsert)
+    headers = {**auth_headers(), "Content-Type": options["content-type"], "x-upsert": options.get("upsert", "false")}
+    if getattr(django_file, "size", None) is not None:
+        headers["Content-Length"] = str(django_file.size)
+    response = await http.post(
+        f"{storage_url()}object/{BUCKET}/{quote(path)}", content=aupload_chunks(django_file, chunk_size), headers=headers,
+    )
+    if response.is_error:
+        try:
+            error = response.json()
+        except ValueError:
+            error = {}
+        raise StorageApiError(error.get("message", response.text), error.get("error", ""), error.get("statusCode", response.status_code))
+    return response.json()
+
+async def aget_signed_url(path: str, expiry: int = 3600) -> Optional[str]:
+    """
+    Async counterpart of `get_signed_url`.
+    """
+    http = async_http_client()
+    if http is None:
+        return await sync_to_async(get_signed_url, thread_sensitive=False)(path, expiry)
+    return _signed_url(await async_bucket(http).create_signed_url(path, expiry))
+
+async def aget_signed_urls(paths: list, expiry: int = 3600) -> dict:
+    """
+    Async counterpart of `get_signed_urls`.
+    """
+    http = async_http_client()
+    if http is None:
+        return await sync_to_async(get_signed_urls, thread_sensitive=False)(paths, expiry)
+    return _signed_urls(await async_bucket(http).create_signed_urls(list(paths), expiry))
 
 def delete_file_supabase(path: str) -> bool:
     """
     Deletes a file at `path` from the configured bucket.
     Returns True on success, False otherwise.
     """
-    storage = supabase.storage.from_(BUCKET)
+    return delete_files_supabase([path])
+
+def delete_files_supabase(paths: list) -> bool:
+    """
+    Deletes every file in `paths` from the configured bucket in one call.
+    Returns True on success, False otherwise.
+    """
+    storage = bucket()
 
     # Most common API: remove(list_of_paths)
     try:
         # remove usually expects a list of paths
         if hasattr(storage, "remove"):
-            result = storage.remove([path])
+            result = storage.remove(list(paths))
             # success shapes vary; we'll treat any falsy/exception as failure
             return True
         # fallback to delete/remove single
         if hasattr(storage, "delete"):
-            storage.delete(path)
+            for path in paths:
+                storage.delete(path)
             return True
     except Exception as e:
         # log if you want; don't crash the caller
@@ -76,3 +182,46 @@ def delete_file_supabase(path: str) -> bool:
 
     # If neither method exists, return False
     return False
+
+def stat_file_supabase(path: str) -> Optional[dict]:
+    """
+    Returns {"size": bytes} for the object at `path`, or None if it does not exist.
+    """
+    try:
+        res = bucket().info(path)
+    except StorageApiError as e:
+        # Missing objects are a 404 (a 400 on older Storage API versions); other errors propagate
+        if str(e.status) in ("400", "404"):
+            return None
+        raise
+    if not isinstance(res, dict):
+        return None
+    size = res.get("size")
+    if size is None:
+        size = (res.get("metadata") or {}).get("size")
+    return {"size": int(size or 0)}
+
+def stream_file_supabase(path: str, chunk_size: int, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Yields the bytes of `path` (optionally only `start`..`end`, inclusive) in `chunk_size` pieces.
+    Goes through a short-lived signed URL so the object never has to fit in memory.
+    A missing object raises FileNotFoundError.
+    """
+    if end is not None and end < start:
+        return
+    try:
+        url = get_signed_url(path, expiry=60)
+    except StorageApiError as e:
+        if str(e.status) in ("400", "404"):
+            raise FileNotFoundError(path) from e
+        raise
+    if not url:
+        raise FileNotFoundError(path)
+    headers = {}
+    if start or end is not None:
+        headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+    with http_client().stream("GET", url, headers=headers) as response:
+        if response.status_code in (400, 404):
+            raise FileNotFoundError(path)
+        response.raise_for_status()
+        yield from response.iter_bytes(chunk_size)
@@ -1,3 +1,1398 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+import httpx
+import supabase_client
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connections
+from django.http import FileResponse
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.test.client import FakePayload
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from storage3.exceptions import StorageApiError
+
+from . import chunked_upload, metrics, previews, supabase_upload
+from .models import Blob, DirectUpload, File, FileTombstone, PreviewJob, StorageDeletion, StorageUsage, UploadSession
+from .caching import TTLCache
+from .compression import compress_upload, compressed_upload
+from .renderers import ORJSONRenderer, dumps, stream_array
+from .management.commands.serve import close_connections_after_each_request, tune
+from .services import file_payload, process_preview_jobs, store_file
+from .signed_urls import signed_url_cache
+from .storage import LocalStorage, SupabaseStorage, get_storage, open_upload_stream
+
+
+class FakeBucket:
+    """Stands in for a supabase storage bucket and drains uploads like httpx does."""
+
+    read_size = 64 * 1024
+
+    def __init__(self):
+        self.uploaded = {}
+        self.digests = {}
+
+    def upload(self, path, file, file_options=None):
+        size = 0
+        digest = hashlib.sha256()
+        chunk = file.read(self.read_size)
+        while chunk:
+            size += len(chunk)
+            digest.update(chunk)
+            chunk = file.read(self.read_size)
+        self.uploaded[path] = size
+        self.digests[path] = digest.hexdigest()
+        return {"Key": path}
+
+    def get_public_url(self, path):
+        return f"https://storage.test/{path}"
+
+    def create_signed_upload_url(self, path):
+        return {"signed_url": f"https://storage.test/upload/sign/{path}?token=t", "token": "t", "path": path}
+
+
+def use_local_storage(test):
+    """Points the storage backend at a throwaway directory for the duration of `test`."""
+    root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, root, ignore_errors=True)
+    override = override_settings(STORAGE_BACKEND="core.storage.LocalStorage", LOCAL_STORAGE_ROOT=root, UPLOAD_SESSION_ROOT=f"{root}/.sessions")
+    override.enable()
+    test.addCleanup(override.disable)
+    return get_storage()
+
+
+class StorageTestCase(TestCase):
+    """Authenticated API client against local-disk storage."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.storage = use_local_storage(self)
+        signed_url_cache.clear()
+
+    def stored_bytes(self, file_id):
+        return self.storage.path(File.objects.get(id=file_id).supabase_path).read_bytes()
+
+
+class StreamingUploadTests(StorageTestCase):
+    chunk_size = 256 * 1024
+
+    def upload_peak(self, size):
+        """Uploads `size` bytes and returns the peak memory allocated while sending them to storage."""
+        upload = SimpleUploadedFile("blob.bin", b"x" * size, content_type="application/octet-stream")
+        measured = {}
+        real_upload = LocalStorage.upload
+
+        def measuring_upload(storage, *args, **kwargs):
+            tracemalloc.start()
+            try:
+                return real_upload(storage, *args, **kwargs)
+            finally:
+                measured["peak"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+        with mock.patch.object(LocalStorage, "upload", measuring_upload):
+            response = self.client.post("/api/upload/", {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.stored_bytes(response.data["id"])), size)
+        return measured["peak"]
+
+    @override_settings(STORAGE_UPLOAD_CHUNK_SIZE=chunk_size)
+    def test_peak_memory_stays_flat_as_uploads_grow(self):
+        small = self.upload_peak(4 * self.chunk_size)
+        large = self.upload_peak(128 * self.chunk_size)
+        # A whole-file read would make the 32 MiB upload cost 32x the small one.
+        self.assertLess(large, 4 * self.chunk_size)
+        self.assertLess(large - small, self.chunk_size)
+
+    def test_stream_reads_in_configured_chunks(self):
+        django_file = SimpleUploadedFile("a.txt", b"abcdefghij")
+        django_file.read(3)
+        stream = open_upload_stream(django_file, chunk_size=4)
+        self.assertEqual(stream.read(), b"abcdefghij")
+
+
+class SupabaseStorageTests(TestCase):
+
+    def setUp(self):
+        self.bucket = FakeBucket()
+        client = mock.Mock()
+        client.from_.return_value = self.bucket
+        patcher = mock.patch.object(supabase_upload, "storage_client", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_upload_streams_file_object_to_bucket(self):
+        content = b"y" * (300 * 1024)
+        SupabaseStorage().upload("1/a.bin", SimpleUploadedFile("a.bin", content))
+        self.assertEqual(self.bucket.uploaded["1/a.bin"], len(content))
+        self.assertEqual(SupabaseStorage().public_url("1/a.bin"), "https://storage.test/1/a.bin")
+
+    async def test_async_calls_share_the_serving_loops_client_until_shutdown(self):
+        clients, requests, new_client = [], [], httpx.AsyncClient
+
+        def respond(request):
+            requests.append(request)
+            if "/object/sign/" in request.url.path:
+                return httpx.Response(200, json={"signedURL": "/object/sign/1/a.txt?token=t"})
+            return httpx.Response(200, json={"Key": "cloud-storage/1/a.bin"})
+
+        def client(**options):
+            clients.append(new_client(transport=httpx.MockTransport(respond)))
+            return clients[-1]
+
+        messages, shutdown, sent = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]), asyncio.Event(), []
+
+        async def receive():
+            message = next(messages)
+            if message["type"] == "lifespan.shutdown":
+                await shutdown.wait()
+            return message
+
+        async def send(message):
+            sent.append(message["type"])
+
+        with mock.patch("httpx.AsyncClient", client), \
+                mock.patch.object(supabase_upload, "storage_url", return_value="http://supabase.test/storage/v1/"), \
+                mock.patch.object(supabase_upload, "auth_headers", return_value={"apiKey": "test-key"}):
+            lifespan = asyncio.ensure_future(supabase_client.lifespan(None)({"type": "lifespan"}, receive, send))
+            await asyncio.sleep(0)
+            url = await supabase_upload.aget_signed_url("1/a.txt")
+            await supabase_upload.aget_signed_url("1/a.txt")
+            await supabase_upload.aupload_file_to_supabase(SimpleUploadedFile("a.bin", b"0123456789"), "1/a.bin", chunk_size=4)
+            self.assertEqual(len(clients), 1)
+            self.assertFalse(clients[0].is_closed)
+            shutdown.set()
+            await lifespan
+        self.assertIn("token=t", url)
+        self.assertTrue(clients[0].is_closed)
+        self.assertEqual(sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+        self.assertEqual(requests[-1].url.path, f"/storage/v1/object/{supabase_upload.BUCKET}/1/a.bin")
+        self.assertEqual(requests[-1].content, b"0123456789")
+
+    async def test_async_calls_use_the_sync_pool_outside_asgi(self):
+        with mock.patch("httpx.AsyncClient") as client:
+            await supabase_upload.aupload_file_to_supabase(SimpleUploadedFile("a.bin", b"x" * 10), "1/a.bin")
+        client.assert_not_called()
+        self.assertEqual(self.bucket.uploaded["1/a.bin"], 10)
+
+    def test_stat_only_treats_not_found_as_missing(self):
+        self.bucket.info = mock.Mock(return_value={"size": 5})
+        self.assertEqual(SupabaseStorage().stat("1/a.txt"), {"size": 5})
+        self.bucket.info.side_effect = StorageApiError("Object not found", "not_found", "404")
+        self.assertIsNone(SupabaseStorage().stat("1/a.txt"))
+        self.bucket.info.side_effect = StorageApiError("Invalid JWT", "Unauthorized", 403)
+        with self.assertRaises(StorageApiError):
+            SupabaseStorage().stat("1/a.txt")
+
+    def test_signed_upload_url_is_a_put_to_the_bucket(self):
+        target = SupabaseStorage().signed_upload_url("1/abc_a.txt", 5, "text/plain")
+        self.assertEqual(target["url"], "https://storage.test/upload/sign/1/abc_a.txt?token=t")
+        self.assertEqual(target["method"], "PUT")
+        self.assertEqual(target["headers"], {"Content-Type": "text/plain"})
+
+
+class SupabaseClientTests(TestCase):
+
+    def setUp(self):
+        supabase_client.close()
+        for name, value in (("SUPABASE_URL", "http://supabase.test"), ("SUPABASE_SERVICE_KEY", "test-key")):
+            patcher = mock.patch.object(supabase_client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        supabase_client.close()
+
+    def test_one_pooled_client_is_created_on_first_use_and_shared(self):
+        self.assertIsNone(supabase_client._storage)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            clients = set(pool.map(lambda _: id(supabase_client.storage_client()), range(32)))
+        self.assertEqual(len(clients), 1)
+        http = supabase_client.http_client()
+        self.assertIs(supabase_client.storage_client().session, http)
+        self.assertEqual(http._transport._pool._max_connections, supabase_client.SUPABASE_POOL_SIZE)
+
+    def test_forked_children_start_without_the_parents_client(self):
+        parent = supabase_client.storage_client()
+        supabase_client._forget_after_fork()
+        self.assertIsNone(supabase_client._http)
+        self.assertIsNot(supabase_client.storage_client(), parent)
+        parent.session.close()
+
+
+class LocalStorageTests(StorageTestCase):
+
+    def test_upload_download_and_delete(self):
+        response = self.client.post("/api/upload/", {"file": SimpleUploadedFile("notes.txt", b"hello")}, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        file_id = response.data["id"]
+        self.assertEqual(self.stored_bytes(file_id), b"hello")
+
+        download_url = self.client.get(f"/api/download/{file_id}/").data["download_url"]
+        download = APIClient().get(download_url)
+        self.assertEqual(b"".join(download.streaming_content), b"hello")
+
+        path = File.objects.get(id=file_id).supabase_path
+        self.assertEqual(self.client.delete(f"/api/delete/{file_id}/").status_code, 204)
+        call_command("process_storage_deletions", "--once", stdout=StringIO())
+        self.assertIsNone(self.storage.stat(path))
+
+    def test_stream_honours_byte_range(self):
+        self.storage.upload("1/abc.txt", SimpleUploadedFile("abc.txt", b"0123456789"))
+        self.assertEqual(b"".join(self.storage.stream("1/abc.txt", chunk_size=3, start=2, end=6)), b"23456")
+
+    def test_signed_urls_expire_and_paths_cannot_escape_root(self):
+        self.storage.upload("1/abc.txt", SimpleUploadedFile("abc.txt", b"x"))
+        expired = self.storage.signed_url("1/abc.txt", expiry=-1)
+        self.assertEqual(APIClient().get(expired).status_code, 404)
+        with self.assertRaises(ValueError):
+            self.storage.path("../outside.txt")
+
+
+class ResumableUploadTests(StorageTestCase):
+
+    def start(self, payload):
+        response = self.client.post("/api/uploads/", {"name": "video.mp4", **payload}, format="json")
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def put_chunk(self, upload_id, index, data):
+        return self.client.put(f"/api/uploads/{upload_id}/chunks/{index}/", data, content_type="application/octet-stream")
+
+    def test_out_of_order_chunks_commit_to_a_single_file(self):
+        content = bytes(range(256)) * 10
+        session = self.start({"size": len(content), "chunk_size": 1000})
+        self.assertEqual(session["total_chunks"], 3)
+
+        for index in (2, 0):
+            self.assertEqual(self.put_chunk(session["upload_id"], index, content[index * 1000:(index + 1) * 1000]).status_code, 200)
+
+        status = self.client.get(f"/api/uploads/{session['upload_id']}/")
+        self.assertEqual(status.data["received"], [0, 2])
+        self.assertEqual(status.data["missing"], [1])
+
+        incomplete = self.client.post(f"/api/uploads/{session['upload_id']}/commit/")
+        self.assertEqual(incomplete.status_code, 409)
+        self.assertEqual(incomplete.data["missing"], [1])
+
+        self.put_chunk(session["upload_id"], 1, content[1000:2000])
+        committed = self.client.post(f"/api/uploads/{session['upload_id']}/commit/")
+        self.assertEqual(committed.status_code, 201)
+
+        file_obj = File.objects.get(id=committed.data["id"])
+        self.assertEqual((file_obj.name, file_obj.size), ("video.mp4", len(content)))
+        self.assertEqual(self.stored_bytes(file_obj.id), content)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_chunk_of_wrong_size_is_rejected(self):
+        session = self.start({"size": 1500, "chunk_size": 1000})
+        self.assertEqual(self.put_chunk(session["upload_id"], 0, b"x" * 999).status_code, 400)
+        self.assertEqual(self.put_chunk(session["upload_id"], 1, b"x" * 501).status_code, 400)
+        self.assertEqual(self.put_chunk(session["upload_id"], 2, b"").status_code, 400)
+        self.assertEqual(self.client.get(f"/api/uploads/{session['upload_id']}/").data["received"], [])
+
+    def test_sessions_are_private(self):
+        session = self.start({"size": 10})
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username="bob", password="pw"))
+        self.assertEqual(other.get(f"/api/uploads/{session['upload_id']}/").status_code, 404)
+
+    def test_purge_removes_expired_sessions_and_chunks(self):
+        session = self.start({"size": 4, "chunk_size": 2})
+        self.put_chunk(session["upload_id"], 0, b"ab")
+        upload = UploadSession.objects.get()
+        UploadSession.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        call_command("purge_upload_sessions", stdout=StringIO())
+
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(chunked_upload.session_dir(upload).exists())
+
+
+class DirectUploadTests(StorageTestCase):
+
+    def open_slot(self, name="notes.txt", size=5):
+        response = self.client.post("/api/uploads/direct/", {"name": name, "size": size, "content_type": "text/plain"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def put(self, slot, data):
+        return Client().put(slot["upload_url"], data, content_type=slot["headers"]["Content-Type"])
+
+    def test_overlong_names_are_refused_before_anything_is_reserved(self):
+        name = "x" * 252 + ".txt"
+        for url in ("/api/uploads/direct/", "/api/uploads/"):
+            response = self.client.post(url, {"name": name, "size": 5}, format="json")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("at most 255 characters", response.data["error"])
+        self.assertFalse(DirectUpload.objects.exists())
+        self.assertFalse(UploadSession.objects.exists())
+
+        # Multipart file names are cut to 255 characters by Django as they are parsed
+        response = self.client.post("/api/upload/", {"file": SimpleUploadedFile(name, b"hello")}, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["name"], "x" * 251 + ".txt")
+
+    def test_upload_goes_to_storage_and_finalize_creates_the_file(self):
+        slot = self.open_slot()
+        self.assertEqual(slot["method"], "PUT")
+        self.assertTrue(slot["upload_url"].startswith("http://testserver/api/storage/upload/"))
+
+        early = self.client.post(f"/api/uploads/direct/{slot['upload_id']}/finalize/")
+        self.assertEqual(early.status_code, 409)
+
+        self.assertEqual(self.put(slot, b"hello").status_code, 200)
+        self.assertEqual(self.put(slot, b"again").status_code, 409)
+        response = self.client.post(f"/api/uploads/direct/{slot['upload_id']}/finalize/")
+        self.assertEqual(response.status_code, 201)
+
+        file_obj = File.objects.get(id=response.data["id"])
+        self.assertIsNone(file_obj.blob_id)
+        self.assertRegex(file_obj.supabase_path, rf"^{self.user.id}/[0-9a-f]{{32}}_notes\.txt$")
+        self.assertEqual(self.stored_bytes(file_obj.id), b"hello")
+        self.assertEqual(StorageUsage.objects.get(user=self.user).bytes_used, 5)
+        self.assertFalse(DirectUpload.objects.exists())
+        self.assertEqual(self.client.post(f"/api/uploads/direct/{slot['upload_id']}/finalize/").status_code, 404)
+
+        self.client.delete(f"/api/delete/{file_obj.id}/")
+        self.assertTrue(StorageDeletion.objects.filter(path=file_obj.supabase_path).exists())
+
+    def test_uploads_must_match_the_declared_size(self):
+        slot = self.open_slot(size=3)
+        self.assertEqual(self.put(slot, b"toolong").status_code, 413)
+        self.assertEqual(Client().put("/api/storage/upload/bogus/", b"x").status_code, 403)
+
+        # Without a Content-Length (chunked, under ASGI) the body itself is cut off at the limit
+        slot = self.open_slot(size=3)
+        path = slot["upload_url"].removeprefix("http://testserver")
+        response = async_to_sync(AsyncClient().request)(
+            method="PUT", path=path, query_string="", headers=[(b"host", b"testserver")], _body_file=FakePayload(b"toolong"),
+        )
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(list(self.storage.root.rglob("*.txt*")), [])
+        self.assertEqual(self.put(slot, b"abc").status_code, 200)
+
+        slot = self.open_slot(size=10)
+        self.put(slot, b"short")
+        response = self.client.post(f"/api/uploads/direct/{slot['upload_id']}/finalize/")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(DirectUpload.objects.filter(id=slot["upload_id"]).exists())
+        self.assertEqual(StorageDeletion.objects.count(), 1)
+        self.assertFalse(File.objects.exists())
+
+    def test_quota_is_checked_when_opening_and_finalizing(self):
+        self.client.get("/api/usage/")
+        StorageUsage.objects.filter(user=self.user).update(quota=8)
+        response = self.client.post("/api/uploads/direct/", {"name": "big.bin", "size": 9}, format="json")
+        self.assertEqual(response.status_code, 413)
+
+        slot = self.open_slot(size=5)
+        self.put(slot, b"hello")
+        store_file(self.user, SimpleUploadedFile("other.txt", b"1234"), "other.txt", 4)
+        response = self.client.post(f"/api/uploads/direct/{slot['upload_id']}/finalize/")
+        self.assertEqual(response.status_code, 413)
+        self.assertTrue(DirectUpload.objects.filter(id=slot["upload_id"]).exists())
+
+    def test_expired_slots_are_purged_with_their_objects(self):
+        slot = self.open_slot()
+        self.put(slot, b"hello")
+        DirectUpload.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.client.post(f"/api/uploads/direct/{slot['upload_id']}/finalize/").status_code, 410)
+        self.assertEqual(StorageDeletion.objects.count(), 1)
+
+        self.open_slot()
+        DirectUpload.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command("purge_upload_sessions", stdout=StringIO())
+        self.assertFalse(DirectUpload.objects.exists())
+        self.assertEqual(StorageDeletion.objects.count(), 2)
+
+
+class SignedURLCacheTests(StorageTestCase):
+
+    def upload(self, name, content):
+        return self.client.post("/api/upload/", {"file": SimpleUploadedFile(name, content)}, format="multipart").data["id"]
+
+    def test_repeat_downloads_reuse_the_signed_url_until_deleted(self):
+        file_id = self.upload("a.jpg", b"jpeg")
+        with mock.patch.object(LocalStorage, "signed_url", wraps=self.storage.signed_url) as sign:
+            first = self.client.get(f"/api/download/{file_id}/").data["download_url"]
+            second = self.client.get(f"/api/download/{file_id}/").data["download_url"]
+            self.assertEqual(first, second)
+            self.assertEqual(sign.call_count, 1)
+
+            path = File.objects.get(id=file_id).supabase_path
+            self.client.delete(f"/api/delete/{file_id}/")
+            self.assertIsNone(signed_url_cache.get((path, 3600)))
+
+    def test_urls_close_to_expiry_are_not_served(self):
+        cache = TTLCache(max_entries=10)
+        cache.set("fresh", "url-1", ttl=3600)
+        cache.set("stale", "url-2", ttl=200)
+        self.assertEqual(cache.get("fresh", min_ttl=300), "url-1")
+        self.assertIsNone(cache.get("stale", min_ttl=300))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(max_entries=2)
+        cache.set("a", 1, ttl=60)
+        cache.set("b", 2, ttl=60)
+        cache.get("a")
+        cache.set("c", 3, ttl=60)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_batch_signs_only_the_callers_files_in_one_storage_call(self):
+        mine = [self.upload(f"{n}.png", bytes([n])) for n in range(3)]
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username="bob", password="pw"))
+        theirs = other.post("/api/upload/", {"file": SimpleUploadedFile("x.png", b"bob")}, format="multipart").data["id"]
+
+        with mock.patch.object(LocalStorage, "signed_urls", wraps=self.storage.signed_urls) as sign:
+            response = self.client.post("/api/download/batch/", {"ids": mine + [theirs]}, format="json")
+        self.assertEqual(sign.call_count, 1)
+        self.assertEqual([row["id"] for row in response.data["results"]], mine)
+        self.assertTrue(all(row["download_url"] for row in response.data["results"]))
+        self.assertEqual(response.data["missing"], [theirs])
+
+
+class BulkDeleteTests(StorageTestCase):
+
+    def upload(self, name, content):
+        return self.client.post("/api/upload/", {"file": SimpleUploadedFile(name, content)}, format="multipart").data["id"]
+
+    def test_deletes_in_batched_storage_calls_and_reports_missing_ids(self):
+        ids = [self.upload(f"{n}.txt", bytes([n])) for n in range(5)]
+        shared = self.upload("dup.txt", bytes([0]))   # keeps blob 0 alive
+
+        with mock.patch.object(LocalStorage, "delete", wraps=self.storage.delete) as remove:
+            response = self.client.post("/api/delete/bulk/", {"ids": ids + [999999]}, format="json")
+            self.assertEqual(remove.call_count, 0)
+            call_command("process_storage_deletions", "--once", "--batch-size", "2", stdout=StringIO())
+
+        self.assertEqual(sorted(response.data["deleted"]), ids)
+        self.assertEqual(response.data["failed"], [{"id": 999999, "error": "not_found"}])
+        self.assertEqual([len(call.args[0]) for call in remove.call_args_list], [2, 2])
+        self.assertEqual(list(File.objects.values_list("id", flat=True)), [shared])
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertFalse(StorageDeletion.objects.exists())
+
+    def test_failed_storage_deletes_are_retried_with_backoff(self):
+        ids = [self.upload(f"{n}.txt", bytes([n])) for n in range(2)]
+        self.client.post("/api/delete/bulk/", {"ids": ids}, format="json")
+        self.assertFalse(File.objects.exists())
+
+        with mock.patch.object(LocalStorage, "delete", side_effect=OSError("storage down")):
+            call_command("process_storage_deletions", "--once", stdout=StringIO(), stderr=StringIO())
+        pending = list(StorageDeletion.objects.all())
+        self.assertEqual([(item.attempts, item.last_error) for item in pending], [(1, "storage down")] * 2)
+        self.assertTrue(all(item.next_attempt_at > timezone.now() for item in pending))
+
+        StorageDeletion.objects.update(next_attempt_at=timezone.now())
+        call_command("process_storage_deletions", "--once", stdout=StringIO())
+        self.assertFalse(StorageDeletion.objects.exists())
+
+    def test_filter_only_touches_own_matching_files(self):
+        keep = self.upload("report.pdf", b"r")
+        self.upload("tmp-1.log", b"1")
+        self.upload("tmp-2.log", b"2")
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username="bob", password="pw"))
+        theirs = other.post("/api/upload/", {"file": SimpleUploadedFile("tmp-3.log", b"3")}, format="multipart").data["id"]
+
+        response = self.client.post("/api/delete/bulk/", {"filter": {"name_prefix": "tmp-"}}, format="json")
+
+        self.assertEqual(len(response.data["deleted"]), 2)
+        self.assertEqual(set(File.objects.values_list("id", flat=True)), {keep, theirs})
+        self.assertEqual(self.client.post("/api/delete/bulk/", {"filter": {}}, format="json").status_code, 400)
+
+    def test_filter_that_narrows_nothing_deletes_nothing(self):
+        self.upload("a.txt", b"a")
+        for prefix in ("", "   ", None, 7):
+            response = self.client.post("/api/delete/bulk/", {"filter": {"name_prefix": prefix}}, format="json")
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post("/api/delete/bulk/", {"filter": {"uploaded_before": None}}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(File.objects.count(), 1)
+
+
+class FileListPaginationTests(StorageTestCase):
+
+    def test_pages_walk_every_file_newest_first(self):
+        files = File.objects.bulk_create([File(user=self.user, name=f"f{n}", size=n) for n in range(7)])
+        # Several files sharing a timestamp must still page without gaps or repeats
+        File.objects.filter(id__in=[f.id for f in files[:4]]).update(uploaded_at=files[0].uploaded_at)
+
+        seen, cursor = [], None
+        while True:
+            response = self.client.get("/api/files/", {"limit": 3, **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            seen += [row["id"] for row in response.data["results"]]
+            cursor = response.data["next_cursor"]
+            if cursor is None:
+                break
+
+        expected = list(File.objects.order_by("-uploaded_at", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.client.get("/api/files/", {"cursor": "not-a-cursor"}).status_code, 400)
+
+
+class JSONRenderingTests(StorageTestCase):
+
+    def test_listing_rows_match_the_file_payload(self):
+        file_obj = store_file(self.user, SimpleUploadedFile("a.txt", b"hello"), "a.txt", 5)
+        response = self.client.get("/api/files/")
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.content, dumps({"results": [file_payload(File.objects.get(id=file_obj.id))], "next_cursor": None}))
+
+    def test_stream_sends_every_file_as_one_array(self):
+        File.objects.bulk_create([File(user=self.user, name=f"f{n}", size=n) for n in range(5)])
+        with override_settings(FILE_STREAM_BATCH_SIZE=2):
+            response = self.client.get("/api/files/stream/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header("ETag"))
+        rows = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([row["name"] for row in rows], [f"f{n}" for n in reversed(range(5))])
+        self.assertEqual(set(rows[0]), {"id", "name", "size", "uploaded_at", "url", "previews", "encoding"})
+
+    def test_stream_array_and_renderer_encode_like_drf(self):
+        for items in ([], [1], list(range(7))):
+            self.assertEqual(json.loads(b"".join(stream_array(iter(items), 3))), items)
+        data = {"when": timezone.now(), "price": Decimal("1.50"), "name": "ü", "sizes": {256: "a"}}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class ConditionalListTests(StorageTestCase):
+
+    def upload(self, name, content):
+        return self.client.post("/api/upload/", {"file": SimpleUploadedFile(name, content)}, format="multipart").data["id"]
+
+    def test_unchanged_listing_is_answered_with_304_from_the_usage_row(self):
+        self.upload("a.txt", b"a")
+        etag = self.client.get("/api/files/")["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/files/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+
+    def test_uploads_and_deletes_change_the_etag(self):
+        etags = [self.client.get("/api/files/")["ETag"]]
+        file_id = self.upload("a.txt", b"a")
+        etags.append(self.client.get("/api/files/")["ETag"])
+        self.client.post("/api/upload/batch/", {"files": [SimpleUploadedFile("b.txt", b"b")]}, format="multipart")
+        etags.append(self.client.get("/api/files/")["ETag"])
+        self.client.delete(f"/api/delete/{file_id}/")
+        etags.append(self.client.get("/api/files/")["ETag"])
+
+        self.assertEqual(len(set(etags)), 4)
+        response = self.client.get("/api/files/", HTTP_IF_NONE_MATCH=etags[2])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f["name"] for f in response.data["results"]], ["b.txt"])
+
+    def test_search_and_async_list_share_the_validators(self):
+        self.upload("a.txt", b"a")
+        etag = self.client.get("/api/files/")["ETag"]
+        self.assertEqual(self.client.get("/api/files/search/", {"q": "a"}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        token = AccessToken.for_user(self.user)
+        response = Client().get("/api/async/files/", HTTP_AUTHORIZATION=f"Bearer {token}", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since_alone_is_not_answered_with_304(self):
+        self.upload("a.txt", b"a")
+        response = self.client.get("/api/files/")
+        self.assertFalse(response.has_header("Last-Modified"))
+        # Changes within the same second as the client's date must still be seen
+        self.upload("b.txt", b"b")
+        response = self.client.get("/api/files/", HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 2)
+
+
+class ChangesFeedTests(StorageTestCase):
+
+    def upload(self, name, content):
+        return self.client.post("/api/upload/", {"file": SimpleUploadedFile(name, content)}, format="multipart").data["id"]
+
+    def changes(self, cursor, **params):
+        response = self.client.get("/api/changes/", {"cursor": cursor, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_cursor_zero_lists_live_files_in_sequence_order(self):
+        first, second = self.upload("a.txt", b"a"), self.upload("b.txt", b"b")
+        self.client.delete(f"/api/delete/{first}/")
+
+        data = self.changes(0)
+        self.assertEqual([(c["type"], c["file"]["id"]) for c in data["changes"]], [("created", second)])
+        self.assertEqual(data["cursor"], 3)
+        self.assertFalse(data["has_more"])
+        self.assertEqual(self.changes(data["cursor"])["changes"], [])
+
+    def test_changes_after_a_cursor_include_deletes(self):
+        first = self.upload("a.txt", b"a")
+        cursor = self.changes(0)["cursor"]
+        self.client.post("/api/upload/batch/", {"files": [SimpleUploadedFile(n, n.encode()) for n in ("b", "c")]}, format="multipart")
+        self.client.delete(f"/api/delete/{first}/")
+
+        data = self.changes(cursor)
+        self.assertEqual([c["seq"] for c in data["changes"]], [2, 3, 4])
+        self.assertEqual([c["type"] for c in data["changes"]], ["created", "created", "deleted"])
+        self.assertEqual(data["changes"][2]["id"], first)
+
+    def test_pages_follow_the_cursor(self):
+        for name in "abcde":
+            self.upload(name, name.encode())
+        seen, cursor, has_more = [], 0, True
+        while has_more:
+            data = self.changes(cursor, limit=2)
+            seen += [c["file"]["name"] for c in data["changes"]]
+            cursor, has_more = data["cursor"], data["has_more"]
+        self.assertEqual(seen, list("abcde"))
+
+    def test_pruned_tombstones_expire_older_cursors(self):
+        first = self.upload("a.txt", b"a")
+        self.upload("b.txt", b"b")
+        self.client.delete(f"/api/delete/{first}/")
+        FileTombstone.objects.update(deleted_at=timezone.now() - timedelta(days=31))
+        call_command("purge_file_tombstones", stdout=StringIO())
+
+        self.assertFalse(FileTombstone.objects.exists())
+        self.assertEqual(self.client.get("/api/changes/", {"cursor": 1}).status_code, 410)
+        self.assertEqual(self.changes(3)["changes"], [])
+        self.assertEqual(len(self.changes(0)["changes"]), 1)
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.client.get("/api/changes/", {"cursor": "abc"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/changes/", {"cursor": -1}).status_code, 400)
+
+
+@override_settings(PREVIEW_SIZES=[64, 16])
+@mock.patch("core.services.preview_kind", lambda name: "image" if name.endswith(".jpg") else None)
+class PreviewTests(StorageTestCase):
+
+    def upload(self, name, content=b"photo"):
+        return self.client.post("/api/upload/", {"file": SimpleUploadedFile(name, content)}, format="multipart").data
+
+    def run_jobs(self):
+        with ThreadPoolExecutor(1) as pool:
+            return process_preview_jobs(10, pool)
+
+    def fake_render(self, data, kind, sizes):
+        return {size: f"{size}px".encode() for size in sizes}
+
+    def test_upload_only_queues_previews(self):
+        self.assertEqual(self.upload("a.jpg")["previews"], {})
+        self.upload("notes.txt")
+        self.assertEqual(list(PreviewJob.objects.values_list("kind", flat=True)), ["image"])
+
+    def test_previews_are_stored_next_to_the_original_and_listed(self):
+        file_id = self.upload("a.jpg")["id"]
+        cursor = self.client.get("/api/changes/").data["cursor"]
+        with mock.patch("core.services.render_previews", self.fake_render):
+            self.assertEqual(self.run_jobs(), (1, 0))
+
+        blob = Blob.objects.get()
+        self.assertEqual(self.storage.path(previews.preview_path(blob.path, 16)).read_bytes(), b"16px")
+        listed = self.client.get("/api/files/").data["results"][0]
+        self.assertEqual(set(listed["previews"]), {"64", "16"})
+        self.assertEqual(listed["previews"], blob.previews)
+        self.assertFalse(PreviewJob.objects.exists())
+        self.assertEqual([c["file"]["id"] for c in self.client.get("/api/changes/", {"cursor": cursor}).data["changes"]], [file_id])
+
+        # The same bytes again reuse the previews
+        self.assertEqual(self.upload("b.jpg")["previews"], blob.previews)
+        self.assertFalse(PreviewJob.objects.exists())
+
+    def test_undecodable_files_get_no_previews(self):
+        self.upload("a.jpg")
+        with mock.patch("core.services.render_previews", side_effect=ValueError("not an image")):
+            self.assertEqual(self.run_jobs(), (1, 0))
+        self.assertEqual(Blob.objects.get().previews, {})
+        self.upload("b.jpg")
+        self.assertFalse(PreviewJob.objects.exists())
+
+    def test_storage_failures_are_retried_after_the_lease(self):
+        self.upload("a.jpg")
+        with mock.patch.object(LocalStorage, "stream", side_effect=OSError("unreachable")):
+            self.assertEqual(self.run_jobs(), (0, 1))
+        self.assertEqual(self.run_jobs(), (0, 0))
+        self.assertEqual(PreviewJob.objects.get().last_error, "unreachable")
+
+        PreviewJob.objects.update(next_attempt_at=timezone.now())
+        with mock.patch("core.services.render_previews", self.fake_render):
+            self.assertEqual(self.run_jobs(), (1, 0))
+
+    def test_deleting_the_file_removes_its_previews(self):
+        file_id = self.upload("a.jpg")["id"]
+        with mock.patch("core.services.render_previews", self.fake_render):
+            self.run_jobs()
+        blob = Blob.objects.get()
+        self.client.delete(f"/api/delete/{file_id}/")
+        self.assertCountEqual(
+            StorageDeletion.objects.values_list("path", flat=True),
+            [blob.path, previews.preview_path(blob.path, 64), previews.preview_path(blob.path, 16)],
+        )
+
+    @skipUnless(previews.Image, "Pillow is not installed")
+    def test_render_fits_each_size(self):
+        source = BytesIO()
+        previews.Image.new("RGB", (300, 150), "red").save(source, "PNG")
+        rendered = previews.render_previews(source.getvalue(), "image", [64, 16])
+        self.assertEqual(previews.Image.open(BytesIO(rendered[64])).size, (64, 32))
+        self.assertEqual(previews.Image.open(BytesIO(rendered[16])).size, (16, 8))
+
+
+@override_settings(UPLOAD_COMPRESSION="gzip")
+class CompressionTests(StorageTestCase):
+    csv = b"".join(b"2024-01-%02d,invoice,%d,EUR\n" % (n % 28 + 1, n) for n in range(5000))
+
+    def upload(self, name, content, content_type="application/octet-stream"):
+        upload = SimpleUploadedFile(name, content, content_type=content_type)
+        return self.client.post("/api/upload/", {"file": upload}, format="multipart").data
+
+    def test_text_is_stored_compressed_and_downloads_decoded(self):
+        payload = self.upload("export.csv", self.csv, "text/csv")
+        self.assertEqual(payload["encoding"], "gzip")
+        self.assertEqual(payload["size"], len(self.csv))
+        stored = self.stored_bytes(payload["id"])
+        self.assertLess(len(stored) * 5, len(self.csv))
+        self.assertEqual(gzip.decompress(stored), self.csv)
+
+        download = self.client.get(f"/api/download/{payload['id']}/").data
+        self.assertNotIn("content_encoding", download)
+        response = APIClient().get(download["download_url"])
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), self.csv)
+
+    def test_compressed_formats_and_small_files_are_stored_as_they_are(self):
+        png = b"\x89PNG\r\n\x1a\n" + bytes(20000)
+        self.assertEqual(self.upload("photo.bin", png)["encoding"], None)
+        self.assertEqual(self.upload("random.bin", os.urandom(20000))["encoding"], None)
+        self.assertEqual(self.upload("tiny.txt", b"short text", "text/plain")["encoding"], None)
+        self.assertEqual(self.upload("zeros.bin", bytes(20000))["encoding"], "gzip")
+        self.assertEqual(Blob.objects.filter(encoding="").count(), 3)
+
+    def test_batch_and_async_uploads_compress_too(self):
+        response = self.client.post("/api/upload/batch/", {"files": [SimpleUploadedFile("a.csv", self.csv)]}, format="multipart")
+        self.assertEqual(response.data["results"][0]["file"]["encoding"], "gzip")
+
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        response = client.post("/api/async/upload/", {"file": SimpleUploadedFile("b.csv", self.csv + b"x")})
+        self.assertEqual(response.json()["encoding"], "gzip")
+        self.assertEqual(gzip.decompress(self.stored_bytes(response.json()["id"])), self.csv + b"x")
+
+    def test_backends_that_cannot_serve_the_encoding_store_the_original_bytes(self):
+        upload = SimpleUploadedFile("export.csv", self.csv, content_type="text/csv")
+        self.assertEqual(compress_upload(upload, SupabaseStorage()), (upload, ""))
+        with compressed_upload(upload, self.storage) as (_, encoding):
+            self.assertEqual(encoding, "gzip")
+
+    @override_settings(UPLOAD_COMPRESSION="")
+    def test_compression_is_off_by_default(self):
+        payload = self.upload("export.csv", self.csv, "text/csv")
+        self.assertIsNone(payload["encoding"])
+        self.assertEqual(self.stored_bytes(payload["id"]), self.csv)
+
+
+@override_settings(DOWNLOAD_PROXY_ENABLED=True, DOWNLOAD_PROXY_CHUNK_SIZE=4)
+class DownloadProxyTests(StorageTestCase):
+    content = b"0123456789abcdef"
+
+    def setUp(self):
+        super().setUp()
+        upload = SimpleUploadedFile("clip.mp4", self.content)
+        self.file_id = self.client.post("/api/upload/", {"file": upload}, format="multipart").data["id"]
+        self.url = f"/api/download/{self.file_id}/content/"
+
+    def get(self, **headers):
+        response = self.client.get(self.url, HTTP_ACCEPT="video/*", **headers)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_whole_file_is_sent_as_file_response(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response["Content-Length"], "16")
+        self.assertEqual(response["Content-Type"], "video/mp4")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertTrue(response["Content-Disposition"].startswith("attachment"))
+
+    def test_ranges(self):
+        for header, status, expected, content_range in [
+            ("bytes=2-5", 206, b"2345", "bytes 2-5/16"),
+            ("bytes=10-", 206, b"abcdef", "bytes 10-15/16"),
+            ("bytes=-3", 206, b"def", "bytes 13-15/16"),
+            ("bytes=14-99", 206, b"ef", "bytes 14-15/16"),
+            ("bytes=5-2", 200, self.content, None),
+            ("bytes=0-1,4-5", 200, self.content, None),
+        ]:
+            with self.subTest(header):
+                response, body = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(body, expected)
+                self.assertEqual(response["Content-Length"], str(len(expected)))
+                self.assertEqual(response.get("Content-Range"), content_range)
+
+    def test_bounded_ranges_stream_in_chunks(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=1-10")
+        chunks = list(response.streaming_content)
+        self.assertEqual(b"".join(chunks), self.content[1:11])
+        self.assertTrue(all(len(chunk) <= 4 for chunk in chunks))
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(HTTP_RANGE="bytes=16-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */16")
+
+    def test_if_range_and_conditional_requests(self):
+        etag = self.get()[0]["ETag"]
+        self.assertEqual(self.get(HTTP_RANGE="bytes=0-0", HTTP_IF_RANGE=etag)[1], b"0")
+        response, body = self.get(HTTP_RANGE="bytes=0-0", HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, body), (200, self.content))
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag)[0].status_code, 304)
+
+    @override_settings(UPLOAD_COMPRESSION="gzip", UPLOAD_COMPRESSION_MIN_SIZE=0)
+    def test_compressed_files_are_decoded_unless_the_client_takes_the_encoding(self):
+        text = b"hello world, " * 1000
+        upload = SimpleUploadedFile("notes.txt", text, content_type="text/plain")
+        self.url = f"/api/download/{self.client.post('/api/upload/', {'file': upload}, format='multipart').data['id']}/content/"
+
+        response, body = self.get(HTTP_RANGE="bytes=13-25")
+        self.assertEqual((response.status_code, body), (206, b"hello world, "))
+        response, body = self.get()
+        self.assertEqual(body, text)
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+        response, body = self.get(HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(body), text)
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_other_users_files_and_disabled_proxy_are_not_found(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username="bob"))
+        self.assertEqual(other.get(self.url).status_code, 404)
+        with override_settings(DOWNLOAD_PROXY_ENABLED=False):
+            self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_empty_files(self):
+        upload = SimpleUploadedFile("empty.bin", b"")
+        self.url = f"/api/download/{self.client.post('/api/upload/', {'file': upload}, format='multipart').data['id']}/content/"
+        with mock.patch.object(LocalStorage, "stream") as stream:
+            response, body = self.get()
+        stream.assert_not_called()
+        self.assertEqual((response.status_code, body), (200, b""))
+        self.assertEqual(self.get(HTTP_RANGE="bytes=0-")[0].status_code, 416)
+
+    def test_missing_objects_are_not_found_before_streaming(self):
+        self.storage.delete([File.objects.get(id=self.file_id).supabase_path])
+        self.assertEqual(self.get()[0].status_code, 404)
+        self.assertEqual(self.get(HTTP_RANGE="bytes=2-5")[0].status_code, 404)
+
+
+@override_settings(DOWNLOAD_PROXY_CHUNK_SIZE=4, ZIP_PREFETCH_CHUNKS=2)
+class ZipDownloadTests(StorageTestCase):
+
+    def upload(self, name, content):
+        return self.client.post("/api/upload/", {"file": SimpleUploadedFile(name, content)}, format="multipart").data["id"]
+
+    def archive(self, **params):
+        response = self.client.get("/api/download/zip/", params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        archive = zipfile.ZipFile(BytesIO(b"".join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        return archive
+
+    def test_whole_account_with_duplicate_names(self):
+        self.upload("a.txt", b"first a")
+        self.upload("b.txt", b"b" * 1000)
+        self.upload("a.txt", b"second a")
+
+        archive = self.archive(all="1")
+        self.assertEqual(archive.namelist(), ["a.txt", "b.txt", "a (1).txt"])
+        self.assertEqual(archive.read("a (1).txt"), b"second a")
+        self.assertEqual(archive.read("b.txt"), b"b" * 1000)
+
+    def test_selection_skips_other_users_files(self):
+        wanted = self.upload("wanted.txt", b"yes")
+        self.upload("other.txt", b"no")
+        bob = User.objects.create_user(username="bob")
+        theirs = File.objects.create(user=bob, name="theirs.txt", size=1, supabase_path="x", url="")
+
+        archive = self.archive(ids=f"{wanted},{theirs.id}")
+        self.assertEqual(archive.namelist(), ["wanted.txt"])
+        self.assertEqual(self.client.get("/api/download/zip/", {"ids": theirs.id}).status_code, 404)
+        self.assertEqual(self.client.get("/api/download/zip/", {"ids": "1,x"}).status_code, 400)
+
+    @override_settings(UPLOAD_COMPRESSION="gzip", UPLOAD_COMPRESSION_MIN_SIZE=0)
+    def test_compressed_files_are_decoded(self):
+        text = b"line of text\n" * 500
+        self.upload("log.txt", text)
+        self.assertEqual(self.archive(all="1").read("log.txt"), text)
+
+    def test_large_entries_use_zip64(self):
+        self.upload("huge.bin", b"pretend this is 5 GiB")
+        File.objects.update(size=5 * 2 ** 30)
+        body = b"".join(self.client.get("/api/download/zip/", {"all": "1"}).streaming_content)
+        self.assertEqual(zipfile.ZipFile(BytesIO(body)).read("huge.bin"), b"pretend this is 5 GiB")
+        # The local header, written before the size is known, carries the ZIP64 extra field
+        name_length = int.from_bytes(body[26:28], "little")
+        self.assertEqual(body[30 + name_length:32 + name_length], b"\x01\x00")
+
+
+class FileSearchTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        names = ["Holiday-2024.jpg", "holiday-notes.txt", "Report.pdf", "old holiday.png", "budget.xlsx"]
+        self.files = File.objects.bulk_create([File(user=self.user, name=name, size=1) for name in names])
+        bob = User.objects.create_user(username="bob", password="pw")
+        File.objects.create(user=bob, name="holiday-bob.jpg", size=1)
+
+    def search(self, **params):
+        response = self.client.get("/api/files/search/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_substring_match_is_case_insensitive_and_scoped_to_user(self):
+        names = [f["name"] for f in self.search(q="HOLIDAY")["results"]]
+        self.assertEqual(names, ["old holiday.png", "holiday-notes.txt", "Holiday-2024.jpg"])
+
+    def test_prefix_match(self):
+        names = [f["name"] for f in self.search(q="holiday", match="prefix")["results"]]
+        self.assertEqual(names, ["holiday-notes.txt", "Holiday-2024.jpg"])
+
+    def test_results_are_paginated(self):
+        first = self.search(q="o", limit=2)
+        second = self.search(q="o", limit=2, cursor=first["next_cursor"])
+        seen = [f["name"] for f in first["results"] + second["results"]]
+        self.assertEqual(seen, ["old holiday.png", "Report.pdf", "holiday-notes.txt", "Holiday-2024.jpg"])
+        self.assertIsNone(second["next_cursor"])
+
+    def test_rejects_bad_parameters(self):
+        for params in ({}, {"q": "  "}, {"q": "x" * 256}, {"q": "a", "match": "fuzzy"}, {"q": "a", "cursor": "bogus"}):
+            self.assertEqual(self.client.get("/api/files/search/", params).status_code, 400)
+
+
+class DeduplicationTests(StorageTestCase):
+
+    def upload(self, name, content, client=None):
+        response = (client or self.client).post("/api/upload/", {"file": SimpleUploadedFile(name, content)}, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def test_duplicate_upload_skips_storage_and_shares_blob(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username="bob", password="pw"))
+
+        with mock.patch.object(LocalStorage, "upload", wraps=self.storage.upload) as upload:
+            first = self.upload("setup.exe", b"installer bytes")
+            second = self.upload("copy of setup.exe", b"installer bytes", client=other)
+        self.assertEqual(upload.call_count, 1)
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.digest, hashlib.sha256(b"installer bytes").hexdigest())
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual({File.objects.get(id=first).blob_id, File.objects.get(id=second).blob_id}, {blob.id})
+
+    def test_object_is_deleted_with_the_last_reference(self):
+        first = self.upload("a.pdf", b"same")
+        second = self.upload("b.pdf", b"same")
+        path = Blob.objects.get().path
+
+        self.client.delete(f"/api/delete/{first}/")
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertFalse(StorageDeletion.objects.exists())
+
+        self.client.delete(f"/api/delete/{second}/")
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(list(StorageDeletion.objects.values_list("path", flat=True)), [path])
+        call_command("process_storage_deletions", "--once", stdout=StringIO())
+        self.assertIsNone(self.storage.stat(path))
+
+    def test_failed_file_insert_releases_the_blob_reference(self):
+        self.upload("a.pdf", b"same")
+        with mock.patch.object(File.objects, "create", side_effect=IntegrityError("file row refused")):
+            with self.assertRaises(IntegrityError):
+                self.upload("b.pdf", b"same")
+            self.assertEqual(Blob.objects.get().ref_count, 1)
+            self.assertFalse(StorageDeletion.objects.exists())
+
+            with self.assertRaises(IntegrityError):
+                self.upload("c.pdf", b"new")
+        self.assertEqual(Blob.objects.count(), 1)
+        self.assertEqual(StorageDeletion.objects.count(), 1)
+
+    def test_reupload_after_delete_is_not_removed_by_the_pending_deletion(self):
+        first = self.upload("a.pdf", b"same")
+        self.client.delete(f"/api/delete/{first}/")
+        second = self.upload("a.pdf", b"same")
+
+        call_command("process_storage_deletions", "--once", stdout=StringIO())
+        self.assertEqual(self.stored_bytes(second), b"same")
+
+    def test_upload_handlers_hash_large_and_small_files(self):
+        content = b"z" * (3 * 1024 * 1024)   # above FILE_UPLOAD_MAX_MEMORY_SIZE, so spooled to disk
+        with mock.patch("core.views.store_file", wraps=store_file) as store:
+            self.upload("big.bin", content)
+            self.upload("small.bin", b"z")
+        received = [call.args[1].sha256 for call in store.call_args_list]
+        self.assertEqual(received, [hashlib.sha256(content).hexdigest(), hashlib.sha256(b"z").hexdigest()])
+
+
+class BatchUploadTests(StorageTestCase):
+
+    def upload_batch(self, *files):
+        return self.client.post("/api/upload/batch/", {"files": [SimpleUploadedFile(name, content) for name, content in files]}, format="multipart")
+
+    def test_new_contents_are_uploaded_once_and_rows_created_together(self):
+        existing = self.client.post("/api/upload/", {"file": SimpleUploadedFile("old.txt", b"old")}, format="multipart").data["id"]
+
+        with mock.patch.object(LocalStorage, "upload", wraps=self.storage.upload) as upload:
+            response = self.upload_batch(("a.txt", b"a"), ("b.txt", b"b"), ("a-copy.txt", b"a"), ("old-copy.txt", b"old"))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(upload.call_count, 2)
+        results = response.data["results"]
+        self.assertEqual([r["name"] for r in results], ["a.txt", "b.txt", "a-copy.txt", "old-copy.txt"])
+        self.assertEqual([self.stored_bytes(r["file"]["id"]) for r in results], [b"a", b"b", b"a", b"old"])
+        refs = {blob.digest: blob.ref_count for blob in Blob.objects.all()}
+        self.assertEqual(refs[hashlib.sha256(b"a").hexdigest()], 2)
+        self.assertEqual(refs[hashlib.sha256(b"b").hexdigest()], 1)
+        self.assertEqual(refs[hashlib.sha256(b"old").hexdigest()], 2)
+        self.assertEqual(File.objects.get(id=existing).blob, File.objects.get(id=results[3]["file"]["id"]).blob)
+
+    def test_failed_transfer_is_reported_per_file(self):
+        def upload(path, django_file, content_type=None, overwrite=False):
+            if django_file.read() == b"bad":
+                raise OSError("bucket unavailable")
+            django_file.seek(0)
+            return LocalStorage.upload(self.storage, path, django_file, content_type, overwrite)
+
+        with mock.patch.object(self.storage, "upload", side_effect=upload):
+            response = self.upload_batch(("good.txt", b"good"), ("bad.txt", b"bad"))
+
+        self.assertEqual(response.status_code, 207)
+        good, bad = response.data["results"]
+        self.assertEqual(self.stored_bytes(good["file"]["id"]), b"good")
+        self.assertEqual(bad, {"name": "bad.txt", "error": "bucket unavailable"})
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(Blob.objects.count(), 1)
+
+    @override_settings(DATA_UPLOAD_MAX_NUMBER_FILES=2)
+    def test_rejects_empty_and_oversized_batches(self):
+        self.assertEqual(self.client.post("/api/upload/batch/", {}, format="multipart").status_code, 400)
+        self.assertEqual(self.upload_batch(("a", b"a"), ("b", b"b"), ("c", b"c")).status_code, 400)
+        self.assertFalse(File.objects.exists())
+
+
+class MetricsTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+
+    def test_requests_are_timed_per_view(self):
+        self.client.post("/api/upload/", {"file": SimpleUploadedFile("a.txt", b"hello")}, format="multipart")
+        self.client.get("/api/files/")
+        self.client.get("/api/files/")
+
+        listing = metrics.registry.durations["FileListView"]
+        self.assertEqual(sum(listing.counts), 2)
+        self.assertGreater(listing.sum, 0)
+        self.assertEqual(metrics.registry.requests[("FileListView", "200")], 2)
+        self.assertGreater(metrics.registry.db_queries["FileListView"], 0)
+        self.assertGreater(metrics.registry.components["render"]["FileListView"].sum, 0)
+        self.assertEqual(metrics.registry.storage_calls["FileListView"], 0)
+        self.assertGreaterEqual(metrics.registry.storage_calls["FileUploadView"], 1)
+        self.assertGreater(metrics.registry.components["storage"]["FileUploadView"].sum, 0)
+
+    def test_nested_storage_calls_are_timed_once(self):
+        class WrappedStorage(LocalStorage):
+            def stat(self, path):
+                return super().stat(path)
+
+            def stream(self, path, chunk_size=64 * 1024, start=0, end=None):
+                return super().stream(path, chunk_size, start, end)
+
+        storage = WrappedStorage(root=str(self.storage.root))
+        storage.upload("x.bin", SimpleUploadedFile("x.bin", b"abc"))
+        timings = metrics.RequestTimings()
+        token = metrics._current.set(timings)
+        try:
+            storage.stat("x.bin")
+            self.assertEqual(b"".join(storage.stream("x.bin", chunk_size=1)), b"abc")
+        finally:
+            metrics._current.reset(token)
+        self.assertEqual(timings.storage_calls, 2)
+
+    def test_endpoint_needs_staff_or_the_token(self):
+        self.client.get("/api/files/")
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 403)
+
+        with override_settings(METRICS_TOKEN="scrape-me"):
+            response = Client().get("/api/metrics/", HTTP_AUTHORIZATION="Bearer scrape-me")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn('http_request_duration_seconds_bucket{view="FileListView",le="+Inf"} 1', body)
+        self.assertIn('http_requests_total{view="FileListView",status="200"} 1', body)
+        self.assertIn("signed_url_cache_hits_total", body)
+        self.assertIn("auth_user_cache_hit_rate ", body)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 200)
+
+    async def test_async_requests_are_timed_without_leaving_the_event_loop(self):
+        async def get_response(request):
+            return None
+
+        self.assertTrue(iscoroutinefunction(metrics.RequestTimingMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(metrics.RequestTimingMiddleware(lambda request: None)))
+
+        client = AsyncClient(AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        self.assertEqual((await client.get("/api/async/files/")).status_code, 200)
+        listing = metrics.registry.durations["async_list_files"]
+        self.assertEqual(sum(listing.counts), 1)
+        self.assertGreater(metrics.registry.db_queries["async_list_files"], 0)
+
+    @override_settings(SLOW_REQUEST_MS=0, SLOW_REQUEST_LOG_RATE=1.0)
+    def test_slow_requests_are_logged_with_the_breakdown(self):
+        with self.assertLogs("core.metrics", "WARNING") as logs:
+            self.client.get("/api/files/")
+        self.assertIn("GET /api/files/ -> 200 (FileListView)", logs.output[0])
+        self.assertIn("queries", logs.output[0])
+
+        with override_settings(SLOW_REQUEST_LOG_RATE=0.0), self.assertNoLogs("core.metrics", "WARNING"):
+            self.client.get("/api/files/")
+
+
+@override_settings(DEBUG=True)
+class BenchApiCommandTests(TestCase):
+
+    def test_small_run_saves_results_and_compares_with_them(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = f"{tmp}/run.json"
+            options = {"users": 2, "files": 5, "requests": 4, "concurrency": 1, "size": 64}
+            call_command("bench_api", output=output, stdout=StringIO(), **options)
+            with open(output) as f:
+                results = json.load(f)["scenarios"]
+            self.assertEqual(list(results), ["upload", "list", "download", "delete"])
+            self.assertEqual({r["errors"] for r in results.values()}, {0})
+            self.assertEqual(results["download"]["queries_per_request"], 1)
+
+            out = StringIO()
+            call_command("bench_api", baseline=output, tolerance=100, stdout=out, **options)
+            self.assertIn("No regressions", out.getvalue())
+
+        self.assertFalse(User.objects.filter(username__startswith="bench-").exists())
+        self.assertFalse(Blob.objects.exists())
+
+    @override_settings(DEBUG=False)
+    def test_refuses_the_default_database_without_debug(self):
+        for command in ("bench_api", "bench_file_list", "bench_serve"):
+            with self.assertRaisesMessage(CommandError, "run them with DEBUG on"):
+                call_command(command, stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, "Unknown database alias: nowhere"):
+            call_command("bench_file_list", database="nowhere", stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+
+    def test_seeded_users_and_files_are_removed(self):
+        out = StringIO()
+        call_command("bench_file_list", rows=30, limit=10, repeat=1, stdout=out)
+        call_command("bench_serialization", rows=30, repeat=1, stdout=out)
+        self.assertIn("30 rows", out.getvalue())
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(File.objects.exists())
+
+
+class ServeCommandTests(TestCase):
+
+    def test_workers_follow_the_cpus_within_the_connection_budget(self):
+        self.assertEqual(tune(4, asgi=False, threads=4), (9, 4))
+        self.assertEqual(tune(4, asgi=True), (4, 1))
+        self.assertEqual(tune(4, asgi=False, workers=2, threads=8), (2, 8))
+        with override_settings(SERVE_DB_CONNECTIONS=20):
+            self.assertEqual(tune(16, asgi=False, threads=4), (5, 4))
+
+    def test_dry_run_prints_the_configuration(self):
+        out = StringIO()
+        call_command("serve", dry_run=True, workers=3, threads=2, bind="127.0.0.1:9000", stdout=out)
+        self.assertIn("WSGI on 127.0.0.1:9000: 3 workers x 2 threads (gthread", out.getvalue())
+
+    def test_asgi_closes_database_connections_after_each_request(self):
+        database = connections.settings["default"]
+        with mock.patch.dict(database, CONN_MAX_AGE=60), mock.patch.dict(os.environ):
+            err = StringIO()
+            call_command("serve", asgi=True, dry_run=True, stdout=StringIO(), stderr=err)
+            self.assertIn("CONN_MAX_AGE is set to 0 under ASGI", err.getvalue())
+            self.assertEqual(database["CONN_MAX_AGE"], 60)
+            close_connections_after_each_request()
+            self.assertEqual((database["CONN_MAX_AGE"], os.environ["CONN_MAX_AGE"]), (0, "0"))
+
+
+class StorageUsageTests(StorageTestCase):
+
+    def upload(self, name, content):
+        return self.client.post("/api/upload/", {"file": SimpleUploadedFile(name, content)}, format="multipart")
+
+    def set_quota(self, quota):
+        self.client.get("/api/usage/")
+        StorageUsage.objects.filter(user=self.user).update(quota=quota)
+
+    def test_upload_and_delete_keep_counters_in_step(self):
+        first = self.upload("a.txt", b"aaaa").data["id"]
+        self.upload("b.txt", b"bb")
+        self.client.post("/api/upload/batch/", {"files": [SimpleUploadedFile("c.txt", b"c"), SimpleUploadedFile("d.txt", b"aaaa")]}, format="multipart")
+        self.assertEqual(self.client.get("/api/usage/").data, {"bytes_used": 11, "file_count": 4, "quota": 10 * 1024 ** 3, "bytes_available": 10 * 1024 ** 3 - 11})
+
+        self.client.delete(f"/api/delete/{first}/")
+        self.client.post("/api/delete/bulk/", {"filter": {"name_prefix": "b"}}, format="json")
+        usage = self.client.get("/api/usage/").data
+        self.assertEqual((usage["bytes_used"], usage["file_count"]), (5, 2))
+
+    def test_usage_lookup_does_not_scan_files(self):
+        File.objects.bulk_create([File(user=self.user, name=f"f{n}", size=10) for n in range(50)])
+        self.assertEqual(self.client.get("/api/usage/").data["bytes_used"], 500)   # counted once, on first use
+        with self.assertNumQueries(1):
+            self.client.get("/api/usage/")
+
+    def test_upload_over_quota_is_refused_before_transfer(self):
+        self.set_quota(5)
+        self.upload("a.txt", b"aaaa")
+        with mock.patch.object(LocalStorage, "upload") as upload:
+            response = self.upload("b.txt", b"bb")
+        self.assertEqual(response.status_code, 413)
+        upload.assert_not_called()
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(StorageUsage.objects.get(user=self.user).bytes_used, 4)
+
+    def test_batch_stores_only_files_that_fit(self):
+        self.set_quota(5)
+        response = self.client.post("/api/upload/batch/", {"files": [SimpleUploadedFile(n, c) for n, c in (("a", b"aaa"), ("b", b"bbb"), ("c", b"cc"))]}, format="multipart")
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r.get("error") for r in response.data["results"]], [None, "Storage quota exceeded.", None])
+        self.assertEqual(StorageUsage.objects.get(user=self.user).bytes_used, 5)
+
+    def test_failed_transfer_releases_reservation(self):
+        with mock.patch.object(self.storage, "upload", side_effect=OSError("bucket unavailable")):
+            with self.assertRaises(OSError):
+                self.upload("a.txt", b"aaaa")
+        usage = StorageUsage.objects.get(user=self.user)
+        self.assertEqual((usage.bytes_used, usage.file_count), (0, 0))
+
+    def test_failed_batch_releases_reservations_and_queues_its_uploads(self):
+        with mock.patch.object(File.objects, "bulk_create", side_effect=IntegrityError("file rows refused")):
+            with self.assertRaises(IntegrityError):
+                self.client.post("/api/upload/batch/", {"files": [SimpleUploadedFile("a.txt", b"aaaa"), SimpleUploadedFile("b.txt", b"bb")]}, format="multipart")
+        usage = StorageUsage.objects.get(user=self.user)
+        self.assertEqual((usage.bytes_used, usage.file_count), (0, 0))
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(StorageDeletion.objects.count(), 2)
+
+    def test_resumable_upload_checks_quota_up_front(self):
+        self.set_quota(5)
+        response = self.client.post("/api/uploads/", {"name": "big.bin", "size": 6}, format="json")
+        self.assertEqual(response.status_code, 413)
+
+    def test_repair_command_recomputes_counters(self):
+        self.upload("a.txt", b"aaaa")
+        StorageUsage.objects.filter(user=self.user).update(bytes_used=999, file_count=7)
+        bob = User.objects.create_user(username="bob", password="pw")
+        File.objects.create(user=bob, name="x", size=3)
+
+        out = StringIO()
+        call_command("repair_storage_usage", "--batch-size", "1", stdout=out)
+        self.assertIn("corrected 2", out.getvalue())
+        self.assertEqual(
+            dict(StorageUsage.objects.values_list("user__username", "bytes_used")),
+            {"alice": 4, "bob": 3},
+        )
+
+
+class AsyncEndpointTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # AsyncClient defaults are ASGI headers: Django adds the HTTP_ prefix itself
+        self.async_client = AsyncClient(AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    async def test_upload_list_download_and_delete(self):
+        response = await self.async_client.post("/api/async/upload/", {"file": SimpleUploadedFile("notes.txt", b"hello")})
+        self.assertEqual(response.status_code, 201)
+        file_id = response.json()["id"]
+        self.assertEqual(await sync_to_async(self.stored_bytes)(file_id), b"hello")
+
+        listed = (await self.async_client.get("/api/async/files/")).json()
+        self.assertEqual([f["id"] for f in listed["results"]], [file_id])
+        self.assertIsNone(listed["next_cursor"])
+
+        download_url = (await self.async_client.get(f"/api/async/download/{file_id}/")).json()["download_url"]
+        self.assertEqual(b"".join((await self.async_client.get(download_url)).streaming_content), b"hello")
+
+        response = await self.async_client.delete(f"/api/async/delete/{file_id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(await File.objects.filter(id=file_id).aexists())
+        self.assertEqual(await StorageDeletion.objects.acount(), 1)
+
+    async def test_upload_shares_blob_with_sync_upload(self):
+        sync_id = (await sync_to_async(self.client.post)("/api/upload/", {"file": SimpleUploadedFile("a.txt", b"same")}, format="multipart")).data["id"]
+        async_id = (await self.async_client.post("/api/async/upload/", {"file": SimpleUploadedFile("b.txt", b"same")})).json()["id"]
+
+        blob = await Blob.objects.aget()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(await File.objects.filter(id__in=[sync_id, async_id], blob=blob).acount(), 2)
+
+    async def test_payloads_match_sync_views(self):
+        await sync_to_async(self.client.post)("/api/upload/", {"file": SimpleUploadedFile("a.txt", b"a")}, format="multipart")
+        sync_listing = await sync_to_async(self.client.get)("/api/files/?limit=1")
+        async_listing = await self.async_client.get("/api/async/files/?limit=1")
+        self.assertEqual(async_listing.content, sync_listing.content)
+
+    async def test_requires_authentication_and_ownership(self):
+        response = await AsyncClient().get("/api/async/files/")
+        self.assertEqual(response.status_code, 401)
+        response = await AsyncClient(AUTHORIZATION="Bearer nonsense").get("/api/async/files/")
+        self.assertEqual(response.status_code, 401)
+
+        bob = await User.objects.acreate(username="bob")
+        other = await File.objects.acreate(user=bob, name="x", size=1, supabase_path="bob/x")
+        response = await self.async_client.get(f"/api/async/download/{other.id}/")
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.delete(f"/api/async/delete/{other.id}/")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_invalid_cursor_and_wrong_method(self):
+        response = await self.async_client.get("/api/async/files/?cursor=bogus")
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get("/api/async/upload/")
+        self.assertEqual(response.status_code, 405)
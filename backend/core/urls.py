@@ -1,9 +1,36 @@
 from django.urls import path
-from .views import FileUploadView, FileListView, FileDownloadView, FileDeleteView
+from . import async_views
+from .views import (
+    FileUploadView, FileBatchUploadView, FileListView, FileStreamView, FileSearchView, FileDownloadView, FileContentView, FileZipDownloadView, FileDownloadBatchView, FileDeleteView, FileBulkDeleteView,
+    StorageUsageView, ChangesView, MetricsView, LocalStorageDownloadView, LocalStorageUploadView, UploadSessionCreateView, UploadSessionDetailView, UploadChunkView, UploadSessionCommitView,
+    DirectUploadCreateView, DirectUploadFinalizeView,
+)
 
 urlpatterns = [
     path('upload/', FileUploadView.as_view(), name='upload_file'),
+    path('upload/batch/', FileBatchUploadView.as_view(), name='upload_files'),
     path('files/', FileListView.as_view(), name='list_files'),
+    path('files/stream/', FileStreamView.as_view(), name='stream_files'),
+    path('files/search/', FileSearchView.as_view(), name='search_files'),
     path('download/<int:file_id>/', FileDownloadView.as_view(), name='download_file'),
+    path('download/<int:file_id>/content/', FileContentView.as_view(), name='download_file_content'),
+    path('download/zip/', FileZipDownloadView.as_view(), name='download_zip'),
+    path('download/batch/', FileDownloadBatchView.as_view(), name='download_files'),
     path('delete/<int:file_id>/', FileDeleteView.as_view(), name='delete_file'),
+    path('delete/bulk/', FileBulkDeleteView.as_view(), name='delete_files'),
+    path('usage/', StorageUsageView.as_view(), name='storage_usage'),
+    path('changes/', ChangesView.as_view(), name='file_changes'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('storage/upload/<str:token>/', LocalStorageUploadView.as_view(), name='local_storage_upload'),
+    path('storage/<str:token>/', LocalStorageDownloadView.as_view(), name='local_storage_download'),
+    path('uploads/', UploadSessionCreateView.as_view(), name='create_upload_session'),
+    path('uploads/<uuid:upload_id>/', UploadSessionDetailView.as_view(), name='upload_session'),
+    path('uploads/<uuid:upload_id>/chunks/<int:index>/', UploadChunkView.as_view(), name='upload_chunk'),
+    path('uploads/<uuid:upload_id>/commit/', UploadSessionCommitView.as_view(), name='commit_upload_session'),
+    path('uploads/direct/', DirectUploadCreateView.as_view(), name='create_direct_upload'),
+    path('uploads/direct/<uuid:upload_id>/finalize/', DirectUploadFinalizeView.as_view(), name='finalize_direct_upload'),
+    path('async/upload/', async_views.upload_file, name='async_upload_file'),
+    path('async/files/', async_views.list_files, name='async_list_files'),
+    path('async/download/<int:file_id>/', async_views.download_file, name='async_download_file'),
+    path('async/delete/<int:file_id>/', async_views.delete_file, name='async_delete_file'),
 ]
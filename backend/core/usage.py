@@ -0,0 +1,132 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+from .models import File, StorageUsage
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, message="Storage quota exceeded."):
+        super().__init__(message)
+
+
+def default_quota():
+    return settings.STORAGE_DEFAULT_QUOTA or None
+
+
+def usage_for(user) -> StorageUsage:
+    """
+    The running totals of `user` (a user or a user id). The row is created on
+    first use from the files the user already has.
+    """
+    user_id = getattr(user, "pk", user)
+    try:
+        return StorageUsage.objects.get(user_id=user_id)
+    except StorageUsage.DoesNotExist:
+        totals = File.objects.filter(user_id=user_id).aggregate(
+            bytes_used=Sum("size"), file_count=Count("id"), version=Max("seq"),
+        )
+        usage, _ = StorageUsage.objects.get_or_create(user_id=user_id, defaults={
+            "bytes_used": totals["bytes_used"] or 0,
+            "file_count": totals["file_count"],
+            "quota": default_quota(),
+            "version": totals["version"] or 0,
+        })
+        return usage
+
+
+def has_room(user, size: int) -> bool:
+    usage = usage_for(user)
+    return usage.quota is None or usage.bytes_used + size <= usage.quota
+
+
+def reserve_usage(user, sizes) -> list:
+    """
+    Counts files of `sizes` against `user`'s quota before any bytes are transferred.
+    Each is accepted if it still fits after the ones before it; returns a bool per size.
+    Release accepted files with `release_usage` if storing them fails.
+    """
+    usage_for(user)
+    with transaction.atomic():
+        # Row lock: concurrent uploads cannot both claim the last free bytes
+        usage = StorageUsage.objects.select_for_update().get(user=user)
+        accepted, reserved, count = [], 0, 0
+        for size in sizes:
+            fits = usage.quota is None or usage.bytes_used + reserved + size <= usage.quota
+            accepted.append(fits)
+            if fits:
+                reserved += size
+                count += 1
+        if count:
+            StorageUsage.objects.filter(user=user).update(
+                bytes_used=F("bytes_used") + reserved,
+                file_count=F("file_count") + count,
+            )
+    return accepted
+
+
+def release_usage(user_id, size: int, count: int = 1) -> None:
+    StorageUsage.objects.filter(user_id=user_id).update(
+        bytes_used=F("bytes_used") - size,
+        file_count=F("file_count") - count,
+    )
+
+
+def claim_seqs(user_id, count: int = 1) -> range:
+    """
+    The next `count` numbers of the user's change sequence, one per file created
+    or deleted; run in the transaction that makes the change. The usage row stays
+    locked until it commits, so a user's changes become visible in sequence order.
+    """
+    usage_for(user_id)
+    version = StorageUsage.objects.select_for_update().values_list("version", flat=True).get(user_id=user_id)
+    StorageUsage.objects.filter(user_id=user_id).update(version=F("version") + count, changed_at=timezone.now())
+    return range(version + 1, version + count + 1)
+
+
+def release_files(files) -> None:
+    """
+    Takes deleted `files` off their owners' totals; run in the deleting transaction.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for f in files:
+        totals[f.user_id][0] += f.size
+        totals[f.user_id][1] += 1
+    for user_id, (size, count) in totals.items():
+        release_usage(user_id, size, count)
+
+
+def repair_usage(user_ids) -> int:
+    """
+    Recomputes the totals of `user_ids` from their files, creating missing rows.
+    Returns how many rows were corrected.
+    """
+    with transaction.atomic():
+        StorageUsage.objects.bulk_create(
+            [StorageUsage(user_id=user_id, quota=default_quota()) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        rows = StorageUsage.objects.select_for_update().filter(user_id__in=user_ids)
+        totals = {
+            row["user"]: row
+            for row in File.objects.filter(user_id__in=user_ids).values("user").annotate(bytes_used=Sum("size"), file_count=Count("id"))
+        }
+        corrected = []
+        for usage in rows:
+            actual = totals.get(usage.user_id, {})
+            bytes_used, file_count = actual.get("bytes_used") or 0, actual.get("file_count", 0)
+            if (usage.bytes_used, usage.file_count) != (bytes_used, file_count):
+                usage.bytes_used, usage.file_count = bytes_used, file_count
+                corrected.append(usage)
+        StorageUsage.objects.bulk_update(corrected, ["bytes_used", "file_count"])
+    return len(corrected)
+
+
+def usage_payload(usage: StorageUsage) -> dict:
+    return {
+        "bytes_used": usage.bytes_used,
+        "file_count": usage.file_count,
+        "quota": usage.quota,
+        "bytes_available": None if usage.quota is None else max(0, usage.quota - usage.bytes_used),
+    }
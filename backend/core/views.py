@@ -1,11 +1,34 @@
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, AllowAny, BasePermission
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
-from django.http import Http404
-from .models import File
-from .supabase_upload import upload_file_to_supabase, get_public_url, get_signed_url, delete_file_supabase
-import uuid
+from rest_framework.settings import api_settings
+from django.conf import settings
+from Names.authentication import user_cache
+from django.contrib.auth.models import AnonymousUser
+from django.core.files import File as DjangoFile
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
+from .changes import CursorExpired, changes_since
+from .compression import path_encoding
+from .downloads import serve_file, zip_stream
+from .metrics import render_metrics
+from .models import DirectUpload, File, UploadSession
+from .pagination import InvalidCursor, keyset_page, page_size
+from .renderers import stream_array
+from .services import FILE_PAYLOAD_FIELDS, store_file, store_files, delete_file, delete_files, file_payload, row_payload
+from .signed_urls import signed_url, signed_urls, signed_url_cache
+from .storage import CappedStream, LocalStorage, UploadTooLarge, get_storage
+from .usage import QuotaExceeded, has_room, usage_for, usage_payload
+from . import chunked_upload, direct_upload
+
+# Longest name a File can have; longer ones are refused before anything is reserved or stored
+MAX_NAME_LENGTH = File._meta.get_field("name").max_length
+NAME_TOO_LONG = f"File names must be at most {MAX_NAME_LENGTH} characters."
 
 # Upload a file
 class FileUploadView(APIView):
@@ -17,51 +40,138 @@ class FileUploadView(APIView):
 
         if not uploaded_file:
             return Response({"error": "No file provided."}, status=400)
+        if len(uploaded_file.name) > MAX_NAME_LENGTH:
+            return Response({"error": NAME_TOO_LONG}, status=400)
 
-        # Unique filename (avoid overwriting)
-        filename = f"{request.user.id}/{uuid.uuid4()}_{uploaded_file.name}"
+        try:
+            file_instance = store_file(request.user, uploaded_file, uploaded_file.name, uploaded_file.size)
+        except QuotaExceeded as e:
+            return Response({"error": str(e)}, status=413)
 
-        # Upload to Supabase
-        upload_file_to_supabase(uploaded_file, filename)
+        return Response(file_payload(file_instance), status=201)
 
-        # For public buckets
-        public_url = get_public_url(filename)
 
-        # Store in DB
-        file_instance = File.objects.create(
-            user=request.user,
-            name=uploaded_file.name,
-            size=uploaded_file.size,
-            supabase_path=filename,
-            url=public_url
-        )
+# Upload many files in one multipart request (repeated "files" field)
+class FileBatchUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
 
-        return Response({
-            "id": file_instance.id,
-            "name": file_instance.name,
-            "size": file_instance.size,
-            "uploaded_at": file_instance.uploaded_at,
-            "url": file_instance.url,     # public URL
-        }, status=201)
+    def post(self, request):
+        # Django itself rejects requests with more than UPLOAD_BATCH_MAX_FILES files
+        uploaded_files = request.FILES.getlist("files")
 
+        if not uploaded_files:
+            return Response({"error": "No files provided."}, status=400)
+        too_long = [f.name for f in uploaded_files if len(f.name) > MAX_NAME_LENGTH]
+        if too_long:
+            return Response({"error": NAME_TOO_LONG, "names": too_long}, status=400)
 
-# List all files
+        stored = store_files(request.user, uploaded_files)
+
+        results = [
+            {"name": f.name, "file": file_payload(result)} if isinstance(result, File) else {"name": f.name, "error": result}
+            for f, result in zip(uploaded_files, stored)
+        ]
+        # 207 Multi-Status: some files were stored and some were not
+        failed = any("error" in result for result in results)
+        return Response({"results": results}, status=207 if failed else 201)
+
+
+def listing_etag(usage) -> str:
+    """
+    ETag of a listing of the user's files, from their change version. There is
+    no Last-Modified: whole seconds cannot tell apart two changes in one second.
+    """
+    return f'"{usage.user_id}-{usage.version}"'
+
+
+def not_modified(request, usage):
+    """
+    The 304 to send if the client's copy of the listing is current, else None.
+    Answered from the usage row alone, without touching the File table.
+    """
+    response = get_conditional_response(request, etag=listing_etag(usage))
+    if response is not None:
+        set_listing_validators(response, usage)
+    return response
+
+
+def set_listing_validators(response, usage):
+    response["ETag"] = listing_etag(usage)
+    # Per user, and always worth revalidating
+    response["Cache-Control"] = "private, no-cache"
+    patch_vary_headers(response, ["Authorization", "Cookie"])
+    return response
+
+
+# List files, newest first, one page at a time (?limit=&cursor=)
 class FileListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        files = File.objects.filter(user=request.user).order_by('-uploaded_at')
-        data = [
-            {
-                "id": f.id,
-                "name": f.name,
-                "size": f.size,
-                "uploaded_at": f.uploaded_at,
-                "url": f.url,   # public URL
-            }
-            for f in files
-        ]
-        return Response(data)
+        usage = usage_for(request.user)
+        cached = not_modified(request, usage)
+        if cached:
+            return cached
+
+        # Plain rows: no File instances to build for a listing
+        files = File.objects.filter(user=request.user).values(*FILE_PAYLOAD_FIELDS)
+        try:
+            page, next_cursor = keyset_page(files, request.query_params.get("cursor"), page_size(request))
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=400)
+        return set_listing_validators(Response({
+            "results": [row_payload(row) for row in page],
+            "next_cursor": next_cursor,
+        }), usage)
+
+
+# Every file as one JSON array, newest first, streamed as it is read (for exports and full syncs)
+class FileStreamView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        usage = usage_for(request.user)
+        cached = not_modified(request, usage)
+        if cached:
+            return cached
+
+        rows = (
+            File.objects.filter(user=request.user).order_by("-uploaded_at", "-id")
+            .values(*FILE_PAYLOAD_FIELDS).iterator(chunk_size=settings.FILE_STREAM_BATCH_SIZE)
+        )
+        body = stream_array(map(row_payload, rows), settings.FILE_STREAM_BATCH_SIZE)
+        return set_listing_validators(StreamingHttpResponse(body, content_type="application/json"), usage)
+
+
+# Search the user's files by name (?q=&match=substring|prefix&limit=&cursor=), newest first
+class FileSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        match = request.query_params.get("match", "substring")
+        if not query or len(query) > 255:
+            return Response({"error": "q must be 1 to 255 characters."}, status=400)
+        if match not in ("substring", "prefix"):
+            return Response({"error": "match must be substring or prefix."}, status=400)
+
+        usage = usage_for(request.user)
+        cached = not_modified(request, usage)
+        if cached:
+            return cached
+
+        # Case-insensitive; served by the trigram index on Postgres (migration 0010)
+        lookup = "name__istartswith" if match == "prefix" else "name__icontains"
+        files = File.objects.filter(user=request.user, **{lookup: query}).values(*FILE_PAYLOAD_FIELDS)
+        try:
+            page, next_cursor = keyset_page(files, request.query_params.get("cursor"), page_size(request))
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=400)
+        return set_listing_validators(Response({
+            "results": [row_payload(row) for row in page],
+            "next_cursor": next_cursor,
+        }), usage)
 
 
 # Download via signed URL
@@ -74,12 +184,119 @@ class FileDownloadView(APIView):
         except File.DoesNotExist:
             raise Http404("File not found or unauthorized.")
 
-        # Create a signed URL (valid for 1 hour)
-        download_url = get_signed_url(file_obj.supabase_path)
+        # Signed URL (valid for SIGNED_URL_EXPIRY seconds), reused from the cache when possible
+        download_url = signed_url(file_obj.supabase_path)
 
+        # Compressed objects are sent with a Content-Encoding header, so clients get the original bytes
         return Response({"download_url": download_url})
 
 
+class AnyAcceptNegotiation(BaseContentNegotiation):
+    """
+    Lets views that answer with raw bytes serve any Accept header (a <video>
+    element asks for video/*); errors are still rendered as JSON.
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+# Download the file's bytes through the API, for clients that cannot reach
+# storage (?inline=1 to display rather than save). Supports Range and If-Range.
+class FileContentView(APIView):
+    permission_classes = [IsAuthenticated]
+    content_negotiation_class = AnyAcceptNegotiation
+
+    def get(self, request, file_id):
+        if not settings.DOWNLOAD_PROXY_ENABLED:
+            raise Http404("Not found.")
+        try:
+            file_obj = File.objects.select_related("blob").get(id=file_id, user=request.user)
+        except File.DoesNotExist:
+            raise Http404("File not found or unauthorized.")
+
+        return serve_file(request, file_obj, inline=request.query_params.get("inline") == "1")
+
+
+# Several files, or all of them, as one ZIP archive streamed while it is built:
+# ?ids=1,2,3 or ?all=1
+class FileZipDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+    content_negotiation_class = AnyAcceptNegotiation
+
+    def get(self, request):
+        files = File.objects.filter(user=request.user).only(
+            "id", "name", "size", "supabase_path", "encoding", "uploaded_at",
+        ).order_by("uploaded_at", "id")
+        if request.query_params.get("all") != "1":
+            try:
+                ids = [int(i) for i in request.query_params.get("ids", "").split(",")]
+            except ValueError:
+                return Response({"error": "ids must be a comma-separated list of file ids, or pass all=1."}, status=400)
+            if len(ids) > settings.ZIP_DOWNLOAD_MAX_IDS:
+                return Response({"error": f"At most {settings.ZIP_DOWNLOAD_MAX_IDS} ids per archive."}, status=400)
+            files = files.filter(id__in=ids)
+        files = list(files)
+        if not files:
+            raise Http404("No files found.")
+
+        response = StreamingHttpResponse(zip_stream(files), content_type="application/zip")
+        response["Content-Disposition"] = 'attachment; filename="files.zip"'
+        return response
+
+
+# Signed URLs for many files in one request: {"ids": [...]}
+class FileDownloadBatchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        ids = request.data.get("ids")
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            return Response({"error": "ids must be a list of file ids."}, status=400)
+        if len(ids) > settings.SIGNED_URL_BATCH_MAX:
+            return Response({"error": f"At most {settings.SIGNED_URL_BATCH_MAX} ids per request."}, status=400)
+
+        paths = dict(File.objects.filter(id__in=ids, user=request.user).values_list("id", "supabase_path"))
+        urls = signed_urls([path for path in paths.values() if path])
+
+        return Response({
+            "results": [
+                {"id": file_id, "download_url": urls.get(paths[file_id])}
+                for file_id in ids if file_id in paths
+            ],
+            "missing": [file_id for file_id in ids if file_id not in paths],
+        })
+
+
+# Storage used by the current user, and their quota
+class StorageUsageView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(usage_payload(usage_for(request.user)))
+
+
+# Files created and deleted since a sync cursor (?cursor=&limit=)
+class ChangesView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            cursor = int(request.query_params.get("cursor", 0))
+        except ValueError:
+            cursor = -1
+        if cursor < 0:
+            return Response({"error": "Invalid cursor."}, status=400)
+
+        try:
+            return Response(changes_since(request.user, cursor, page_size(request)))
+        except CursorExpired as e:
+            return Response({"error": str(e)}, status=410)
+
+
 # Delete file
 class FileDeleteView(APIView):
     permission_classes = [IsAuthenticated]
@@ -90,10 +307,342 @@ class FileDeleteView(APIView):
         except File.DoesNotExist:
             return Response({"error": "File not found"}, status=404)
 
-        # Delete from Supabase
-        delete_file_supabase(file_obj.supabase_path)
-
-        # Delete from DB
-        file_obj.delete()
+        # Delete from DB; the stored object is removed in the background once no other file shares it
+        delete_file(file_obj)
 
         return Response({"message": "File deleted successfully"}, status=204)
+
+
+def filter_files(queryset, criteria: dict):
+    """
+    Narrows `queryset` by the bulk delete filter: name_prefix, uploaded_before, uploaded_after.
+    Every criterion given must narrow it: an empty prefix would match every file.
+    """
+    unknown = set(criteria) - {"name_prefix", "uploaded_before", "uploaded_after"}
+    if unknown or not criteria:
+        raise ValueError("filter takes name_prefix, uploaded_before and/or uploaded_after.")
+    if "name_prefix" in criteria:
+        prefix = criteria["name_prefix"]
+        if not isinstance(prefix, str) or not prefix.strip():
+            raise ValueError("name_prefix must be a non-empty string.")
+        queryset = queryset.filter(name__startswith=prefix)
+    for key, lookup in (("uploaded_before", "uploaded_at__lt"), ("uploaded_after", "uploaded_at__gt")):
+        if key in criteria:
+            moment = parse_datetime(str(criteria[key]))
+            if moment is None:
+                raise ValueError(f"{key} must be an ISO 8601 datetime.")
+            queryset = queryset.filter(**{lookup: moment})
+    return queryset
+
+
+# Delete many files: {"ids": [...]} or {"filter": {...}}
+class FileBulkDeleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        ids = request.data.get("ids")
+        criteria = request.data.get("filter")
+        limit = settings.BULK_DELETE_MAX_IDS
+        owned = File.objects.filter(user=request.user).only("id", "blob_id", "supabase_path")
+        failed = []
+        has_more = False
+
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+                return Response({"error": "ids must be a list of file ids."}, status=400)
+            if len(ids) > limit:
+                return Response({"error": f"At most {limit} ids per request."}, status=400)
+            files = list(owned.filter(id__in=ids))
+            found = {f.id for f in files}
+            failed += [{"id": file_id, "error": "not_found"} for file_id in dict.fromkeys(ids) if file_id not in found]
+        elif isinstance(criteria, dict):
+            try:
+                files = list(filter_files(owned, criteria).order_by("id")[:limit + 1])
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+            # Repeat the request to delete the rest
+            has_more = len(files) > limit
+            files = files[:limit]
+        else:
+            return Response({"error": "Provide ids or filter."}, status=400)
+
+        delete_files(files)
+
+        return Response({
+            "deleted": [f.id for f in files],
+            "failed": failed,
+            "has_more": has_more,
+        })
+
+
+# Signed download URLs handed out by the local-disk storage backend
+class LocalStorageDownloadView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, token):
+        storage = get_storage()
+        if not isinstance(storage, LocalStorage):
+            raise Http404("Not found.")
+        path = storage.unsign(token)
+        if not path or storage.stat(path) is None:
+            raise Http404("Link expired or file not found.")
+        encoding = path_encoding(path)
+        if not encoding:
+            return FileResponse(open(storage.path(path), "rb"), as_attachment=True, filename=path.rsplit("/", 1)[-1])
+        # Sent as stored; the browser decodes it on the way in
+        response = FileResponse(
+            open(storage.path(path), "rb"), as_attachment=True,
+            filename=path.rsplit("/", 1)[-1].rsplit(".", 1)[0], content_type="application/octet-stream",
+        )
+        response["Content-Encoding"] = encoding
+        return response
+
+
+# Signed upload URLs handed out by the local-disk storage backend (raw request body)
+class LocalStorageUploadView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def put(self, request, token):
+        storage = get_storage()
+        if not isinstance(storage, LocalStorage):
+            raise Http404("Not found.")
+        grant = storage.unsign_upload(token)
+        if grant is None:
+            return Response({"error": "Upload link expired or invalid."}, status=403)
+        path, max_size = grant
+        if int(request.META.get("CONTENT_LENGTH") or 0) > max_size:
+            return Response({"error": f"Upload is larger than the {max_size} bytes allowed."}, status=413)
+
+        # DRF reads a body without Content-Length as empty, but under ASGI a chunked
+        # body is there in full: read Django's own stream, capped whatever was declared
+        body = CappedStream(request._request, max_size)
+        try:
+            storage.upload(path, DjangoFile(body), content_type=request.content_type)
+        except FileExistsError:
+            return Response({"error": "Something was already uploaded to this URL."}, status=409)
+        except UploadTooLarge as e:
+            # LocalStorage.upload wrote to a temporary file, which it has removed
+            return Response({"error": str(e)}, status=413)
+        return Response({"path": path})
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """
+    Lets a metrics scraper in with ``Authorization: Bearer <METRICS_TOKEN>``.
+    """
+
+    def authenticate(self, request):
+        token = settings.METRICS_TOKEN
+        if token and constant_time_compare(request.META.get("HTTP_AUTHORIZATION", ""), f"Bearer {token}"):
+            return AnonymousUser(), "metrics"
+        return None
+
+
+class CanReadMetrics(BasePermission):
+    def has_permission(self, request, view):
+        return request.auth == "metrics" or bool(request.user and request.user.is_staff)
+
+
+# Per-view request metrics in the Prometheus text format
+class MetricsView(APIView):
+    authentication_classes = [MetricsTokenAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    permission_classes = [CanReadMetrics]
+
+    def get(self, request):
+        return HttpResponse(
+            render_metrics({"signed_url_cache": signed_url_cache, "auth_user_cache": user_cache}),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
+def get_upload_session(request, upload_id):
+    try:
+        return UploadSession.objects.get(id=upload_id, user=request.user)
+    except UploadSession.DoesNotExist:
+        raise Http404("Upload session not found or unauthorized.")
+
+
+def upload_session_payload(session, received=None):
+    received = chunked_upload.received_chunks(session) if received is None else received
+    return {
+        "upload_id": session.id,
+        "name": session.name,
+        "size": session.size,
+        "chunk_size": session.chunk_size,
+        "total_chunks": session.total_chunks,
+        "received": received,
+        "missing": chunked_upload.missing_chunks(session, received),
+        "expires_at": session.expires_at,
+    }
+
+
+# Start a resumable upload
+class UploadSessionCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        name = request.data.get("name")
+        try:
+            size = int(request.data.get("size"))
+            chunk_size = int(request.data.get("chunk_size") or settings.UPLOAD_SESSION_CHUNK_SIZE)
+        except (TypeError, ValueError):
+            return Response({"error": "size and chunk_size must be integers."}, status=400)
+
+        if not name:
+            return Response({"error": "No file name provided."}, status=400)
+        if len(name) > MAX_NAME_LENGTH:
+            return Response({"error": NAME_TOO_LONG}, status=400)
+        if size < 0:
+            return Response({"error": "size must not be negative."}, status=400)
+        if not 0 < chunk_size <= settings.UPLOAD_SESSION_MAX_CHUNK_SIZE:
+            return Response({"error": f"chunk_size must be between 1 and {settings.UPLOAD_SESSION_MAX_CHUNK_SIZE}."}, status=400)
+        # Checked again when the upload is committed
+        if not has_room(request.user, size):
+            return Response({"error": str(QuotaExceeded())}, status=413)
+
+        session = UploadSession(
+            user=request.user,
+            name=name,
+            size=size,
+            chunk_size=chunk_size,
+            content_type=request.data.get("content_type") or "",
+            expires_at=chunked_upload.session_expiry(),
+        )
+        if session.total_chunks > settings.UPLOAD_SESSION_MAX_CHUNKS:
+            return Response({"error": f"Upload would need more than {settings.UPLOAD_SESSION_MAX_CHUNKS} chunks; use a larger chunk_size."}, status=400)
+        session.save()
+
+        return Response(upload_session_payload(session, received=[]), status=201)
+
+
+# Query or abort a resumable upload
+class UploadSessionDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id):
+        session = get_upload_session(request, upload_id)
+        return Response(upload_session_payload(session))
+
+    def delete(self, request, upload_id):
+        session = get_upload_session(request, upload_id)
+        session.delete()
+        chunked_upload.discard_session_files(upload_id)
+        return Response(status=204)
+
+
+# Upload one chunk (raw request body); chunks may arrive in any order and in parallel
+class UploadChunkView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, upload_id, index):
+        session = get_upload_session(request, upload_id)
+        if session.status != UploadSession.OPEN:
+            return Response({"error": "Upload is already being committed."}, status=409)
+        if index >= session.total_chunks:
+            return Response({"error": f"Chunk index must be below {session.total_chunks}."}, status=400)
+
+        try:
+            written = chunked_upload.write_chunk(session, index, request.stream)
+        except chunked_upload.ChunkSizeMismatch as e:
+            return Response({"error": str(e)}, status=400)
+
+        # Keep an active upload from being garbage-collected
+        UploadSession.objects.filter(id=session.id).update(expires_at=chunked_upload.session_expiry())
+
+        return Response({"index": index, "size": written})
+
+
+# Assemble the chunks and create the File
+class UploadSessionCommitView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        session = get_upload_session(request, upload_id)
+
+        missing = chunked_upload.missing_chunks(session)
+        if missing:
+            return Response({"error": "Upload is incomplete.", "missing": missing}, status=409)
+
+        # Only one commit may assemble the chunks
+        claimed = UploadSession.objects.filter(id=session.id, status=UploadSession.OPEN).update(status=UploadSession.COMMITTING)
+        if not claimed:
+            return Response({"error": "Upload is already being committed."}, status=409)
+
+        assembled = chunked_upload.open_assembled(session)
+        try:
+            file_instance = store_file(request.user, assembled, session.name, session.size)
+        except Exception as e:
+            UploadSession.objects.filter(id=session.id).update(status=UploadSession.OPEN)
+            if isinstance(e, QuotaExceeded):
+                return Response({"error": str(e)}, status=413)
+            raise
+        finally:
+            assembled.close()
+
+        session.delete()
+        chunked_upload.discard_session_files(upload_id)
+
+        return Response(file_payload(file_instance), status=201)
+
+
+# Get a pre-signed URL to upload one file straight to storage
+class DirectUploadCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        name = request.data.get("name")
+        try:
+            size = int(request.data.get("size"))
+        except (TypeError, ValueError):
+            return Response({"error": "size must be an integer."}, status=400)
+
+        if not name:
+            return Response({"error": "No file name provided."}, status=400)
+        if len(name) > MAX_NAME_LENGTH:
+            return Response({"error": NAME_TOO_LONG}, status=400)
+        if size < 0:
+            return Response({"error": "size must not be negative."}, status=400)
+        # Checked again when the upload is finalized
+        if not has_room(request.user, size):
+            return Response({"error": str(QuotaExceeded())}, status=413)
+
+        try:
+            upload, target = direct_upload.open_slot(request.user, name, size, request.data.get("content_type") or "")
+        except NotImplementedError:
+            return Response({"error": "The storage backend does not support direct uploads."}, status=501)
+
+        return Response({
+            "upload_id": upload.id,
+            "name": upload.name,
+            "size": upload.size,
+            "upload_url": request.build_absolute_uri(target["url"]),
+            "method": target["method"],
+            "headers": target["headers"],
+            "expires_at": upload.expires_at,
+        }, status=201)
+
+
+# Create the File once the client has uploaded to its slot
+class DirectUploadFinalizeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        try:
+            upload = DirectUpload.objects.get(id=upload_id, user=request.user)
+        except DirectUpload.DoesNotExist:
+            raise Http404("Upload not found or unauthorized.")
+
+        try:
+            file_instance = direct_upload.finalize(upload)
+        except direct_upload.UploadMissing as e:
+            return Response({"error": str(e)}, status=409)
+        except direct_upload.UploadSizeMismatch as e:
+            return Response({"error": str(e)}, status=400)
+        except direct_upload.UploadGone as e:
+            return Response({"error": str(e)}, status=410)
+        except QuotaExceeded as e:
+            return Response({"error": str(e)}, status=413)
+
+        return Response(file_payload(file_instance), status=201)
@@ -1,11 +1,157 @@
+"""
+The process's Supabase Storage client, created on first use.
+
+One httpx connection pool is shared by every thread of the process, so
+requests to the bucket reuse kept-alive connections instead of paying a TCP
+and TLS handshake each time. A forked child (gunicorn workers, for example)
+starts with no client and opens its own pool, never the parent's sockets.
+
+Under ASGI, ``lifespan`` gives the serving event loop an async client of its
+own, opened on first use and closed at shutdown. Other loops, like the one
+``async_to_sync`` starts for each call under WSGI, get none: their
+connections would die with them, so async callers use the sync pool instead.
+"""
+import asyncio
 import os
+import threading
+import weakref
 from dotenv import load_dotenv
-from supabase import create_client, Client
 
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+# Connections the pool keeps open, how long an idle one is kept, and request timeouts in seconds
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", 20))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", 30))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", 30))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", 5))
+
+_lock = threading.Lock()
+_http = None
+_storage = None
+# Serving event loop -> its httpx.AsyncClient, None until first used
+_async_http = weakref.WeakKeyDictionary()
+
+
+def storage_url() -> str:
+    return f"{SUPABASE_URL.rstrip('/')}/storage/v1/"
+
+
+def auth_headers() -> dict:
+    return {"apiKey": SUPABASE_SERVICE_KEY, "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}"}
+
+
+def http_options() -> dict:
+    """
+    Pool size and timeouts for an httpx client, sync or async.
+    """
+    import httpx
+    return {
+        "limits": httpx.Limits(
+            max_connections=SUPABASE_POOL_SIZE,
+            max_keepalive_connections=SUPABASE_POOL_SIZE,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT),
+        "follow_redirects": True,
+    }
+
+
+def http_client():
+    """
+    The shared httpx client. Carries no credentials, so it can also fetch signed URLs.
+    """
+    global _http
+    if _http is None:
+        with _lock:
+            if _http is None:
+                import httpx
+                _http = httpx.Client(**http_options())
+    return _http
+
+
+def storage_client():
+    """
+    The shared storage3 client, on the shared connection pool.
+    """
+    global _storage
+    if _storage is None:
+        if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
+            raise RuntimeError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set to use Supabase Storage.")
+        http = http_client()
+        with _lock:
+            if _storage is None:
+                # Imported here: processes that never touch the bucket skip the import
+                from storage3 import SyncStorageClient
+                _storage = SyncStorageClient(storage_url(), auth_headers(), http_client=http)
+    return _storage
+
+
+def close() -> None:
+    """
+    Closes the pool; the next use opens a new one.
+    """
+    global _http, _storage
+    with _lock:
+        http, _http, _storage = _http, None, None
+    if http is not None:
+        http.close()
+
+
+def async_http_client():
+    """
+    The running loop's async httpx client, or None if the loop does not serve ASGI.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_http:
+        return None
+    if _async_http[loop] is None:
+        import httpx
+        _async_http[loop] = httpx.AsyncClient(**http_options())
+    return _async_http[loop]
+
+
+async def aclose() -> None:
+    """
+    Closes the running loop's async client; the next use opens a new one.
+    """
+    loop = asyncio.get_running_loop()
+    http = _async_http.get(loop)
+    if http is not None:
+        _async_http[loop] = None
+        await http.aclose()
+
+
+def lifespan(application):
+    """
+    Wraps an ASGI application (Django answers no lifespan events) so that the
+    serving loop keeps an async client from startup until shutdown.
+    """
+    async def app(scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await application(scope, receive, send)
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                _async_http[asyncio.get_running_loop()] = None
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await aclose()
+                _async_http.pop(asyncio.get_running_loop(), None)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    return app
+
+
+def _forget_after_fork():
+    # The parent's connections must not be shared, nor its lock if another thread held it
+    global _lock, _http, _storage, _async_http
+    _lock = threading.Lock()
+    _http = _storage = None
+    _async_http = weakref.WeakKeyDictionary()
+
 
+os.register_at_fork(after_in_child=_forget_after_fork)
@@ -4,7 +4,9 @@ import logo from "../assets/logo.png";
 
 export default function Dashboard() {
   const [files, setFiles] = useState([]);
-  const [selectedFile, setSelectedFile] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [query, setQuery] = useState("");
+  const [selectedFiles, setSelectedFiles] = useState([]);
   const [error, setError] = useState(null);
   const [loading, setLoading] = useState(true);
   const [menuOpen, setMenuOpen] = useState(false);
@@ -32,16 +34,22 @@ export default function Dashboard() {
     }
   );
 
+  // Searching happens on the server; wait for typing to pause before asking
   useEffect(() => {
-    fetchFiles();
-  }, []);
+    const timer = setTimeout(() => fetchFiles(), query ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [query]);
 
-  const fetchFiles = async () => {
+  const fetchFiles = async (cursor = null) => {
     try {
-      setLoading(true);
+      if (!cursor) setLoading(true);
       setError(null);
-      const res = await axiosInstance.get("files/");
-      setFiles(res.data);
+      const params = cursor ? { cursor } : {};
+      const res = query.trim()
+        ? await axiosInstance.get("files/search/", { params: { ...params, q: query.trim() } })
+        : await axiosInstance.get("files/", { params });
+      setFiles(cursor ? [...files, ...res.data.results] : res.data.results);
+      setNextCursor(res.data.next_cursor);
     } catch {
       setError("Failed to load files.");
     } finally {
@@ -50,13 +58,19 @@ export default function Dashboard() {
   };
 
   const handleUpload = async () => {
-    if (!selectedFile) return;
+    if (!selectedFiles.length) return;
     const formData = new FormData();
-    formData.append("file", selectedFile);
+    // Several files go up in one batch request
+    const batch = selectedFiles.length > 1;
+    selectedFiles.forEach((file) => formData.append(batch ? "files" : "file", file));
     try {
-      await axiosInstance.post("upload/", formData);
-      setSelectedFile(null);
+      const res = await axiosInstance.post(batch ? "upload/batch/" : "upload/", formData);
+      setSelectedFiles([]);
       fetchFiles();
+      if (res.status === 207) {
+        const failed = res.data.results.filter((r) => r.error).map((r) => r.name);
+        setError(`Upload failed for: ${failed.join(", ")}`);
+      }
     } catch {
       setError("Upload failed.");
     }
@@ -150,14 +164,22 @@ export default function Dashboard() {
         <div className="flex flex-col sm:flex-row sm:justify-between sm:items-center mb-4 gap-4">
           <h2 className="text-xl font-semibold">Your Files</h2>
           <div className="flex flex-col sm:flex-row gap-2">
+            <input
+              type="search"
+              value={query}
+              onChange={(e) => setQuery(e.target.value)}
+              placeholder="Search files"
+              className="text-sm text-gray-200 bg-gray-800 border border-gray-600 rounded px-2 py-1"
+            />
             <input
               type="file"
-              onChange={(e) => setSelectedFile(e.target.files[0])}
+              multiple
+              onChange={(e) => setSelectedFiles(Array.from(e.target.files))}
               className="text-sm text-gray-200 bg-gray-800 border border-gray-600 rounded px-2 py-1"
             />
             <button
               onClick={handleUpload}
-              disabled={!selectedFile}
+              disabled={!selectedFiles.length}
               className="bg-blue-600 text-white px-4 py-2 rounded-lg hover:bg-blue-500 disabled:bg-gray-700"
             >
               Upload
@@ -180,7 +202,19 @@ export default function Dashboard() {
               {files.length > 0 ? (
                 files.map((file) => (
                   <tr key={file.id} className="border-b border-gray-700">
-                    <td className="px-4 sm:px-6 py-3 text-sm">{file.name}</td>
+                    <td className="px-4 sm:px-6 py-3 text-sm">
+                      <div className="flex items-center gap-3">
+                        {file.previews?.["256"] && (
+                          <img
+                            src={file.previews["256"]}
+                            alt=""
+                            loading="lazy"
+                            className="w-10 h-10 object-cover rounded"
+                          />
+                        )}
+                        {file.name}
+                      </div>
+                    </td>
                     <td className="px-4 sm:px-6 py-3 text-sm">{(file.size / 1024).toFixed(2)} KB</td>
                     <td className="px-4 sm:px-6 py-3 text-sm">{file.uploaded_at}</td>
                     <td className="px-4 sm:px-6 py-3 flex flex-wrap gap-2">
@@ -202,13 +236,23 @@ export default function Dashboard() {
               ) : (
                 <tr>
                   <td colSpan="4" className="text-center py-6 text-gray-400">
-                    No files uploaded yet
+                    {query ? "No matching files" : "No files uploaded yet"}
                   </td>
                 </tr>
               )}
             </tbody>
           </table>
         </div>
+        {nextCursor && (
+          <div className="flex justify-center mt-4">
+            <button
+              onClick={() => fetchFiles(nextCursor)}
+              className="bg-gray-700 text-white px-4 py-2 rounded-lg hover:bg-gray-600"
+            >
+              Load more
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );